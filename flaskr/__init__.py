@@ -1,3 +1,4 @@
+import atexit
 import os
 
 from flask import Flask,request
@@ -18,6 +19,77 @@ def create_app(test_config=None):
         # store the database in the instance folder
         DATABASE=os.path.join(app.instance_path, "flaskr.sqlite"),
         #DATABASE=os.path.join(app.root_path, '..', 'instance', 'flaskr.sqlite'),
+        # connections kept open by flaskr.db.ConnectionPool
+        DATABASE_POOL_SIZE=5,
+        # seconds a request waits for a free connection
+        DATABASE_POOL_TIMEOUT=30,
+        # run on every new connection
+        DATABASE_PRAGMAS={
+            "journal_mode": "WAL",  # readers don't block the writer
+            "synchronous": "NORMAL",  # safe with WAL, fsync on checkpoint only
+            "mmap_size": 256 * 1024 * 1024,
+            "cache_size": -16 * 1024,  # KiB
+            "busy_timeout": 5000,  # ms
+            "foreign_keys": "ON",
+        },
+        # seconds a search result count is reused on the index page
+        SEARCH_COUNT_TTL=30,
+        # seconds a user row is reused before it is read again
+        USER_CACHE_TTL=60,
+        # werkzeug.security method for new password hashes, older ones are
+        # replaced on login
+        PASSWORD_HASH_METHOD="scrypt",
+        # processes hashing passwords, 0 hashes in the request thread
+        PASSWORD_HASH_PROCESSES=2,
+        # hashes waiting or running before logins are turned away
+        PASSWORD_HASH_QUEUE=16,
+        # (attempts, seconds) allowed per username and per client address
+        LOGIN_RATE_LIMITS={"username": (10, 60), "ip": (50, 60)},
+        # "sqlite" keeps sessions in the database, "cookie" signs them
+        SESSION_BACKEND="sqlite",
+        # seconds a session is reused from memory before it is read again
+        SESSION_CACHE_TTL=5,
+        # seconds between deletes of expired sessions
+        SESSION_SWEEP_INTERVAL=3600,
+        # estimated size of the results kept by flaskr.cache.memoize
+        CACHE_MAX_BYTES=32 * 1024 * 1024,
+        # shared by the worker processes, None keeps results in memory only
+        CACHE_FOLDER=os.path.join(app.instance_path, "cache"),
+        # entries kept in the shared cache
+        CACHE_DISK_MAX_ENTRIES=100000,
+        # total size of the page bodies kept for anonymous visitors
+        RESPONSE_CACHE_MAX_BYTES=16 * 1024 * 1024,
+        # index pages with at least this many posts are streamed, None never
+        STREAM_MIN_PER_PAGE=20,
+        # posts listed in the RSS feed, its links use SERVER_NAME and
+        # PREFERRED_URL_SCHEME, set them to the public address
+        FEED_ITEM_COUNT=10,
+        # where uploaded images are stored, served as static/uploads
+        UPLOAD_FOLDER=os.path.join(app.root_path, "static", "uploads"),
+        # unreferenced uploads younger than this are not deleted yet
+        UPLOAD_GRACE_SECONDS=60,
+        # seconds a like or unlike may wait before it is written
+        LIKE_FLUSH_INTERVAL=1.0,
+        # buffered likes that trigger an early write
+        LIKE_BUFFER_MAX=1000,
+        # path prefix of the per-process journals of buffered likes,
+        # defaults to next to the database
+        LIKE_JOURNAL=None,
+        # time SQL, templates and Markdown per request, serve /metrics
+        INSTRUMENTATION=False,
+        # fraction of requests run under cProfile when instrumenting
+        PROFILE_SAMPLE_RATE=0.0,
+        # profiled requests slower than this many seconds are saved
+        PROFILE_SLOW_SECONDS=0.5,
+        PROFILE_FOLDER=os.path.join(app.instance_path, "profiles"),
+        # compiled templates shared by the workers, None to compile in memory
+        TEMPLATE_CACHE_FOLDER=os.path.join(app.instance_path, "jinja_cache"),
+        # processes rendering Markdown, 0 renders in the request thread
+        RENDER_PROCESSES=0,
+        # threads making thumbnails of uploaded images
+        IMAGE_WORKERS=2,
+        # bounding box of the thumbnails shown on the index page
+        THUMBNAIL_SIZE=(800, 400),
     )
 
     if test_config is None:
@@ -35,7 +107,7 @@ def create_app(test_config=None):
 
     @app.route("/hello")
     def hello():
-        print(f"This page's endpoint(*2) is {request.endpoint * 2 if request.endpoint else "no endpoint"}")  # → 输出: 'hello'
+        print(f"This page's endpoint(*2) is {request.endpoint * 2 if request.endpoint else 'no endpoint'}")  # → 输出: 'hello'
         return f"this is my first flask app. good start!!!! endpoint is {request.endpoint}"
     # ... 在 create_app 函数内部 ...
     
@@ -55,6 +127,26 @@ def create_app(test_config=None):
 
     db.init_app(app)
 
+    from . import storage
+
+    storage.init_app(app)
+
+    from . import transfer
+
+    transfer.init_app(app)
+
+    from . import templating
+
+    templating.init_app(app)
+
+    from . import render
+
+    render.init_app(app)
+
+    from . import sessions
+
+    sessions.init_app(app)
+
     # set up the debug toolbar
     '''如使用会报错，先禁用！！！
     try:
@@ -74,6 +166,8 @@ def create_app(test_config=None):
 
     app.register_blueprint(auth.bp)
     app.register_blueprint(blog.bp)
+    # g.user is loaded on first use
+    app.app_ctx_globals_class = auth.AppGlobals
 
     # make url_for('index') == url_for('blog.index')
     # in another app, you might define a separate main index here with
@@ -81,4 +175,40 @@ def create_app(test_config=None):
     # the tutorial the blog will be the main index
     app.add_url_rule("/", endpoint="index")
 
+    from . import metrics
+
+    metrics.init_app(app)
+
+    # the hasher's worker processes and the like buffer outlive the
+    # requests that started them
+    atexit.register(shutdown, app)
     return app
+
+
+def shutdown(app):
+    """Finish the background work of an app and release what it holds:
+    queued thumbnails, buffered likes, worker processes and database
+    connections. Runs when the interpreter exits, calling it earlier is
+    fine. Whatever is used afterwards is started again.
+    """
+    queue = app.extensions.pop("flaskr.image_queue", None)
+
+    if queue is not None:
+        queue.shutdown()
+
+    # flushing writes to the database, close the pool after
+    buffer = app.extensions.pop("flaskr.like_buffer", None)
+
+    if buffer is not None:
+        buffer.close()
+
+    for name in ("flaskr.render_pool", "flaskr.hasher"):
+        pool = app.extensions.pop(name, None)
+
+        if pool is not None:
+            pool.shutdown()
+
+    pool = app.extensions.pop("flaskr.db_pool", None)
+
+    if pool is not None:
+        pool.close()
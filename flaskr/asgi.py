@@ -0,0 +1,18 @@
+"""Serve the app from an ASGI server, e.g.::
+
+    $ uvicorn --factory flaskr.asgi:create_asgi_app
+
+The server's event loop handles the connections, so slow clients don't
+hold a worker thread while their request or response is transferred.
+The app itself runs in a pool of ``DATABASE_POOL_SIZE`` threads, one per
+pooled connection, so that many requests are served at once.
+"""
+from a2wsgi import WSGIMiddleware
+
+from . import create_app
+
+
+def create_asgi_app(test_config=None):
+    """:func:`flaskr.create_app` wrapped in an ASGI adapter."""
+    app = create_app(test_config)
+    return WSGIMiddleware(app, workers=app.config["DATABASE_POOL_SIZE"])
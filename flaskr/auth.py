@@ -5,19 +5,24 @@ from flask import Blueprint
 from flask import current_app
 from flask import flash
 from flask import g
+from flask import has_request_context
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import session
 from flask import url_for
-from werkzeug.security import check_password_hash
-from werkzeug.security import generate_password_hash
+from flask.ctx import _AppCtxGlobals
 
+from .cache import invalidate
+from .cache import memoize
 from .db import get_db
+from .passwords import HasherBusy
+from .passwords import get_hasher
+from .ratelimit import login_retry_after
+from .sessions import forget_user_snapshots
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
-
 def login_required(view):
     """View decorator that redirects anonymous users to the login page."""
 
@@ -32,25 +37,67 @@ def login_required(view):
     return wrapped_view
 
 
-@bp.before_app_request
+def busy(template):
+    """Ask the client to retry when too many passwords are being hashed."""
+    flash("The server is busy, please try again.")
+    return render_template(template), 503, {"Retry-After": "1"}
+
+
+class AppGlobals(_AppCtxGlobals):
+    """The app's ``g``. ``g.user`` is loaded the first time something
+    reads it, so requests that never look at the user (static files,
+    the feed) don't pay for it.
+    """
+
+    def __getattr__(self, name):
+        if name == "user":
+            self.user = load_logged_in_user()
+            return self.user
+
+        return super().__getattr__(name)
+
+
 def load_logged_in_user():
     """If a user id is stored in the session, load the user object from
-    the database into ``g.user``."""
+    the copy saved with a server side session, the user cache or the
+    database."""
+    if not has_request_context():
+        return None
+
     user_id = session.get("user_id")
     #获取当前函数名
 
     #func_name = inspect.currentframe().f_code.co_name
 
-    current_app.logger.info(f"触发钩子：{__name__} (user_id:{user_id})")
+    # only formatted when debug logging is on
+    current_app.logger.debug("触发钩子：%s (user_id:%s)", __name__, user_id)
+
+    if user_id is None:
+        return None
 
+    user = getattr(session, "user", None)
 
+    if user is not None and user["id"] == user_id:
+        return user
 
-    if user_id is None:
-        g.user = None
-    else:
-        g.user = (
-            get_db().execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
-        )
+    return get_user(user_id)
+
+
+@memoize("USER_CACHE_TTL", tags=lambda user_id: [f"user:{user_id}"], disk=False)
+def get_user(user_id):
+    """Get a user row by id, from the cache if it was loaded in the last
+    ``USER_CACHE_TTL`` seconds.
+    """
+    return get_db().execute("SELECT * FROM user WHERE id = ?", (user_id,)).fetchone()
+
+
+def invalidate_user(user_id):
+    """Forget the cached row of a user. Call this after changing the
+    user's row, e.g. their alias or password. Commits the current
+    transaction.
+    """
+    invalidate(f"user:{user_id}")
+    forget_user_snapshots(user_id)
 
 
 @bp.route("/register", methods=("GET", "POST"))
@@ -74,10 +121,15 @@ def register():
             error = "Password is required."
 
         if error is None:
+            try:
+                pwhash = get_hasher().hash(password)
+            except HasherBusy:
+                return busy("auth/register.html")
+
             try:
                 db.execute(
                     "INSERT INTO user (username, password) VALUES (?, ?)",
-                    (username, generate_password_hash(password)),
+                    (username, pwhash),
                 )
                 db.commit()
             except db.IntegrityError:
@@ -99,6 +151,16 @@ def login():
     if request.method == "POST":
         username = request.form["username"]
         password = request.form["password"]
+        retry_after = login_retry_after(username, request.remote_addr)
+
+        if retry_after:
+            flash(f"Too many login attempts, try again in {retry_after} seconds.")
+            return (
+                render_template("auth/login.html"),
+                429,
+                {"Retry-After": str(retry_after)},
+            )
+
         db = get_db()
         error = None
         user = db.execute(
@@ -107,8 +169,20 @@ def login():
 
         if user is None:
             error = "Incorrect username."
-        elif not check_password_hash(user["password"], password):
-            error = "Incorrect password."
+        else:
+            try:
+                matches, new_hash = get_hasher().check(user["password"], password)
+            except HasherBusy:
+                return busy("auth/login.html")
+
+            if not matches:
+                error = "Incorrect password."
+            elif new_hash is not None:
+                # the hash settings changed since the password was set
+                db.execute(
+                    "UPDATE user SET password = ? WHERE id = ?", (new_hash, user["id"])
+                )
+                invalidate_user(user["id"])
 
         if error is None:
             # store the user id in a new session and return to the index
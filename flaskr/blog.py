@@ -6,18 +6,53 @@ from flask import render_template
 from flask import request
 from flask import url_for
 from flask import current_app
+from markupsafe import Markup
+from markupsafe import escape
 from werkzeug.exceptions import abort
-from werkzeug.utils import secure_filename
-import markdown
-import os
+from werkzeug.http import http_date
+import math
+from datetime import datetime
 
 from .auth import login_required
+from .cache import memoize
 from .db import get_db
+from .feed import get_feed
+from .feed import refresh_feeds
+from .httpcache import conditional
+from .images import get_image_queue
+from .images import save_image
+from .likes import get_like_buffer
+from .render import get_post_html
+from .render import render_markdown
+from .render import prerender
+from .render import store_post_html
+from .storage import release_image
+from .templating import stream_page
 
 bp = Blueprint("blog", __name__)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
+# FTS5 wraps matched words in these, highlight_filter turns them into
+# <mark> after escaping the text
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+SNIPPET_SQL = (
+    f"snippet(post_fts, 1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 16) as snippet"
+)
+
+# comments shown per page on the detail page
+COMMENTS_PER_PAGE = 20
+
+# tag names looked up or created per statement
+TAG_BATCH_SIZE = 500
+
+# index page rows fetched and rendered at a time when streaming
+STREAM_BATCH_SIZE = 20
+
+# tags listed on the tag index
+TAG_INDEX_SIZE = 200
+
 def allowed_file(filename):
     return '.' in filename and \
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -26,28 +61,49 @@ def allowed_file(filename):
 # === 注册 markdown 过滤器 ===
 @bp.app_template_filter('markdown')
 def markdown_filter(text):
-    if text is None:
-        return ""
-    return markdown.markdown(
-        text,
-        extensions=[
-            'pymdownx.highlight',      # ✅ 核心高亮扩展
-            'pymdownx.superfences',     # ✅ 支持 ``` 代码块并触发高亮
-            'extra',
-            'nl2br'
-        ],
-        extension_configs={
-            'pymdownx.highlight': {
-                'css_class': 'highlight',  # CSS 类名
-                'use_pygments': True,      # 启用 Pygments
-                'linenums': False          # 不显示行号
-            }
-        }
+    return render_markdown(text)
+
+
+@bp.app_template_filter('body_html')
+def body_html_filter(post):
+    """Rendered body of a post row, served from the HTML cache."""
+    return get_post_html(post)[0]
+
+
+@bp.app_template_filter('excerpt_html')
+def excerpt_html_filter(post):
+    """Rendered index page excerpt of a post row."""
+    return get_post_html(post)[1]
+
+
+
+def site_version():
+    """Validator for pages listing posts, see :func:`.httpcache.conditional`."""
+    values = dict(
+        get_db().execute(
+            "SELECT name, value FROM counter"
+            " WHERE name IN ('content_version', 'content_modified')"
+        ).fetchall()
     )
+    return values["content_version"], values["content_modified"]
 
 
+def post_version(id):
+    """Validator for the detail page of a post. Buffered likes change
+    the page before they change the post's version, so there is none
+    while the post has some.
+    """
+    if get_like_buffer().has_pending(id):
+        return None
+
+    row = get_db().execute(
+        "SELECT version, modified FROM post WHERE id = ?", (id,)
+    ).fetchone()
+    return None if row is None else (row["version"], row["modified"])
+
 
 @bp.route("/")
+@conditional(site_version)
 def index():
     """Show all the posts, most recent first."""
     '''
@@ -81,8 +137,6 @@ def index():
     page = request.args.get('page', 1, type=int)
     if page < 1:
         page = 1
-    if page > 100:
-        page = 100
     per_page = request.args.get('per_page',5, type=int)
     if per_page < 1:
         per_page = 1
@@ -90,17 +144,29 @@ def index():
         per_page = 100
     tag_name = request.args.get('tag')
     search_query = request.args.get('q')
-    offset = (page - 1) * per_page#巧妙算法
-    
-    query_base = '''
-        SELECT p.id, p.title, p.body, p.created, p.author_id, p.image_path, u.username,
-         GROUP_CONCAT(t.name) as tags
-         FROM post p
-         JOIN user u ON p.author_id = u.id
-         LEFT JOIN post_tag pt ON p.id = pt.post_id
-         LEFT JOIN tag t ON pt.tag_id = t.id
+    match = fts_query(search_query)
+    # 游标分页：?after=<created,id> 或 ?before=<created,id>
+    # search results are ordered by relevance and use page numbers
+    after = None if match else parse_cursor(request.args.get('after'))
+    before = None if match or after else parse_cursor(request.args.get('before'))
+
+    # tags are fetched per selected post, so no GROUP BY over the whole
+    # filtered set is needed and ORDER BY can walk post_created_id
+    columns = '''
+        SELECT p.id, p.title, p.body, p.created, p.author_id, p.image_path,
+         p.thumb_path, p.webp_path, u.username,
+         (SELECT GROUP_CONCAT(t.name) FROM post_tag pt JOIN tag t ON pt.tag_id = t.id
+          WHERE pt.post_id = p.id) as tags
     '''
-    query_count = "SELECT count(DISTINCT p.id) FROM post p"
+    if match:
+        # search results come from the full text index, with a snippet
+        query_base = (
+            columns + ", " + SNIPPET_SQL +
+            " FROM post_fts JOIN post p ON p.id = post_fts.rowid"
+            " JOIN user u ON p.author_id = u.id"
+        )
+    else:
+        query_base = columns + " FROM post p JOIN user u ON p.author_id = u.id"
     params = []
     where_clauses = []
     
@@ -115,31 +181,233 @@ def index():
         where_clauses.append("p.id IN (SELECT pt.post_id FROM post_tag pt JOIN tag t ON pt.tag_id = t.id WHERE t.name = ?)")
         params.append(tag_name)
     
-    # 标题搜索
-    if search_query:
-        where_clauses.append("p.title like ?")
-        params.append(f"%{search_query}%")
+    # 全文搜索（标题和正文）
+    if match:
+        where_clauses.append("post_fts MATCH ?")
+        params.append(match)
     
-    # 拼接 WHERE子句
-    if where_clauses:
-        clauses_str = " WHERE " + " AND ".join(where_clauses)
-        query_base += clauses_str
-        query_count += clauses_str
-
     # 获取总数
-    total = db.execute(query_count, params).fetchone()[0]
+    total = count_posts(db, tag_name, match, where_clauses, params)
     total_pages = (total + per_page -1) // per_page
 
-    # 添加排序和分页
-    #query_base += " ORDER BY p.created DESC LIMIT ? OFFSET ?"
-    #必须加 GROUP BY p.id 否则 GROUP_CONCAT 会把所有帖子的标签拼成一行
-    query_base += "GROUP BY p.id ORDER BY p.created DESC LIMIT ? OFFSET ?" 
-    params.extend([per_page, offset])
-    posts = db.execute(query_base, params).fetchall()
-    return render_template("blog/index.html", posts=posts, page=page, total_pages=total_pages, current_tag=tag_name, search_query=search_query)
+    # seek past the cursor instead of skipping rows with OFFSET, so every
+    # page costs the same no matter how deep it is
+    order = "DESC"
+    if after:
+        where_clauses.append("(p.created, p.id) < (?, ?)")
+        params.extend(after)
+    elif before:
+        where_clauses.append("(p.created, p.id) > (?, ?)")
+        params.extend(before)
+        order = "ASC"
+
+    if where_clauses:
+        query_base += " WHERE " + " AND ".join(where_clauses)
+
+    # 多取一条用来判断是否还有下一页
+    if match:
+        query_base += " ORDER BY bm25(post_fts, 10.0, 1.0), p.id DESC LIMIT ?"
+    else:
+        query_base += f" ORDER BY p.created {order}, p.id {order} LIMIT ?"
+    params.append(per_page + 1)
+
+    if not (after or before):
+        # 没有游标时按页码跳转（第一版的 OFFSET 分页）
+        query_base += " OFFSET ?"
+        params.append((page - 1) * per_page)#巧妙算法
+
+    cursor = db.execute(query_base, params)
+    context = dict(
+        page=page,
+        per_page=per_page,
+        total_pages=total_pages,
+        current_tag=tag_name,
+        search_query=search_query,
+    )
+    min_per_page = current_app.config["STREAM_MIN_PER_PAGE"]
+
+    if min_per_page is not None and per_page >= min_per_page and not before:
+        # long pages are sent as they are rendered, rows are fetched and
+        # rendered a batch at a time
+        has_prev = after is not None or page > 1
+        posts = PostStream(db, cursor, per_page, has_prev, cursors=not match)
+        return stream_page("blog/index.html", posts=posts, pager=posts, **context)
+
+    posts = cursor.fetchall()
+    has_more = len(posts) > per_page
+    posts = posts[:per_page]
+
+    if before:
+        posts.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, after is not None or page > 1
+
+    next_cursor = prev_cursor = None
+    if not match:
+        # search results show a snippet instead of the excerpt
+        prerender(db, posts)
+        next_cursor = make_cursor(posts[-1]) if has_next and posts else None
+        prev_cursor = make_cursor(posts[0]) if has_prev and posts else None
+    return render_template(
+        "blog/index.html",
+        posts=posts,
+        pager=Pager(next_cursor, prev_cursor, has_next),
+        **context,
+    )
+
+
+class Pager:
+    """The links to the pages around an index page."""
+
+    __slots__ = ("next_cursor", "prev_cursor", "has_next")
+
+    def __init__(self, next_cursor, prev_cursor, has_next):
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.has_next = has_next
+
+
+class PostStream:
+    """The rows of an index page, fetched from ``cursor`` and rendered
+    :data:`STREAM_BATCH_SIZE` at a time while the page is sent. Only
+    once they have been iterated over are the links to the pages around
+    it known, as attributes like :class:`Pager`'s.
+
+    :param cursor: the page's query, which selects one extra row to tell
+        whether there is a next page
+    :param has_prev: whether there is a previous page
+    :param cursors: link the pages by position (``?after=``) rather
+        than by page number, and render the excerpts. Search results are
+        neither.
+    """
+
+    def __init__(self, db, cursor, per_page, has_prev, cursors=True):
+        self.db = db
+        self.cursor = cursor
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.cursors = cursors
+        self.has_next = False
+        self._first = self._last = None
+
+    def __iter__(self):
+        seen = 0
+
+        while seen < self.per_page:
+            size = min(STREAM_BATCH_SIZE, self.per_page - seen)
+            rows = self.cursor.fetchmany(size)
+
+            if not rows:
+                break
+
+            if self.cursors:
+                prerender(self.db, rows)
+
+            self._first = self._first or rows[0]
+            self._last = rows[-1]
+            seen += len(rows)
+            yield from rows
+
+        self.has_next = seen == self.per_page and self.cursor.fetchone() is not None
+
+    @property
+    def next_cursor(self):
+        if self.cursors and self.has_next and self._last is not None:
+            return make_cursor(self._last)
+
+        return None
+
+    @property
+    def prev_cursor(self):
+        if self.cursors and self.has_prev and self._first is not None:
+            return make_cursor(self._first)
+
+        return None
+
+
+def count_posts(db, tag_name, match, where_clauses, params):
+    """Number of posts matching the index filters.
+
+    The unfiltered and tag filtered totals are kept up to date by
+    triggers (see ``migrations/0003_counters.sql``). Search totals can't
+    be maintained, so they are counted and cached for
+    ``SEARCH_COUNT_TTL`` seconds.
+    """
+    if not match:
+        if tag_name:
+            row = db.execute(
+                "SELECT s.post_count FROM tag_stats s JOIN tag t ON s.tag_id = t.id"
+                " WHERE t.name = ?",
+                (tag_name,),
+            ).fetchone()
+        else:
+            row = db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()
+
+        return row[0] if row else 0
 
+    return count_matches(" AND ".join(where_clauses), tuple(params))
 
 
+@memoize("SEARCH_COUNT_TTL")
+def count_matches(where, params):
+    """Count the posts matching a search, see :func:`count_posts`."""
+    return (
+        get_db()
+        .execute(
+            "SELECT count(*) FROM post_fts JOIN post p ON p.id = post_fts.rowid"
+            " WHERE " + where,
+            params,
+        )
+        .fetchone()[0]
+    )
+
+
+def fts_query(search_query):
+    """Turn what the user typed into an FTS5 query. Every word must
+    appear in the title or body, as a whole word or a prefix. Words are
+    quoted so FTS5 operators and punctuation are matched literally.
+
+    :return: the ``MATCH`` argument, or ``None`` if there are no words
+    """
+    if not search_query:
+        return None
+
+    terms = ['"{}"*'.format(word.replace('"', '""')) for word in search_query.split()]
+    return " ".join(terms) or None
+
+
+@bp.app_template_filter('highlight')
+def highlight_filter(snippet):
+    """Escape a search snippet and mark the matched words."""
+    return Markup(
+        str(escape(snippet))
+        .replace(SNIPPET_START, "<mark>")
+        .replace(SNIPPET_END, "</mark>")
+    )
+
+
+def make_cursor(post):
+    """Encode the ``(created, id)`` position of a post for ``?after=``."""
+    return f"{post['created']},{post['id']}"
+
+
+def parse_cursor(value):
+    """Decode a cursor made by :func:`make_cursor`.
+
+    :return: ``(created, id)`` parameters for the seek condition, or
+        ``None`` if the value is missing or malformed
+    """
+    if not value:
+        return None
+
+    created, _, id = value.rpartition(",")
+
+    try:
+        return str(datetime.fromisoformat(created)), int(id)
+    except ValueError:
+        return None
+
 
 def get_post(id, check_author=True):
     """Get a post and its author by id.
@@ -176,11 +444,10 @@ def get_post(id, check_author=True):
     return post
 
 
-
 @bp.route("/<int:id>")
+@conditional(post_version)
 def detail(id):
     """show a post detail."""
-    post = get_post(id, check_author=False)
     #return render_template(url_for("detail.html"),post=post)
     '''
     render_template : 
@@ -197,33 +464,68 @@ def detail(id):
 
     '''
     db = get_db()
+    user_id = g.user['id'] if g.user else None
+
+    # like and comment totals are kept on the post by triggers, so the
+    # post, its tags and whether the user liked it are one lookup
+    post = db.execute(
+        "SELECT p.id, title, body, created, author_id, username, image_path,"
+        " like_count, comment_count,"
+        " (SELECT GROUP_CONCAT(t.name) FROM post_tag pt JOIN tag t ON pt.tag_id = t.id"
+        "  WHERE pt.post_id = p.id) as tags,"
+        " EXISTS (SELECT 1 FROM user_like WHERE user_id = ? AND post_id = p.id) as liked"
+        " FROM post p JOIN user u ON p.author_id = u.id"
+        " WHERE p.id = ?",
+        (user_id, id),
+    ).fetchone()
 
-    comments = db.execute(
-        "SELECT c.body, c.created, u.username"
-        " FROM comment c JOIN user u ON c.user_id = u.id"
-        " WHERE c.post_id = ? "
-        " ORDER BY c.created DESC ",
-        (id,)
-    ).fetchall()
+    if post is None:
+        abort(404, f"Post id {id} doesn't exist.")
 
-    like_count = db.execute(
-        "SELECT COUNT(*) FROM user_like WHERE post_id = ?",
-        (id,)
-    ).fetchone()[0]
-
-    liked = False
-    if g.user:
-        liked = db.execute(
-            "SELECT 1 FROM user_like WHERE user_id = ? and post_id = ?",
-            (g.user['id'], id)
-        ).fetchone() is not None
-    
-    return render_template("blog/detail.html", post=post, comments=comments, like_count=like_count, liked=liked)
+    prerender(db, [post])
+
+    # 评论分页：?comments_after=<created,id>
+    comments_after = parse_cursor(request.args.get('comments_after'))
+    query = (
+        "SELECT c.id, c.body, c.created, u.username"
+        " FROM comment c JOIN user u ON c.user_id = u.id"
+        " WHERE c.post_id = ?"
+    )
+    params = [id]
+
+    if comments_after:
+        query += " AND (c.created, c.id) < (?, ?)"
+        params.extend(comments_after)
+
+    query += " ORDER BY c.created DESC, c.id DESC LIMIT ?"
+    params.append(COMMENTS_PER_PAGE + 1)
+    comments = db.execute(query, params).fetchall()
+    more_comments = None
+
+    if len(comments) > COMMENTS_PER_PAGE:
+        comments = comments[:COMMENTS_PER_PAGE]
+        more_comments = make_cursor(comments[-1])
+
+    # likes that are buffered but not written yet
+    likes = get_like_buffer()
+    like_count = post['like_count'] + likes.pending_delta(id)
+    liked = likes.pending_liked(user_id, id) if user_id else None
+
+    return render_template(
+        "blog/detail.html",
+        post=post,
+        comments=comments,
+        like_count=like_count,
+        liked=bool(post['liked']) if liked is None else liked,
+        more_comments=more_comments,
+    )
 
 @bp.route("/<int:id>/like", methods=("POST",))
 @login_required
 def like(id):
     db = get_db()
+    # this write replaces any buffered like or unlike
+    get_like_buffer().discard(g.user['id'], id)
     db.execute(
         "INSERT OR IGNORE INTO user_like (user_id, post_id) VALUES (?, ?)",
         (g.user['id'], id)
@@ -235,6 +537,7 @@ def like(id):
 @login_required
 def unlike(id):
     db = get_db()
+    get_like_buffer().discard(g.user['id'], id)
     db.execute(
         "DELETE FROM user_like WHERE user_id = ? AND post_id = ?",
          (g.user['id'], id)
@@ -242,18 +545,102 @@ def unlike(id):
     db.commit()
     return redirect(url_for('blog.detail', id=id))
 
+@bp.route("/<int:id>/like.json", methods=("POST", "DELETE"))
+def like_json(id):
+    """Like (``POST``) or unlike (``DELETE``) a post and return the new
+    state as JSON, without rendering the detail page. The write is
+    buffered and batched with others, see :class:`.likes.LikeBuffer`.
+    """
+    if g.user is None:
+        return {"error": "Login required."}, 401
+
+    if get_db().execute("SELECT 1 FROM post WHERE id = ?", (id,)).fetchone() is None:
+        return {"error": f"Post id {id} doesn't exist."}, 404
+
+    liked, like_count = get_like_buffer().add(g.user['id'], id, request.method == "POST")
+    return {"post_id": id, "liked": liked, "like_count": like_count}
+
 @bp.route("/feed")
 def feed():
-    db = get_db()
-    posts = db.execute(
-        "SELECT p.id, p.title, p.body, p.created, p.author_id, u.username"
-        " FROM post p JOIN user u ON p.author_id = u.id"
-        " ORDER By created DESC LIMIT 10"
+    """Serve the stored RSS feed, of all posts or of ``?tag=``. The
+    document is built when posts change (see :mod:`.feed`), not here.
+    """
+    row = get_feed(get_db(), request.args.get('tag', ''))
+
+    if row is None:
+        abort(404, f"Tag {request.args['tag']} doesn't exist.")
+
+    headers = {
+        'ETag': f'"{row["etag"]}"',
+        'Last-Modified': http_date(row["modified"]),
+        'Cache-Control': 'no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+
+    if request.if_none_match.contains(row["etag"]):
+        return current_app.response_class(status=304, headers=headers)
+
+    if 'gzip' in request.accept_encodings:
+        body = row["gzip"]
+        headers['Content-Encoding'] = 'gzip'
+    else:
+        body = row["xml"]
+
+    return current_app.response_class(body, headers=headers, content_type='application/xml')
+
+
+# how the tag index is read for each ?sort=, each in the order of an
+# index. CROSS JOIN makes SQLite walk the index of its left table.
+TAG_INDEX_QUERIES = {
+    "popular": "tag_stats s JOIN tag t ON t.id = s.tag_id"
+    " WHERE s.post_count > 0 ORDER BY s.post_count DESC, s.tag_id",
+    "recent": "tag_stats s CROSS JOIN tag t ON t.id = s.tag_id"
+    " WHERE s.post_count > 0 ORDER BY s.last_used DESC, s.tag_id",
+    "name": "tag t CROSS JOIN tag_stats s ON s.tag_id = t.id"
+    " WHERE s.post_count > 0 ORDER BY t.name",
+}
+
+
+def get_tag_index(db, sort):
+    """The first ``TAG_INDEX_SIZE`` tags in ``sort`` order, from the
+    counts kept in ``tag_stats``.
+
+    :param sort: ``"popular"``, ``"recent"`` or ``"name"``, unknown
+        values are ``"popular"``
+    :return: ``(name, post_count, last_used)`` rows
+    """
+    query = TAG_INDEX_QUERIES.get(sort, TAG_INDEX_QUERIES["popular"])
+    return db.execute(
+        f"SELECT t.name, s.post_count, s.last_used FROM {query} LIMIT ?",
+        (TAG_INDEX_SIZE,),
     ).fetchall()
-    xml = render_template('blog/feed.xml', posts=posts)
-    response = current_app.make_response(xml)
-    response.headers['Content-Type'] = 'application/xml'
-    return response
+
+
+@bp.route("/tags")
+@conditional(site_version)
+def tags():
+    """Show the tag cloud, larger for tags with more posts."""
+    sort = request.args.get("sort", "popular")
+    rows = get_tag_index(get_db(), sort)
+    most = max((row["post_count"] for row in rows), default=1)
+    # 1 to 5, on a log scale since a few tags have most of the posts
+    scale = 4 / math.log(most) if most > 1 else 0
+    cloud = [(row, 1 + round(math.log(row["post_count"]) * scale)) for row in rows]
+    return render_template("blog/tags.html", cloud=cloud, sort=sort)
+
+
+@bp.route("/tags.json")
+@conditional(site_version)
+def tags_json():
+    """The tag index as JSON, sorted by ``?sort=`` like :func:`tags`."""
+    return {
+        "tags": [
+            {"name": name, "post_count": post_count, "last_used": last_used}
+            for name, post_count, last_used in get_tag_index(
+                get_db(), request.args.get("sort", "popular")
+            )
+        ]
+    }
 
 
 
@@ -279,20 +666,98 @@ def comment(id):
     return redirect(url_for("blog.detail",id=id))
 
 def save_tags(db, post_id, tags_str):#接收db参数方便在调用处关闭连接且节约、连贯。是工具函数区别于路由函数（视图函数）
-    if not tags_str:
-        return
+    """Set the tags of a post to the comma separated ``tags_str``.
+
+    Only the difference to the post's current tags is written, with a
+    fixed number of statements however many tags there are. Tags no post
+    has anymore are deleted.
+    """
     # 分割标签并去重
-    tag_names = set(t.strip() for t in tags_str.split(",") if t.strip())
-    for tag_name in tag_names:
-        # 查找或创建标签，返回ID
-        tag = db.execute('SELECT id FROM tag WHERE name = ?',(tag_name,)).fetchone()
-        if not tag:
-            cursor  = db.execute("INSERT INTO tag (name) VALUES (?)", (tag_name,))
-            tag_id = cursor.lastrowid
-        else:
-            tag_id = tag['id']
-        # 关联文章和标签
-        db.execute("INSERT OR IGNORE INTO post_tag (post_id, tag_id) VALUES (?, ?)", (post_id, tag_id))
+    tag_names = set(t.strip() for t in (tags_str or "").split(",") if t.strip())
+    # the rows of the post reference existing tags, so their ids are
+    # current inside this transaction
+    current = dict(
+        db.execute(
+            "SELECT t.name, t.id FROM post_tag pt JOIN tag t ON pt.tag_id = t.id"
+            " WHERE pt.post_id = ?",
+            (post_id,),
+        ).fetchall()
+    )
+
+    if tag_names == current.keys():
+        return
+
+    # 查找或创建标签，返回ID
+    new_ids = get_tag_ids(db, tag_names - current.keys())
+    removed = [current[name] for name in current.keys() - tag_names]
+
+    if removed:
+        db.executemany(
+            "DELETE FROM post_tag WHERE post_id = ? AND tag_id = ?",
+            [(post_id, tag_id) for tag_id in removed],
+        )
+
+    # 关联文章和标签
+    if new_ids:
+        db.executemany(
+            "INSERT OR IGNORE INTO post_tag (post_id, tag_id) VALUES (?, ?)",
+            [(post_id, tag_id) for tag_id in new_ids.values()],
+        )
+
+    delete_orphan_tags(db, removed)
+
+
+def delete_orphan_tags(db, tag_ids):
+    """Delete those of ``tag_ids`` that no post has anymore, with their
+    stats. Does not commit.
+    """
+    tag_ids = list(tag_ids)
+
+    for start in range(0, len(tag_ids), TAG_BATCH_SIZE):
+        batch = tag_ids[start:start + TAG_BATCH_SIZE]
+        marks = ", ".join("?" * len(batch))
+        orphans = [
+            row[0]
+            for row in db.execute(
+                f"SELECT tag_id FROM tag_stats WHERE tag_id IN ({marks})"
+                " AND post_count = 0",
+                batch,
+            )
+        ]
+
+        if not orphans:
+            continue
+
+        marks = ", ".join("?" * len(orphans))
+        db.execute(f"DELETE FROM tag_stats WHERE tag_id IN ({marks})", orphans)
+        db.execute(f"DELETE FROM tag WHERE id IN ({marks})", orphans)
+
+
+def get_tag_ids(db, tag_names):
+    """Map tag names to ids, creating the tags that don't exist yet.
+
+    The ids are looked up by the insert itself, inside the caller's
+    transaction. Another process may delete a tag at any time, so ids
+    are not kept across transactions.
+
+    :return: ``{name: id}``
+    """
+    tag_names = list(tag_names)
+    ids = {}
+
+    for start in range(0, len(tag_names), TAG_BATCH_SIZE):
+        batch = tag_names[start:start + TAG_BATCH_SIZE]
+        # the no-op update makes existing tags return their ids as well
+        ids.update(
+            db.execute(
+                f"INSERT INTO tag (name) VALUES {', '.join(['(?)'] * len(batch))}"
+                " ON CONFLICT (name) DO UPDATE SET name = excluded.name"
+                " RETURNING name, id",
+                batch,
+            ).fetchall()
+        )
+
+    return ids
 
 
 @bp.route("/create", methods=("GET", "POST"))
@@ -314,13 +779,7 @@ def create():
             if current_app.static_folder is None:
                 error = "System Error: Static folder not configured."
             else:
-                filename = secure_filename(image.filename)
-                #确保存储目录存在
-                upload_folder = os.path.join(current_app.static_folder, 'uploads')
-                os.makedirs(upload_folder, exist_ok=True)
-
-                image.save(os.path.join(upload_folder, filename))
-                image_path = f"uploads/{filename}"
+                image_path = save_image(image)
 
         if error is not None:
             flash(error)
@@ -332,7 +791,13 @@ def create():
             )
             post_id = cursor.lastrowid#由游标方法获取id
             save_tags(db, post_id, tags)
+            store_post_html(db, post_id, body)
+            db.commit()
+            refresh_feeds(db)
             db.commit()
+            if image_path:
+                # thumbnails are made in the background
+                get_image_queue().submit(post_id, image_path)
             return redirect(url_for("blog.index"))
 
     return render_template("blog/create.html")
@@ -349,6 +814,7 @@ def update(id):
         body = request.form["body"]
         tags = request.form.get("tags")
         image = request.files.get("image")
+        image_path = None
         error = None
 
         if not title:
@@ -362,22 +828,26 @@ def update(id):
                 if current_app.static_folder is None:
                     Error = "System Error: Static folder not configured."
                 else:
-                    filename = secure_filename(image.filename)
-                    upload_folder = os.path.join(current_app.static_folder, 'uploads')
-                    os.makedirs(upload_folder, exist_ok=True)
-                    image.save(os.path.join(upload_folder, filename))
-                    image_path = f"uploads/{filename}"
+                    image_path = save_image(image)
+                    # the old thumbnails belong to the old image
                     db.execute(
-                        "UPDATE post SET title = ?, body = ?, image_path = ? WHERE id = ?",
+                        "UPDATE post SET title = ?, body = ?, image_path = ?,"
+                        " thumb_path = NULL, webp_path = NULL WHERE id = ?",
                         (title, body, image_path, id)
                     )
             else:
                 db.execute(
                     "UPDATE post SET title = ?, body = ? WHERE id = ?", (title, body, id)
                 )
-            db.execute("DELETE FROM post_tag WHERE post_id = ?", (id,))
             save_tags(db, id, tags)
+            store_post_html(db, id, body)
+            db.commit()
+            refresh_feeds(db)
             db.commit()
+            if image_path:
+                get_image_queue().submit(id, image_path)
+                if post['image_path'] != image_path:
+                    release_image(db, post['image_path'])
             return redirect(url_for("blog.index"))
         '''
         db = get_db()
@@ -398,7 +868,7 @@ def delete(id):
     Ensures that the post exists and that the logged in user is the
     author of the post.
     """
-    get_post(id)#**“副作用调用” (Call for Side Effects)
+    post = get_post(id)#**“副作用调用” (Call for Side Effects)，同时取得图片路径
     db = get_db()
     '''
     在这里，我们调用 get_post(id) 不是为了要它的返回值（那个帖子对象），而是为了利用它的“副作用”——也就是它的检查机制。
@@ -416,8 +886,19 @@ def delete(id):
 
     '''
 
+    tag_ids = [
+        row[0] for row in db.execute("SELECT tag_id FROM post_tag WHERE post_id = ?", (id,))
+    ]
+
+    # foreign keys are enforced, remove the rows that reference the post
+    for table in ("post_tag", "post_html", "comment", "user_like"):
+        db.execute(f"DELETE FROM {table} WHERE post_id = ?", (id,))
     db.execute("DELETE FROM post WHERE id = ?", (id,))
+    delete_orphan_tags(db, tag_ids)
+    db.commit()
+    refresh_feeds(db)
     db.commit()
+    release_image(db, post['image_path'])
     return redirect(url_for("blog.index"))
 
 
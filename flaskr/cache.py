@@ -0,0 +1,353 @@
+"""Memoize expensive helpers, e.g. the user row every request loads::
+
+    @memoize("USER_CACHE_TTL", tags=lambda user_id: [f"user:{user_id}"])
+    def get_user(user_id):
+        ...
+
+    # in the write handlers
+    invalidate(f"user:{id}")
+
+Results are kept in an in-process LRU bounded by ``CACHE_MAX_BYTES``, and
+with ``CACHE_FOLDER`` set, in a SQLite file there too, which the worker
+processes using the same database share. Invalidating a tag drops the
+entries of this process and of the shared file. Other processes keep
+their own copies until they expire, so TTLs bound how stale a result
+may be.
+"""
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+# seconds between deletes of expired entries from the disk tier
+DISK_SWEEP_INTERVAL = 60
+
+_MISSING = object()
+_cache_lock = threading.Lock()
+
+
+def sizeof(value):
+    """Estimate the memory used by ``value`` and what it contains."""
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        size += sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset, sqlite3.Row)):
+        size += sum(sizeof(item) for item in value)
+
+    return size
+
+
+class DiskCache:
+    """Pickled entries in a SQLite file, shared by the processes that
+    open the same file. Each thread has its own connection.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._next_sweep = 0
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.path, isolation_level=None)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = OFF")
+            db.execute("PRAGMA busy_timeout = 5000")
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS entry ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS entry_expires ON entry (expires);"
+                "CREATE TABLE IF NOT EXISTS entry_tag ("
+                " tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key))"
+                " WITHOUT ROWID;"
+            )
+
+        return db
+
+    def get(self, key):
+        """:return: ``(value, seconds left, tags)`` or ``None``"""
+        now = time.time()
+        row = (
+            self._connect()
+            .execute(
+                "SELECT value, expires FROM entry WHERE key = ? AND expires > ?",
+                (key, now),
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return None
+
+        value, tags = pickle.loads(row[0])
+        return value, row[1] - now, tags
+
+    def set(self, key, value, ttl, tags):
+        now = time.time()
+        db = self._connect()
+
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                "INSERT OR REPLACE INTO entry (key, value, expires) VALUES (?, ?, ?)",
+                (key, pickle.dumps((value, tags), pickle.HIGHEST_PROTOCOL), now + ttl),
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO entry_tag (tag, key) VALUES (?, ?)",
+                [(tag, key) for tag in tags],
+            )
+
+            if now >= self._next_sweep:
+                self._next_sweep = now + DISK_SWEEP_INTERVAL
+                self._sweep(db, now)
+
+    def _sweep(self, db, now):
+        db.execute(
+            "DELETE FROM entry WHERE expires <= ? OR key NOT IN"
+            " (SELECT key FROM entry ORDER BY expires DESC LIMIT ?)",
+            (now, self.max_entries),
+        )
+        db.execute("DELETE FROM entry_tag WHERE key NOT IN (SELECT key FROM entry)")
+
+    def invalidate(self, tags):
+        db = self._connect()
+        marks = ", ".join("?" * len(tags))
+
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute(
+                f"DELETE FROM entry WHERE key IN"
+                f" (SELECT key FROM entry_tag WHERE tag IN ({marks}))",
+                tags,
+            )
+            db.execute(f"DELETE FROM entry_tag WHERE tag IN ({marks})", tags)
+
+    def clear(self):
+        db = self._connect()
+
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM entry")
+            db.execute("DELETE FROM entry_tag")
+
+
+class Cache:
+    """A thread safe LRU whose entries expire after a TTL, bounded by the
+    estimated size of what it holds, in front of an optional
+    :class:`DiskCache`.
+
+    Entries can be tagged, e.g. with the post they were built from, and
+    all entries with a tag dropped at once with :meth:`invalidate`.
+    """
+
+    def __init__(self, max_bytes, disk=None):
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.size = 0
+        # key -> (expires, size, tags, value)
+        self._data = OrderedDict()
+        # tag -> keys
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            (
+                "hits",
+                "misses",
+                "disk_hits",
+                "evictions",
+                "expirations",
+                "invalidations",
+            ),
+            0,
+        )
+
+    def get(self, key, disk=True):
+        """:param disk: look in the disk tier as well on a miss
+        :return: the value, or ``_MISSING``
+        """
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[3]
+
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+        if disk and self.disk is not None:
+            found = self.disk.get(repr(key))
+
+            if found is not None:
+                value, ttl, tags = found
+
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+
+                self._store(key, value, ttl, tags)
+                return value
+
+        with self._lock:
+            self._stats["misses"] += 1
+
+        return _MISSING
+
+    def set(self, key, value, ttl, tags=(), disk=True):
+        """:param disk: store in the disk tier as well, ``value`` must be
+            picklable
+        """
+        if ttl <= 0:
+            return
+
+        self._store(key, value, ttl, tags)
+
+        if disk and self.disk is not None:
+            self.disk.set(repr(key), value, ttl, tags)
+
+    def _store(self, key, value, ttl, tags):
+        size = sizeof(value)
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (time.monotonic() + ttl, size, tags, value)
+            self.size += size
+
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._data)))
+                self._stats["evictions"] += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+
+        if entry is None:
+            return
+
+        self.size -= entry[1]
+
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+
+            if keys is not None:
+                keys.discard(key)
+
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags):
+        """Drop the entries with any of ``tags``."""
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self._stats["invalidations"] += 1
+
+        if self.disk is not None and tags:
+            self.disk.invalidate(tags)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.size = 0
+
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        """Usage counters of the cache, for monitoring."""
+        with self._lock:
+            return {**self._stats, "entries": len(self._data), "size": self.size}
+
+
+def get_cache():
+    """Get the cache of the current app, creating it on first use from
+    the ``CACHE_*`` config.
+    """
+    cache = current_app.extensions.get("flaskr.cache")
+
+    if cache is None:
+        with _cache_lock:
+            cache = current_app.extensions.get("flaskr.cache")
+
+            if cache is None:
+                config = current_app.config
+                disk = None
+
+                if config["CACHE_FOLDER"]:
+                    os.makedirs(config["CACHE_FOLDER"], exist_ok=True)
+                    # results of another database must not be found
+                    name = hashlib.sha1(config["DATABASE"].encode()).hexdigest()[:16]
+                    disk = DiskCache(
+                        os.path.join(config["CACHE_FOLDER"], f"cache-{name}.sqlite"),
+                        config["CACHE_DISK_MAX_ENTRIES"],
+                    )
+
+                cache = current_app.extensions["flaskr.cache"] = Cache(
+                    config["CACHE_MAX_BYTES"], disk
+                )
+
+    return cache
+
+
+def invalidate(*tags):
+    """Drop the cached results tagged with any of ``tags``."""
+    get_cache().invalidate(*tags)
+
+
+def memoize(ttl, tags=None, disk=True):
+    """Decorate a function of hashable arguments so its results are
+    cached per app. ``None`` results are cached as well.
+
+    :param ttl: seconds a result is reused, or the name of the config
+        key holding them. 0 disables the cache.
+    :param tags: called with the function's arguments, returns the tags
+        of the result
+    :param disk: also keep the results in the shared disk tier, they
+        must be picklable
+    """
+
+    def decorator(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            seconds = current_app.config[ttl] if isinstance(ttl, str) else ttl
+
+            if not seconds:
+                return func(*args)
+
+            cache = get_cache()
+            key = (name, args)
+            value = cache.get(key, disk)
+
+            if value is _MISSING:
+                value = func(*args)
+                entry_tags = tuple(tags(*args)) if tags is not None else ()
+                cache.set(key, value, seconds, entry_tags, disk)
+
+            return value
+
+        wrapper.uncached = func
+        return wrapper
+
+    return decorator
+
@@ -1,41 +1,394 @@
+import os
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
 import click
 from flask import current_app
 from flask import g
+from flask import has_app_context
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became free within the pool's timeout."""
+
+
+class QueryRecord:
+    """Duration in seconds and row count of one statement."""
+
+    __slots__ = ("sql", "duration", "rows")
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.duration = 0.0
+        self.rows = 0
+
+
+class TimedCursor(sqlite3.Cursor):
+    """A cursor that records each statement it runs in ``g.queries``.
+    The time and rows of fetching the results are added to the record.
+    """
+
+    _record = None
+
+    def _timed(self, method, sql, *args):
+        record = QueryRecord(sql)
+        start = time.perf_counter()
+
+        try:
+            return method(self, sql, *args)
+        finally:
+            record.duration = time.perf_counter() - start
+            # only known for writes, rows read are counted while fetching
+            record.rows = max(self.rowcount, 0)
+            self._record = record
+
+            if has_app_context():
+                g.setdefault("queries", []).append(record)
+
+    def _fetched(self, start, rows):
+        if self._record is not None:
+            self._record.duration += time.perf_counter() - start
+            self._record.rows += rows
+
+    def execute(self, sql, parameters=()):
+        return self._timed(sqlite3.Cursor.execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(sqlite3.Cursor.executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(sqlite3.Cursor.executescript, sql_script)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0)
+            raise
+
+        self._fetched(start, 1)
+        return row
+
+
+class TimedConnection(sqlite3.Connection):
+    """A connection whose statements are timed, see :class:`TimedCursor`.
+    Used by the pool when ``INSTRUMENTATION`` is on.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # the built in shortcuts don't go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+class ConnectionPool:
+    """A thread safe pool of connections to one SQLite database.
+
+    Connections are opened on demand up to ``size`` and configured once
+    with ``pragmas`` when they are opened. When all of them are in use,
+    :meth:`acquire` waits for one to be released.
+
+    :param database: path to the database file
+    :param size: maximum number of open connections
+    :param timeout: seconds to wait for a free connection
+    :param pragmas: ``{name: value}`` run as ``PRAGMA name = value`` on
+        every new connection
+    :param factory: the connection class, e.g. :class:`TimedConnection`
+    """
+
+    def __init__(
+        self, database, size=5, timeout=30.0, pragmas=None, factory=sqlite3.Connection
+    ):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self.factory = factory
+        self._idle = []
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+
+    def connect(self):
+        """Open and configure a new connection."""
+        db = sqlite3.connect(
+            self.database,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        db.row_factory = sqlite3.Row
+
+        for name, value in self.pragmas.items():
+            db.execute(f"PRAGMA {name} = {value}")
+
+        return db
+
+    def acquire(self):
+        """Take an idle connection, open a new one if the pool is not
+        full, or wait for one to be released.
+
+        :raise PoolTimeout: if nothing was released within ``timeout``
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The connection pool is closed.")
+
+            self._acquired += 1
+
+            if self._idle:
+                return self._idle.pop()
+
+            if self._open < self.size:
+                self._open += 1
+                reserved = True
+            else:
+                reserved = False
+                start = time.perf_counter()
+                self._waits += 1
+                ready = self._cond.wait_for(
+                    lambda: self._idle or self._open < self.size or self._closed,
+                    self.timeout,
+                )
+                waited = time.perf_counter() - start
+                self._wait_time += waited
+                self._max_wait = max(self._max_wait, waited)
+
+                if not ready or self._closed:
+                    raise PoolTimeout(
+                        f"No database connection was free after {self.timeout}s."
+                    )
+
+                if self._idle:
+                    return self._idle.pop()
+
+                self._open += 1
+                reserved = True
+
+        # connect outside the lock, other threads can use idle connections
+        try:
+            return self.connect()
+        except Exception:
+            if reserved:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+            raise
+
+    def release(self, db):
+        """Give a connection back. Work the borrower did not commit is
+        rolled back so the next borrower starts clean.
+        """
+        try:
+            if db.in_transaction:
+                db.rollback()
+        except sqlite3.Error:
+            # the connection is broken, replace it with a new one later
+            self._discard(db)
+            return
+
+        with self._cond:
+            if self._closed:
+                self._open -= 1
+                db.close()
+            else:
+                self._idle.append(db)
+
+            self._cond.notify()
+
+    def _discard(self, db):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+        try:
+            db.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        """Close the idle connections. Connections still in use are
+        closed when they are released.
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+
+        for db in idle:
+            db.close()
+
+    def stats(self):
+        """Usage counters of the pool, for monitoring."""
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "acquired": self._acquired,
+                "waits": self._waits,
+                "wait_time": self._wait_time,
+                "max_wait": self._max_wait,
+            }
+
+
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Get the connection pool of the current app, creating it on first
+    use from the ``DATABASE*`` config.
+    """
+    pool = current_app.extensions.get("flaskr.db_pool")
+
+    if pool is None:
+        with _pool_lock:
+            pool = current_app.extensions.get("flaskr.db_pool")
+
+            if pool is None:
+                config = current_app.config
+                pool = current_app.extensions["flaskr.db_pool"] = ConnectionPool(
+                    config["DATABASE"],
+                    size=config["DATABASE_POOL_SIZE"],
+                    timeout=config["DATABASE_POOL_TIMEOUT"],
+                    pragmas=config["DATABASE_PRAGMAS"],
+                    factory=(
+                        TimedConnection
+                        if config["INSTRUMENTATION"]
+                        else sqlite3.Connection
+                    ),
+                )
+
+    return pool
 
 
 def get_db():
     """Connect to the application's configured database. The connection
     is unique for each request and will be reused if this is called
-    again.
+    again. It is borrowed from the app's :class:`ConnectionPool`.
     """
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"], detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+        g.db = get_pool().acquire()
 
     return g.db
 
 
 def close_db(e=None):
-    """If this request connected to the database, close the
-    connection.
+    """If this request connected to the database, return the
+    connection to the pool.
     """
     db = g.pop("db", None)
 
     if db is not None:
-        db.close()
+        get_pool().release(db)
 
 
 def init_db():
     """Clear existing data and create new tables."""
     db = get_db()
+    # DROP TABLE would be refused while rows reference each other
+    foreign_keys = db.execute("PRAGMA foreign_keys").fetchone()[0]
+    db.execute("PRAGMA foreign_keys = OFF")
 
-    with current_app.open_resource("schema.sql") as f:
-        db.executescript(f.read().decode("utf8"))
+    try:
+        with current_app.open_resource("schema.sql") as f:
+            db.executescript(f.read().decode("utf8"))
+    finally:
+        db.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+
+    migrate_db()
+
+
+def get_migrations():
+    """List the ``(version, filename)`` of every migration script, in
+    the order they must be applied. Scripts live in ``migrations/`` and
+    are named ``<version>_<description>.sql``.
+    """
+    folder = os.path.join(current_app.root_path, "migrations")
+    migrations = []
+
+    for filename in os.listdir(folder):
+        version, _, rest = filename.partition("_")
+
+        if rest.endswith(".sql") and version.isdigit():
+            migrations.append((int(version), filename))
+
+    return sorted(migrations)
+
+
+def migrate_db():
+    """Apply the migrations newer than the database's ``user_version``,
+    then restore what an unfinished import set aside, see
+    :func:`.transfer.deferred_indexes`.
+
+    Each script runs in its own transaction together with the version
+    bump, so a failed script leaves the database at the last good
+    version. Existing data is kept.
+
+    :return: the versions that were applied
+    """
+    db = get_db()
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+
+    for version, filename in get_migrations():
+        if version <= current:
+            continue
+
+        with current_app.open_resource(f"migrations/{filename}") as f:
+            script = f.read().decode("utf8")
+
+        try:
+            db.executescript(
+                f"BEGIN;\n{script}\nPRAGMA user_version = {version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+        applied.append(version)
+
+    # an import that died leaves the indexes of the post tables set aside
+    from .transfer import restore_indexes
+
+    restore_indexes(db)
+    return applied
 
 
 @click.command("init-db")
@@ -45,6 +398,17 @@ def init_db_command():
     click.echo("Initialized the database.")
 
 
+@click.command("migrate-db")
+def migrate_db_command():
+    """Bring an existing database up to date without losing data."""
+    applied = migrate_db()
+
+    if applied:
+        click.echo(f"Applied migrations {', '.join(map(str, applied))}.")
+    else:
+        click.echo("The database is up to date.")
+
+
 sqlite3.register_converter("timestamp", lambda v: datetime.fromisoformat(v.decode()))
 
 
@@ -54,3 +418,4 @@ def init_app(app):
     """
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
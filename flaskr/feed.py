@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import time
+
+from flask import current_app
+from flask import render_template
+
+
+def build_feed(db, tag=""):
+    """Render the RSS document of the latest posts, optionally only
+    those with a tag, and store it with its gzip encoding and ETag.
+
+    Absolute links use the configured ``SERVER_NAME`` and
+    ``PREFERRED_URL_SCHEME``. Does not commit, the caller owns the
+    transaction.
+
+    :param tag: tag name, or ``""`` for the feed of all posts
+    :return: the stored ``feed`` row
+    """
+    query = (
+        "SELECT p.id, p.title, p.body, p.created, p.author_id, u.username"
+        " FROM post p JOIN user u ON p.author_id = u.id"
+    )
+    params = []
+
+    if tag:
+        query += (
+            " WHERE p.id IN (SELECT pt.post_id FROM post_tag pt"
+            " JOIN tag t ON pt.tag_id = t.id WHERE t.name = ?)"
+        )
+        params.append(tag)
+
+    query += " ORDER BY p.created DESC, p.id DESC LIMIT ?"
+    params.append(current_app.config["FEED_ITEM_COUNT"])
+    posts = db.execute(query, params).fetchall()
+
+    # the links are built from SERVER_NAME and PREFERRED_URL_SCHEME,
+    # not from the host of the request that happened to write a post
+    with current_app.test_request_context():
+        xml = render_template("blog/feed.xml", posts=posts, tag=tag)
+
+    xml = xml.encode("utf8")
+    row = {
+        "tag": tag,
+        "xml": xml,
+        # mtime=0 so the same document always compresses to the same bytes
+        "gzip": gzip.compress(xml, mtime=0),
+        "etag": hashlib.sha1(xml).hexdigest(),
+        "modified": int(time.time()),
+    }
+    db.execute(
+        "INSERT OR REPLACE INTO feed (tag, xml, gzip, etag, modified)"
+        " VALUES (:tag, :xml, :gzip, :etag, :modified)",
+        row,
+    )
+    return row
+
+
+def refresh_feeds(db):
+    """Rebuild the feeds after posts were written. The feed of all
+    posts is built right away, tag feeds are dropped and built again
+    the next time they are requested.
+    """
+    db.execute("DELETE FROM feed WHERE tag != ''")
+    build_feed(db)
+
+
+def get_feed(db, tag=""):
+    """Get a stored feed, building it if there is none yet.
+
+    :return: the feed row, or ``None`` for a tag that doesn't exist,
+        for which nothing is stored
+    """
+    row = db.execute("SELECT * FROM feed WHERE tag = ?", (tag,)).fetchone()
+
+    if row is None:
+        if tag and not db.execute(
+            "SELECT 1 FROM tag WHERE name = ?", (tag,)
+        ).fetchone():
+            return None
+
+        row = build_feed(db, tag)
+        db.commit()
+
+    return row
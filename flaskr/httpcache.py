@@ -0,0 +1,158 @@
+import functools
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from datetime import timezone
+
+from flask import current_app
+from flask import request
+from flask import session
+
+
+class ResponseCache:
+    """A thread safe LRU of rendered responses, bounded by the total
+    size of the bodies it holds.
+
+    :param max_bytes: evict least recently used responses beyond this
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+
+            if value is not None:
+                self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        body = value[0]
+
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._data.pop(key, None)
+
+            if old is not None:
+                self.size -= len(old[0])
+
+            self._data[key] = value
+            self.size += len(body)
+
+            while self.size > self.max_bytes:
+                _, (evicted, *_) = self._data.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+def get_response_cache():
+    """Get the response cache of the current app."""
+    cache = current_app.extensions.get("flaskr.response_cache")
+
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "flaskr.response_cache",
+            ResponseCache(current_app.config["RESPONSE_CACHE_MAX_BYTES"]),
+        )
+
+    return cache
+
+
+def not_modified(etag, last_modified):
+    """Build the body-less 304 response for a matching validator."""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional(get_version):
+    """Decorate a read-only view so it answers conditional requests
+    without rendering, and so anonymous responses are served from
+    memory while the content they show is unchanged.
+
+    :param get_version: called with the view's arguments, returns a
+        ``(version, modified)`` pair that changes whenever what the view
+        shows changes (``modified`` is a unix time), or ``None`` to
+        skip caching, e.g. when the post does not exist
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            validator = get_version(**kwargs)
+
+            # flashed messages are shown once, such a page is never reused
+            if validator is None or "_flashes" in session:
+                return view(**kwargs)
+
+            version, modified = validator
+            user_id = session.get("user_id")
+            # the navigation and the edit links depend on who is asking
+            etag = f"{version}.{modified}.{user_id or 'anon'}"
+            last_modified = datetime.fromtimestamp(modified, timezone.utc)
+
+            if request.if_none_match:
+                if request.if_none_match.contains(etag):
+                    return not_modified(etag, last_modified)
+            elif (
+                request.if_modified_since is not None
+                and request.if_modified_since >= last_modified
+            ):
+                return not_modified(etag, last_modified)
+
+            cache = get_response_cache() if user_id is None else None
+            key = (request.full_path, etag)
+
+            if cache is not None:
+                cached = cache.get(key)
+
+                if cached is not None:
+                    body, status, headers = cached
+                    return current_app.response_class(body, status, headers)
+
+            response = current_app.make_response(view(**kwargs))
+
+            if response.status_code != 200:
+                return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            # browsers must revalidate, which is cheap thanks to the 304
+            response.cache_control.no_cache = True
+
+            if user_id is None:
+                response.cache_control.public = True
+            else:
+                response.cache_control.private = True
+
+            # a streamed body is not in memory to keep
+            if (
+                cache is not None
+                and not response.is_streamed
+                and "_flashes" not in session
+            ):
+                headers = [
+                    (name, value)
+                    for name, value in response.headers.items()
+                    if name.lower() != "set-cookie"
+                ]
+                cache.set(key, (response.get_data(), response.status_code, headers))
+
+            return response
+
+        return wrapped_view
+
+    return decorator
@@ -0,0 +1,168 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+from .db import get_db
+from .storage import folder_path
+from .storage import store_upload
+from .storage import variant_paths
+
+# Pillow's Image module, imported by load_pillow()
+_UNLOADED = object()
+Image = _UNLOADED
+
+
+def load_pillow():
+    """Import Pillow on first use, so workers and commands that never
+    process an image don't pay for it.
+
+    :return: the ``PIL.Image`` module, or ``None`` if Pillow is not
+        installed
+    """
+    global Image
+
+    if Image is _UNLOADED:
+        try:
+            from PIL import Image as module
+        except ImportError:  # thumbnails are optional, pages fall back to the original
+            module = None
+
+        Image = module
+
+    return Image
+
+
+def save_image(image):
+    """Store the original of an uploaded image, see
+    :func:`.storage.store_upload`.
+
+    :param image: a :class:`~werkzeug.datastructures.FileStorage`
+    :return: the ``image_path`` to record on the post
+    """
+    ext = image.filename.rsplit(".", 1)[1]
+    return store_upload(image.stream, ext)
+
+
+def make_variants(image_path, size):
+    """Write a thumbnail in the original format and a WebP copy of it
+    next to the original.
+
+    :return: ``(thumb_path, webp_path)`` relative to the static folder,
+        or ``None`` if Pillow is not installed
+    """
+    Image = load_pillow()
+
+    if Image is None:
+        return None
+
+    _, thumb_path, webp_path = variant_paths(image_path)
+
+    # identical uploads share their file, and so their thumbnails
+    if os.path.exists(folder_path(thumb_path)) and os.path.exists(
+        folder_path(webp_path)
+    ):
+        return thumb_path, webp_path
+
+    with Image.open(folder_path(image_path)) as original:
+        original.thumbnail(size)
+        original.save(folder_path(thumb_path))
+
+        if original.mode not in ("RGB", "RGBA"):
+            original = original.convert("RGBA")
+
+        original.save(folder_path(webp_path), "WEBP")
+
+    return thumb_path, webp_path
+
+
+class ImageQueue:
+    """Runs image processing jobs in a thread pool, so the request that
+    uploaded the image doesn't wait for it.
+
+    :param app: the app whose config and database the jobs use
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config["IMAGE_WORKERS"], thread_name_prefix="flaskr-images"
+        )
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, post_id, image_path):
+        """Queue the variants of a post's image. Call after the post is
+        committed.
+        """
+        future = self.executor.submit(self.process, post_id, image_path)
+
+        with self._lock:
+            self._pending.add(future)
+
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def process(self, post_id, image_path):
+        """Make the variants and record them on the post, unless the
+        post's image was replaced in the meantime.
+        """
+        with self.app.app_context():
+            try:
+                variants = make_variants(
+                    image_path, tuple(self.app.config["THUMBNAIL_SIZE"])
+                )
+            except OSError:
+                # not an image Pillow can read, keep showing the original
+                self.app.logger.warning("Could not process %s", image_path, exc_info=True)
+                return None
+
+            if variants is None:
+                return None
+
+            db = get_db()
+            db.execute(
+                "UPDATE post SET thumb_path = ?, webp_path = ?"
+                " WHERE id = ? AND image_path = ?",
+                (*variants, post_id, image_path),
+            )
+            db.commit()
+            return variants
+
+    def join(self):
+        """Wait until the queued jobs are done."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+
+            if not pending:
+                return
+
+            for future in pending:
+                future.exception()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_queue_lock = threading.Lock()
+
+
+def get_image_queue():
+    """Get the image queue of the current app."""
+    queue = current_app.extensions.get("flaskr.image_queue")
+
+    if queue is None:
+        with _queue_lock:
+            queue = current_app.extensions.get("flaskr.image_queue")
+
+            if queue is None:
+                app = current_app._get_current_object()
+                queue = app.extensions["flaskr.image_queue"] = ImageQueue(app)
+
+    return queue
@@ -0,0 +1,335 @@
+import fcntl
+import glob
+import itertools
+import json
+import os
+import threading
+from contextlib import suppress
+
+from flask import current_app
+
+from .db import get_db
+
+
+class LikeBuffer:
+    """Collects like and unlike events and writes them in batches.
+
+    Repeated events for the same user and post are coalesced, only the
+    last one is written. A background thread flushes at most
+    ``LIKE_FLUSH_INTERVAL`` seconds after the first buffered event, or
+    as soon as ``LIKE_BUFFER_MAX`` events are waiting.
+
+    Every event is appended to a journal file before it is acknowledged.
+    Each buffer has its own journal, next to a lock file it holds an
+    ``flock`` on while it runs. Creating a buffer replays the journals
+    whose lock it can take, so events that were buffered when a process
+    died are not lost, and the journals of live processes are left
+    alone. Replaying is safe because writing an event is idempotent.
+
+    :param app: the app whose config and database are used
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.interval = app.config["LIKE_FLUSH_INTERVAL"]
+        self.max_pending = app.config["LIKE_BUFFER_MAX"]
+        self.prefix = app.config["LIKE_JOURNAL"] or app.config["DATABASE"] + "-likes"
+        # one per buffer, a process may have several apps
+        self.base = f"{self.prefix}.{os.getpid()}-{next(_buffer_ids)}"
+        self.journal_path = self.base + ".journal"
+        # {(user_id, post_id): (liked, liked_in_db)}
+        self._pending = {}
+        # {post_id: change of like_count not written yet}
+        self._delta = {}
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._journal = None
+        # a process replaying a journal that had this name holds the
+        # lock until it is done
+        self._lock_file = _lock(self.base + ".lock", blocking=True)
+
+        with app.app_context():
+            self.recover()
+
+    def recover(self):
+        """Write the events of journals left by buffers whose process
+        died, and of this buffer's name if an earlier process had it.
+        """
+        bases = set()
+
+        for path in glob.glob(glob.escape(self.prefix) + ".*"):
+            for suffix in (".lock", ".journal", ".journal.flushing"):
+                if path.endswith(suffix):
+                    bases.add(path[: -len(suffix)])
+
+        taken = {self.base: None}
+
+        try:
+            for base in bases - taken.keys():
+                lock = _lock(base + ".lock", blocking=False)
+
+                if lock is not None:
+                    taken[base] = lock
+
+            events = []
+
+            for base in taken:
+                for path in (base + ".journal.flushing", base + ".journal"):
+                    events.extend(_read_journal(path))
+
+            if events:
+                latest = {(user_id, post_id): liked for user_id, post_id, liked in events}
+                self.write(latest)
+
+            for base in taken:
+                for path in (base + ".journal.flushing", base + ".journal"):
+                    with suppress(FileNotFoundError):
+                        os.remove(path)
+        finally:
+            for base, lock in taken.items():
+                if lock is not None:
+                    with suppress(FileNotFoundError):
+                        os.remove(base + ".lock")
+
+                    lock.close()
+
+    def write(self, events):
+        """Apply ``{(user_id, post_id): liked}`` in one transaction."""
+        db = get_db()
+        likes = [key for key, liked in events.items() if liked]
+        unlikes = [key for key, liked in events.items() if not liked]
+
+        try:
+            # a post may be deleted while its likes wait
+            db.executemany(
+                "INSERT OR IGNORE INTO user_like (user_id, post_id)"
+                " SELECT ?, id FROM post WHERE id = ?",
+                likes,
+            )
+            db.executemany(
+                "DELETE FROM user_like WHERE user_id = ? AND post_id = ?", unlikes
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+    def add(self, user_id, post_id, liked):
+        """Buffer a like (``liked=True``) or unlike of a post.
+
+        :return: whether the user now likes the post, and the post's
+            like count including buffered events
+        """
+        key = (user_id, post_id)
+
+        with self._lock:
+            if key in self._pending:
+                previous, liked_in_db = self._pending[key]
+            else:
+                liked_in_db = previous = (
+                    get_db()
+                    .execute(
+                        "SELECT 1 FROM user_like WHERE user_id = ? AND post_id = ?", key
+                    )
+                    .fetchone()
+                    is not None
+                )
+
+            if liked != previous:
+                self._log(user_id, post_id, liked)
+                self._pending[key] = (liked, liked_in_db)
+                self._delta[post_id] = self._delta.get(post_id, 0) + (
+                    1 if liked else -1
+                )
+                self._start()
+
+                if len(self._pending) >= self.max_pending:
+                    self._wake.set()
+
+            return liked, self.like_count(post_id)
+
+    def like_count(self, post_id):
+        """Like count of a post including buffered events."""
+        row = get_db().execute(
+            "SELECT like_count FROM post WHERE id = ?", (post_id,)
+        ).fetchone()
+        return (row[0] if row else 0) + self.pending_delta(post_id)
+
+    def pending_delta(self, post_id):
+        """How much buffered events change the like count of a post."""
+        with self._lock:
+            return self._delta.get(post_id, 0)
+
+    def has_pending(self, post_id):
+        """Whether events for a post are buffered, even ones that cancel
+        out in the like count.
+        """
+        with self._lock:
+            return post_id in self._delta
+
+    def pending_liked(self, user_id, post_id):
+        """The buffered state of a like, or ``None`` if there is none."""
+        with self._lock:
+            pending = self._pending.get((user_id, post_id))
+            return None if pending is None else pending[0]
+
+    def discard(self, user_id, post_id):
+        """Drop a buffered event that a direct write is superseding."""
+        key = (user_id, post_id)
+
+        with self._lock:
+            pending = self._pending.pop(key, None)
+
+            if pending is not None and pending[0] != pending[1]:
+                self._delta[post_id] -= 1 if pending[0] else -1
+
+    def _log(self, user_id, post_id, liked):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+
+        self._journal.write(json.dumps([user_id, post_id, liked]) + "\n")
+        self._journal.flush()
+
+    def flush(self):
+        """Write the buffered events now."""
+        with self._lock:
+            if not self._pending:
+                return 0
+
+            events = {key: liked for key, (liked, _) in self._pending.items()}
+
+            # events arriving while this batch is written go to a new journal
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+            flushing = self.journal_path + ".flushing"
+
+            if not os.path.exists(self.journal_path):
+                # an earlier flush failed and nothing happened since
+                pass
+            elif os.path.exists(flushing):
+                # an earlier flush failed, its events are still pending
+                with open(self.journal_path) as src, open(flushing, "a") as dst:
+                    dst.write(src.read())
+
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, flushing)
+
+            with self.app.app_context():
+                self.write(events)
+
+            self._pending.clear()
+            self._delta.clear()
+
+            with suppress(FileNotFoundError):
+                os.remove(flushing)
+
+            return len(events)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="flaskr-likes", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                # keep the events and the journal, try again next time
+                self.app.logger.exception("Writing buffered likes failed")
+
+    def close(self):
+        """Write what is buffered and stop the flush thread."""
+        self._stopped = True
+        self._wake.set()
+
+        if self._thread is not None:
+            self._thread.join()
+
+        self.flush()
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        # nothing is left to replay
+        if self._lock_file is not None:
+            with suppress(FileNotFoundError):
+                os.remove(self.base + ".lock")
+
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def _lock(path, blocking):
+    """Take an exclusive ``flock`` on ``path``, creating it.
+
+    :return: the open file holding the lock, or ``None`` if another
+        process holds it and ``blocking`` is false
+    """
+    while True:
+        f = open(path, "a")
+
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            return None
+
+        try:
+            # the holder before may have removed the file when it was done
+            if os.stat(path).st_ino == os.fstat(f.fileno()).st_ino:
+                return f
+        except FileNotFoundError:
+            pass
+
+        f.close()
+
+        if not blocking:
+            return None
+
+
+def _read_journal(path):
+    events = []
+
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # the last line may be cut short by the crash
+                    continue
+    except FileNotFoundError:
+        pass
+
+    return events
+
+
+_buffer_ids = itertools.count()
+_buffer_lock = threading.Lock()
+
+
+def get_like_buffer():
+    """Get the like buffer of the current app."""
+    buffer = current_app.extensions.get("flaskr.like_buffer")
+
+    if buffer is None:
+        with _buffer_lock:
+            buffer = current_app.extensions.get("flaskr.like_buffer")
+
+            if buffer is None:
+                app = current_app._get_current_object()
+                buffer = app.extensions["flaskr.like_buffer"] = LikeBuffer(app)
+
+    return buffer
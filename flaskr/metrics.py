@@ -0,0 +1,315 @@
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import before_render_template
+from flask import current_app
+from flask import g
+from flask import has_request_context
+from flask import request
+from flask import template_rendered
+
+from .cache import get_cache
+from .db import get_pool
+
+# upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# only one request is profiled at a time
+_profile_lock = threading.Lock()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Thread safe totals of the requests an app served, rendered in the
+    Prometheus text format by :meth:`render`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(method, endpoint, status): count}
+        self.requests = {}
+        # {endpoint: [count per bucket..., sum, count]}
+        self.durations = {}
+        # {(endpoint, name): [seconds, count]}
+        self.timings = {}
+
+    def observe(self, method, endpoint, status, duration, timings):
+        """Add one request.
+
+        :param timings: ``{name: [seconds, count]}`` measured during it
+        """
+        with self._lock:
+            key = (method, endpoint, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            histogram = self.durations.setdefault(
+                endpoint, [0] * (len(DURATION_BUCKETS) + 2)
+            )
+
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    histogram[i] += 1
+
+            histogram[-2] += duration
+            histogram[-1] += 1
+
+            for name, (seconds, count) in timings.items():
+                total = self.timings.setdefault((endpoint, name), [0.0, 0])
+                total[0] += seconds
+                total[1] += count
+
+    def render(self, pool_stats, cache_stats):
+        with self._lock:
+            lines = [
+                "# HELP flaskr_requests_total Requests served.",
+                "# TYPE flaskr_requests_total counter",
+            ]
+            lines.extend(
+                f'flaskr_requests_total{{method="{_label(method)}",'
+                f'endpoint="{_label(endpoint)}",status="{status}"}} {count}'
+                for (method, endpoint, status), count in sorted(self.requests.items())
+            )
+            lines += [
+                "# HELP flaskr_request_duration_seconds Time to build the response.",
+                "# TYPE flaskr_request_duration_seconds histogram",
+            ]
+
+            for endpoint, histogram in sorted(self.durations.items()):
+                label = f'endpoint="{_label(endpoint)}"'
+                lines.extend(
+                    f'flaskr_request_duration_seconds_bucket{{{label},le="{bound}"}}'
+                    f" {histogram[i]}"
+                    for i, bound in enumerate(DURATION_BUCKETS)
+                )
+                lines += [
+                    f'flaskr_request_duration_seconds_bucket{{{label},le="+Inf"}}'
+                    f" {histogram[-1]}",
+                    f"flaskr_request_duration_seconds_sum{{{label}}} {histogram[-2]}",
+                    f"flaskr_request_duration_seconds_count{{{label}}} {histogram[-1]}",
+                ]
+
+            lines += [
+                "# HELP flaskr_part_seconds_total Time spent in SQL, templates"
+                " and Markdown.",
+                "# TYPE flaskr_part_seconds_total counter",
+            ]
+            lines.extend(
+                f'flaskr_part_seconds_total{{endpoint="{_label(endpoint)}",'
+                f'part="{name}"}} {seconds}'
+                for (endpoint, name), (seconds, _) in sorted(self.timings.items())
+            )
+            lines += [
+                "# HELP flaskr_part_calls_total SQL statements, templates and"
+                " Markdown documents.",
+                "# TYPE flaskr_part_calls_total counter",
+            ]
+            lines.extend(
+                f'flaskr_part_calls_total{{endpoint="{_label(endpoint)}",'
+                f'part="{name}"}} {count}'
+                for (endpoint, name), (_, count) in sorted(self.timings.items())
+            )
+
+        lines += [
+            "# HELP flaskr_db_connections Connections of the database pool.",
+            "# TYPE flaskr_db_connections gauge",
+            *(
+                f'flaskr_db_connections{{state="{state}"}} {pool_stats[state]}'
+                for state in ("open", "idle", "in_use")
+            ),
+            "# HELP flaskr_db_pool_waits_total Requests that waited for a connection.",
+            "# TYPE flaskr_db_pool_waits_total counter",
+            f"flaskr_db_pool_waits_total {pool_stats['waits']}",
+            "# HELP flaskr_db_pool_wait_seconds_total Time spent waiting for a"
+            " connection.",
+            "# TYPE flaskr_db_pool_wait_seconds_total counter",
+            f"flaskr_db_pool_wait_seconds_total {pool_stats['wait_time']}",
+            "# HELP flaskr_cache_lookups_total Lookups of memoized results.",
+            "# TYPE flaskr_cache_lookups_total counter",
+            *(
+                f'flaskr_cache_lookups_total{{result="{result}"}} {cache_stats[key]}'
+                for result, key in (
+                    ("hit", "hits"),
+                    ("disk_hit", "disk_hits"),
+                    ("miss", "misses"),
+                )
+            ),
+            "# HELP flaskr_cache_removals_total Memoized results dropped.",
+            "# TYPE flaskr_cache_removals_total counter",
+            *(
+                f'flaskr_cache_removals_total{{reason="{reason}"}} {cache_stats[key]}'
+                for reason, key in (
+                    ("eviction", "evictions"),
+                    ("expiration", "expirations"),
+                    ("invalidation", "invalidations"),
+                )
+            ),
+            "# HELP flaskr_cache_bytes Estimated size of the memoized results.",
+            "# TYPE flaskr_cache_bytes gauge",
+            f"flaskr_cache_bytes {cache_stats['size']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def add_timing(name, seconds, count=1):
+    """Add to the current request's ``name`` timing."""
+    total = g.setdefault("timings", {}).setdefault(name, [0.0, 0])
+    total[0] += seconds
+    total[1] += count
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's ``name``
+    timing. Does nothing unless ``INSTRUMENTATION`` is on.
+    """
+    if not has_request_context() or "flaskr.metrics" not in current_app.extensions:
+        yield
+        return
+
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def request_timings(state=None):
+    """The timings of the current request, with its SQL statements.
+
+    :param state: the request's :data:`~flask.g`, for use after its
+        context is gone
+    """
+    state = g if state is None else state
+    timings = dict(state.get("timings", {}))
+    queries = state.get("queries", ())
+
+    if queries:
+        timings["sql"] = [sum(q.duration for q in queries), len(queries)]
+
+    return timings
+
+
+def _start_template(sender, template, context, **extra):
+    if has_request_context():
+        g.setdefault("template_starts", []).append(time.perf_counter())
+
+
+def _end_template(sender, template, context, **extra):
+    starts = g.get("template_starts") if has_request_context() else None
+
+    if starts:
+        add_timing("template", time.perf_counter() - starts.pop())
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    rate = current_app.config["PROFILE_SAMPLE_RATE"]
+
+    if rate and random.random() < rate and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _after_request(response):
+    start = g.get("request_start")
+
+    # an earlier before_request function answered the request
+    if start is None:
+        return response
+
+    state = g._get_current_object()
+    metrics = current_app.extensions["flaskr.metrics"]
+    labels = (request.method, request.endpoint or "none", response.status_code)
+
+    if response.is_streamed:
+        # the body, with its templates and queries, is only made while
+        # it is sent, after the headers. Record the request once the
+        # server closes the response, without a Server-Timing header.
+        response.call_on_close(lambda: _observe(metrics, labels, state, start))
+        return response
+
+    duration, timings = _observe(metrics, labels, state, start)
+    # overlapping parts: the template time includes the SQL and Markdown
+    # run while rendering it
+    response.headers["Server-Timing"] = ", ".join(
+        [
+            *(
+                f'{name};dur={seconds * 1000:.2f};desc="{count}"'
+                for name, (seconds, count) in sorted(timings.items())
+            ),
+            f"total;dur={duration * 1000:.2f}",
+        ]
+    )
+    return response
+
+
+def _observe(metrics, labels, state, start):
+    duration = time.perf_counter() - start
+    timings = request_timings(state)
+    # left by a template that raised
+    state.pop("template_starts", None)
+    metrics.observe(*labels, duration, timings)
+    return duration, timings
+
+
+def _teardown_request(exc):
+    profiler = g.pop("profiler", None)
+
+    if profiler is None:
+        return
+
+    try:
+        profiler.disable()
+        duration = time.perf_counter() - g.request_start
+
+        if duration >= current_app.config["PROFILE_SLOW_SECONDS"]:
+            save_profile(profiler, duration)
+    finally:
+        _profile_lock.release()
+
+
+def save_profile(profiler, duration):
+    """Write the stats of a slow request to ``PROFILE_FOLDER``, to be
+    read with :mod:`pstats` or snakeviz.
+    """
+    folder = current_app.config["PROFILE_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    name = (
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{time.time_ns() % 10**9:09}"
+        f"-{request.endpoint or 'none'}-{duration * 1000:.0f}ms.prof"
+    )
+    path = os.path.join(folder, name)
+    profiler.dump_stats(path)
+    current_app.logger.info("Slow request %s profiled to %s", request.path, path)
+    return path
+
+
+def metrics_view():
+    """Serve the app's metrics to Prometheus."""
+    body = current_app.extensions["flaskr.metrics"].render(
+        get_pool().stats(), get_cache().stats()
+    )
+    return body, 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+def init_app(app):
+    """Time requests, SQL, templates and Markdown, and serve the totals
+    at ``/metrics``, if ``INSTRUMENTATION`` is on.
+    """
+    if not app.config["INSTRUMENTATION"]:
+        return
+
+    app.extensions["flaskr.metrics"] = Metrics()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
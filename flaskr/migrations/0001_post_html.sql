@@ -0,0 +1,8 @@
+-- rendered Markdown of each post, body_hash tells whether it is stale
+CREATE TABLE IF NOT EXISTS post_html (
+  post_id INTEGER PRIMARY KEY,
+  body_hash TEXT NOT NULL,
+  body_html TEXT NOT NULL,
+  excerpt_html TEXT NOT NULL,
+  FOREIGN KEY (post_id) REFERENCES post (id)
+);
@@ -0,0 +1,12 @@
+-- secondary indexes for the queries run by the blog views
+
+-- index page order and ?after=<created,id> cursor
+CREATE INDEX IF NOT EXISTS post_created_id ON post (created, id);
+-- post JOIN user
+CREATE INDEX IF NOT EXISTS post_author_id ON post (author_id);
+-- comments of a post on the detail page
+CREATE INDEX IF NOT EXISTS comment_post_id ON comment (post_id, created);
+-- like count of a post, the primary key only covers (user_id, post_id)
+CREATE INDEX IF NOT EXISTS user_like_post_id ON user_like (post_id);
+-- ?tag= filter, the primary key only covers (post_id, tag_id)
+CREATE INDEX IF NOT EXISTS post_tag_tag_id ON post_tag (tag_id);
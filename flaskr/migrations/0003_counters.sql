@@ -0,0 +1,38 @@
+-- maintained row counts, so the index page does not COUNT(*) per request
+
+CREATE TABLE IF NOT EXISTS counter (
+  name TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS tag_stats (
+  tag_id INTEGER PRIMARY KEY,
+  post_count INTEGER NOT NULL DEFAULT 0,
+  FOREIGN KEY (tag_id) REFERENCES tag (id)
+);
+
+INSERT OR REPLACE INTO counter (name, value) SELECT 'post', count(*) FROM post;
+INSERT OR REPLACE INTO tag_stats (tag_id, post_count)
+  SELECT tag_id, count(*) FROM post_tag GROUP BY tag_id;
+
+-- the triggers run inside the writing statement's transaction
+CREATE TRIGGER IF NOT EXISTS post_count_insert AFTER INSERT ON post
+BEGIN
+  UPDATE counter SET value = value + 1 WHERE name = 'post';
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_count_delete AFTER DELETE ON post
+BEGIN
+  UPDATE counter SET value = value - 1 WHERE name = 'post';
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_count_insert AFTER INSERT ON post_tag
+BEGIN
+  INSERT INTO tag_stats (tag_id, post_count) VALUES (NEW.tag_id, 1)
+    ON CONFLICT (tag_id) DO UPDATE SET post_count = post_count + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS tag_count_delete AFTER DELETE ON post_tag
+BEGIN
+  UPDATE tag_stats SET post_count = post_count - 1 WHERE tag_id = OLD.tag_id;
+END;
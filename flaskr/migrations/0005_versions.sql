@@ -0,0 +1,83 @@
+-- versions used as HTTP validators (ETag / Last-Modified)
+
+-- bumped when a post, or what its detail page shows, changes
+ALTER TABLE post ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
+-- unix time of the last change
+ALTER TABLE post ADD COLUMN modified INTEGER NOT NULL DEFAULT 0;
+
+UPDATE post SET modified = CAST(strftime('%s', created) AS INTEGER);
+
+-- bumped when the post list (index page, feed) changes
+INSERT OR REPLACE INTO counter (name, value) VALUES ('content_version', 0);
+INSERT OR REPLACE INTO counter (name, value)
+  VALUES ('content_modified', CAST(strftime('%s', 'now') AS INTEGER));
+
+CREATE TRIGGER IF NOT EXISTS content_version_insert AFTER INSERT ON post
+BEGIN
+  UPDATE post SET modified = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE id = NEW.id;
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
+
+CREATE TRIGGER IF NOT EXISTS content_version_update
+  AFTER UPDATE OF title, body, image_path ON post
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.id;
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
+
+CREATE TRIGGER IF NOT EXISTS content_version_delete AFTER DELETE ON post
+BEGIN
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
+
+-- tags are shown on the index and detail pages
+CREATE TRIGGER IF NOT EXISTS post_version_tag_insert AFTER INSERT ON post_tag
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.post_id;
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_version_tag_delete AFTER DELETE ON post_tag
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = OLD.post_id;
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
+
+-- comments and likes are only shown on the detail page
+CREATE TRIGGER IF NOT EXISTS post_version_comment_insert AFTER INSERT ON comment
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_version_comment_delete AFTER DELETE ON comment
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = OLD.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_version_like_insert AFTER INSERT ON user_like
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS post_version_like_delete AFTER DELETE ON user_like
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = OLD.post_id;
+END;
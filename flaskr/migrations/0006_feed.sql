@@ -0,0 +1,8 @@
+-- RSS documents built when posts change, served as stored
+CREATE TABLE IF NOT EXISTS feed (
+  tag TEXT PRIMARY KEY,  -- '' for the feed of all posts
+  xml BLOB NOT NULL,
+  gzip BLOB NOT NULL,
+  etag TEXT NOT NULL,
+  modified INTEGER NOT NULL
+);
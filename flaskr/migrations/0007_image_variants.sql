@@ -0,0 +1,16 @@
+-- smaller versions of the post image, made in the background
+ALTER TABLE post ADD COLUMN thumb_path TEXT;
+ALTER TABLE post ADD COLUMN webp_path TEXT;
+
+-- the index page shows the thumbnails, so recording them changes it
+DROP TRIGGER IF EXISTS content_version_update;
+
+CREATE TRIGGER content_version_update
+  AFTER UPDATE OF title, body, image_path, thumb_path, webp_path ON post
+BEGIN
+  UPDATE post SET version = version + 1,
+    modified = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.id;
+  UPDATE counter SET value = value + 1 WHERE name = 'content_version';
+  UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE name = 'content_modified';
+END;
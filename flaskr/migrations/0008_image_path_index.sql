@@ -0,0 +1,2 @@
+-- reference count of a stored upload, see storage.release_image
+CREATE INDEX IF NOT EXISTS post_image_path ON post (image_path);
@@ -0,0 +1,27 @@
+-- like and comment totals shown on the detail page
+ALTER TABLE post ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE post ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0;
+
+UPDATE post SET
+  like_count = (SELECT count(*) FROM user_like WHERE post_id = post.id),
+  comment_count = (SELECT count(*) FROM comment WHERE post_id = post.id);
+
+CREATE TRIGGER IF NOT EXISTS like_count_insert AFTER INSERT ON user_like
+BEGIN
+  UPDATE post SET like_count = like_count + 1 WHERE id = NEW.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS like_count_delete AFTER DELETE ON user_like
+BEGIN
+  UPDATE post SET like_count = like_count - 1 WHERE id = OLD.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS comment_count_insert AFTER INSERT ON comment
+BEGIN
+  UPDATE post SET comment_count = comment_count + 1 WHERE id = NEW.post_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS comment_count_delete AFTER DELETE ON comment
+BEGIN
+  UPDATE post SET comment_count = comment_count - 1 WHERE id = OLD.post_id;
+END;
@@ -0,0 +1,12 @@
+-- server side sessions, see flaskr/sessions.py
+CREATE TABLE IF NOT EXISTS session (
+  id TEXT PRIMARY KEY,  -- sha256 of the id in the cookie
+  user_id INTEGER,
+  data TEXT NOT NULL,
+  user TEXT,  -- JSON copy of the user row, NULL to load it again
+  expires INTEGER NOT NULL  -- unix time
+);
+
+-- logging a user out everywhere, and sweeping expired sessions
+CREATE INDEX IF NOT EXISTS session_user_id ON session (user_id);
+CREATE INDEX IF NOT EXISTS session_expires ON session (expires);
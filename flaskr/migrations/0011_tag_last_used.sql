@@ -0,0 +1,19 @@
+-- the tag index lists tags by use, without grouping post_tag
+ALTER TABLE tag_stats ADD COLUMN last_used TIMESTAMP;
+
+UPDATE tag_stats SET last_used = (
+  SELECT max(p.created) FROM post_tag pt JOIN post p ON p.id = pt.post_id
+  WHERE pt.tag_id = tag_stats.tag_id
+);
+
+CREATE INDEX IF NOT EXISTS tag_stats_post_count ON tag_stats (post_count DESC, tag_id);
+
+DROP TRIGGER IF EXISTS tag_count_insert;
+
+CREATE TRIGGER IF NOT EXISTS tag_count_insert AFTER INSERT ON post_tag
+BEGIN
+  INSERT INTO tag_stats (tag_id, post_count, last_used)
+    VALUES (NEW.tag_id, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (tag_id) DO UPDATE SET post_count = post_count + 1,
+      last_used = excluded.last_used;
+END;
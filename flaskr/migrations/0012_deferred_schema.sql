@@ -0,0 +1,8 @@
+-- indexes and triggers an import has set aside, see flaskr/transfer.py.
+-- Rows left behind by an import that died are restored by migrate-db.
+CREATE TABLE IF NOT EXISTS deferred_schema (
+  name TEXT PRIMARY KEY,
+  type TEXT NOT NULL,
+  sql TEXT NOT NULL,
+  first_post_id INTEGER NOT NULL  -- the first id the import gave a post
+);
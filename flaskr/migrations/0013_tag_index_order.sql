@@ -0,0 +1,3 @@
+-- the tag index sorted by recent use reads tags in this order, sorted
+-- by name it walks the UNIQUE index of tag.name
+CREATE INDEX IF NOT EXISTS tag_stats_last_used ON tag_stats (last_used DESC, tag_id);
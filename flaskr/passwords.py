@@ -0,0 +1,99 @@
+import functools
+import threading
+
+from flask import current_app
+from werkzeug.security import check_password_hash
+from werkzeug.security import generate_password_hash
+
+from .processes import make_process_pool
+
+_hasher_lock = threading.Lock()
+
+
+class HasherBusy(Exception):
+    """Raised when ``PASSWORD_HASH_QUEUE`` hashes are already waiting or
+    running. Shedding the request is cheaper than queueing it behind a
+    burst of login attempts.
+    """
+
+
+@functools.cache
+def method_prefix(method):
+    """The parameters part of the hashes ``method`` makes, e.g.
+    ``"scrypt:32768:8:1"`` for ``"scrypt"``.
+    """
+    return generate_password_hash("", method).partition("$")[0]
+
+
+def _check(pwhash, password, method):
+    """Check a password, and hash it again if ``pwhash`` was made with
+    other parameters than ``method``'s.
+
+    :return: ``(matches, new_hash or None)``
+    """
+    if not check_password_hash(pwhash, password):
+        return False, None
+
+    if pwhash.partition("$")[0] == method_prefix(method):
+        return True, None
+
+    return True, generate_password_hash(password, method)
+
+
+class Hasher:
+    """Hash and check passwords in ``processes`` worker processes, so a
+    burst of logins doesn't pin every request thread on the deliberately
+    slow hashes. With ``processes=0`` the calling thread hashes.
+
+    :param queue: the most hashes waiting or running at once
+    """
+
+    def __init__(self, method, processes, queue):
+        self.method = method
+        self._slots = threading.BoundedSemaphore(queue)
+        self._executor = None
+
+        if processes:
+            self._executor = make_process_pool(processes)
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+
+        try:
+            if self._executor is None:
+                return func(*args)
+
+            return self._executor.submit(func, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        """:return: ``(matches, new_hash or None)``, see :func:`_check`"""
+        return self._run(_check, pwhash, password, self.method)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+def get_hasher():
+    """Get the app's password hasher."""
+    hasher = current_app.extensions.get("flaskr.hasher")
+
+    if hasher is None:
+        with _hasher_lock:
+            hasher = current_app.extensions.get("flaskr.hasher")
+
+            if hasher is None:
+                config = current_app.config
+                hasher = current_app.extensions["flaskr.hasher"] = Hasher(
+                    config["PASSWORD_HASH_METHOD"],
+                    config["PASSWORD_HASH_PROCESSES"],
+                    config["PASSWORD_HASH_QUEUE"],
+                )
+
+    return hasher
@@ -0,0 +1,75 @@
+"""Warm up an app before a pre-forking server starts its workers, e.g.
+with gunicorn::
+
+    $ gunicorn --preload -w 4 'flaskr.preload:create_warm_app()'
+
+What is loaded here is shared copy-on-write by the forked workers
+instead of being loaded again by each of them.
+"""
+import gc
+
+from . import create_app
+from .db import get_db
+from .db import get_pool
+from .images import load_pillow
+from .render import get_post_html
+from .render import render_markdown
+from .templating import compile_templates
+
+# recent posts whose rendered HTML is loaded into the shared cache
+PRELOAD_POSTS = 100
+
+# loads the Markdown extensions and the lexers of common languages
+SAMPLE_MARKDOWN = """\
+# Title
+
+Some *text* with a [link](/) and a table:
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+```python
+print("hello")
+```
+
+```bash
+echo hello
+```
+"""
+
+
+def warm_up(app, freeze=True):
+    """Import the lazily loaded libraries, load the templates and the
+    HTML of the newest posts, then close the database connections, which
+    must not be shared with the workers.
+
+    :param freeze: move everything loaded so far out of the garbage
+        collector's reach (:func:`gc.freeze`), so collections in the
+        workers don't write to, and so copy, the shared pages
+    """
+    render_markdown(SAMPLE_MARKDOWN)
+    load_pillow()
+    compile_templates(app)
+
+    with app.app_context():
+        for post in get_db().execute(
+            "SELECT id, body FROM post ORDER BY created DESC, id DESC LIMIT ?",
+            (PRELOAD_POSTS,),
+        ).fetchall():
+            get_post_html(post)
+
+        get_pool().close()
+
+    # each worker opens its own connections on first use
+    del app.extensions["flaskr.db_pool"]
+
+    if freeze:
+        gc.freeze()
+
+    return app
+
+
+def create_warm_app(test_config=None):
+    """:func:`flaskr.create_app` followed by :func:`warm_up`."""
+    return warm_up(create_app(test_config))
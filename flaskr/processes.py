@@ -0,0 +1,13 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def make_process_pool(workers):
+    """A pool of ``workers`` processes for CPU bound work, such as
+    rendering Markdown and hashing passwords.
+
+    Forking a process that runs threads and holds database connections
+    is unsafe, so the workers are started as clean interpreters. They
+    only import what the submitted functions need.
+    """
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
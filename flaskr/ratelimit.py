@@ -0,0 +1,88 @@
+import math
+import threading
+import time
+
+from flask import current_app
+
+# buckets kept per limiter before full ones are dropped
+MAX_BUCKETS = 10000
+
+
+class RateLimiter:
+    """Token buckets, one per key. Each holds up to ``capacity`` tokens
+    and earns them back at ``capacity / period`` per second, so bursts of
+    ``capacity`` are allowed but not more than that per ``period`` on
+    average.
+
+    A full bucket is the same as no bucket, so those are dropped when
+    there are too many keys.
+    """
+
+    def __init__(self, capacity, period, max_buckets=MAX_BUCKETS):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.max_buckets = max_buckets
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def acquire(self, key):
+        """Take a token for ``key``.
+
+        :return: 0 if there was one, otherwise the seconds until there
+            is
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            tokens = self._refill(key, now)
+
+            if tokens < 1:
+                return (1 - tokens) / self.rate
+
+            if len(self._buckets) >= self.max_buckets and key not in self._buckets:
+                self._prune(now)
+
+            self._buckets[key] = (tokens - 1, now)
+            return 0
+
+    def _prune(self, now):
+        for key in [key for key in self._buckets if self._refill(key, now) >= self.capacity]:
+            del self._buckets[key]
+
+        # still too many, drop the keys seen first
+        while len(self._buckets) >= self.max_buckets:
+            del self._buckets[next(iter(self._buckets))]
+
+
+def get_limiter(name):
+    """Get the app's limiter for the ``name`` entry of
+    ``LOGIN_RATE_LIMITS``.
+    """
+    limiters = current_app.extensions.setdefault("flaskr.rate_limiters", {})
+    limiter = limiters.get(name)
+
+    if limiter is None:
+        limiter = limiters.setdefault(
+            name, RateLimiter(*current_app.config["LOGIN_RATE_LIMITS"][name])
+        )
+
+    return limiter
+
+
+def login_retry_after(username, address):
+    """Take a login attempt from the username's and the client address'
+    allowances.
+
+    :return: 0 if the attempt may go ahead, otherwise the whole seconds
+        to wait before the next one
+    """
+    wait = get_limiter("username").acquire(username)
+
+    if not wait:
+        wait = get_limiter("ip").acquire(address)
+
+    return math.ceil(wait)
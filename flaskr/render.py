@@ -0,0 +1,287 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import click
+from flask import current_app
+from jinja2.filters import do_truncate
+
+from .db import get_db
+from .metrics import timed
+from .processes import make_process_pool
+
+# number of characters of the body shown on the index page
+EXCERPT_LENGTH = 20
+
+# number of rendered posts kept in memory per process
+HTML_CACHE_SIZE = 1024
+
+# posts rendered and stored per transaction by render-posts
+BACKFILL_BATCH_SIZE = 100
+
+MARKDOWN_EXTENSIONS = [
+    "pymdownx.highlight",  # ✅ 核心高亮扩展
+    "pymdownx.superfences",  # ✅ 支持 ``` 代码块并触发高亮
+    "extra",
+    "nl2br",
+]
+
+MARKDOWN_EXTENSION_CONFIGS = {
+    "pymdownx.highlight": {
+        "css_class": "highlight",  # CSS 类名
+        "use_pygments": True,  # 启用 Pygments
+        "linenums": False,  # 不显示行号
+    }
+}
+
+# building a Markdown instance loads every extension, so each thread
+# keeps its own instance and resets it between documents
+_local = threading.local()
+
+
+def render_markdown(text):
+    """Run ``text`` through the Markdown/Pygments pipeline."""
+    if text is None:
+        return ""
+
+    md = getattr(_local, "md", None)
+
+    if md is None:
+        # slow to import, with the Pygments lexers its extensions load
+        import markdown
+
+        md = _local.md = markdown.Markdown(
+            extensions=MARKDOWN_EXTENSIONS,
+            extension_configs=MARKDOWN_EXTENSION_CONFIGS,
+        )
+
+    try:
+        with timed("markdown"):
+            return md.convert(text)
+    finally:
+        md.reset()
+
+
+def body_hash(body):
+    """Return the hash that identifies a version of a post body."""
+    return hashlib.sha1(body.encode("utf8")).hexdigest()
+
+
+def excerpt(body):
+    """The part of the body shown on the index page."""
+    return do_truncate(current_app.jinja_env, body, EXCERPT_LENGTH)
+
+
+class HTMLCache:
+    """A small thread safe LRU mapping ``(post_id, body_hash)`` to the
+    rendered ``(body_html, excerpt_html)`` pair.
+    """
+
+    def __init__(self, maxsize=HTML_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+
+            if value is not None:
+                self._data.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+html_cache = HTMLCache()
+
+
+def render_post(body, excerpt_text):
+    """Render a post body and its excerpt. Takes no app state, so it can
+    run in a render process.
+    """
+    return render_markdown(body), render_markdown(excerpt_text)
+
+
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Get the app's pool of ``RENDER_PROCESSES`` processes rendering
+    Markdown, or ``None`` if rendering happens in the request thread.
+    """
+    pool = current_app.extensions.get("flaskr.render_pool")
+
+    if pool is None and current_app.config["RENDER_PROCESSES"]:
+        with _render_pool_lock:
+            pool = current_app.extensions.get("flaskr.render_pool")
+
+            if pool is None:
+                pool = current_app.extensions["flaskr.render_pool"] = (
+                    make_process_pool(current_app.config["RENDER_PROCESSES"])
+                )
+
+    return pool
+
+
+def store_post_html(db, post_id, body, rendered=None):
+    """Render a post body and store the result next to the post. Called
+    by the write handlers so the read path finds the HTML ready.
+
+    Does not commit, the caller owns the transaction.
+
+    :param rendered: the ``(body_html, excerpt_html)`` if already rendered
+    """
+    digest = body_hash(body)
+
+    if rendered is None:
+        rendered = render_post(body, excerpt(body))
+
+    db.execute(
+        "INSERT INTO post_html (post_id, body_hash, body_html, excerpt_html)"
+        " VALUES (?, ?, ?, ?)"
+        " ON CONFLICT (post_id) DO UPDATE SET body_hash = excluded.body_hash,"
+        " body_html = excluded.body_html, excerpt_html = excluded.excerpt_html",
+        (post_id, digest, *rendered),
+    )
+    html_cache.set((post_id, digest), rendered)
+    return rendered
+
+
+def get_post_html(post):
+    """Get the rendered ``(body_html, excerpt_html)`` of a post row.
+
+    Looks in the in-process LRU first, then in the ``post_html`` table.
+    Rows that were written before the table existed, or whose body was
+    changed behind the app's back, are rendered into the LRU only, reads
+    don't write. ``flask render-posts`` stores them.
+
+    :param post: a row with at least ``id`` and ``body``
+    """
+    digest = body_hash(post["body"])
+    key = (post["id"], digest)
+    rendered = html_cache.get(key)
+
+    if rendered is not None:
+        return rendered
+
+    row = get_db().execute(
+        "SELECT body_hash, body_html, excerpt_html FROM post_html WHERE post_id = ?",
+        (post["id"],),
+    ).fetchone()
+
+    if row is not None and row["body_hash"] == digest:
+        rendered = (row["body_html"], row["excerpt_html"])
+    else:
+        rendered = render_post(post["body"], excerpt(post["body"]))
+
+    html_cache.set(key, rendered)
+    return rendered
+
+
+def render_posts(posts):
+    """Render the bodies and excerpts of ``posts`` in one batch, in
+    parallel if there is a render pool.
+
+    :return: the ``(body_html, excerpt_html)`` of each post
+    """
+    bodies = [post["body"] for post in posts]
+    excerpts = [excerpt(body) for body in bodies]
+    pool = get_render_pool()
+
+    if pool is None:
+        return list(map(render_post, bodies, excerpts))
+
+    with timed("markdown"):
+        return list(pool.map(render_post, bodies, excerpts))
+
+
+def prerender(db, posts):
+    """Make sure :func:`get_post_html` finds the HTML of ``posts`` in
+    memory. The stored HTML of all of them is read with one query, and
+    those that have none are rendered in one batch, into memory only
+    like :func:`get_post_html` does.
+
+    :param posts: rows with at least ``id`` and ``body``
+    """
+    missing = {}
+
+    for post in posts:
+        key = (post["id"], body_hash(post["body"]))
+
+        if html_cache.get(key) is None:
+            missing[key] = post
+
+    if not missing:
+        return
+
+    ids = [post_id for post_id, _ in missing]
+
+    for row in db.execute(
+        "SELECT post_id, body_hash, body_html, excerpt_html FROM post_html"
+        f" WHERE post_id IN ({', '.join('?' * len(ids))})",
+        ids,
+    ):
+        key = (row["post_id"], row["body_hash"])
+
+        if key in missing:
+            html_cache.set(key, (row["body_html"], row["excerpt_html"]))
+            del missing[key]
+
+    if missing:
+        for key, html in zip(missing, render_posts(list(missing.values()))):
+            html_cache.set(key, html)
+
+
+def backfill_post_html(db, batch_size=BACKFILL_BATCH_SIZE):
+    """Store the HTML of the posts that have none, or HTML of another
+    version of their body. Commits after every ``batch_size`` posts.
+
+    :return: the number of posts rendered
+    """
+    count = 0
+    last_id = 0
+
+    while True:
+        rows = db.execute(
+            "SELECT p.id, p.body, h.body_hash FROM post p"
+            " LEFT JOIN post_html h ON h.post_id = p.id"
+            " WHERE p.id > ? ORDER BY p.id LIMIT ?",
+            (last_id, batch_size),
+        ).fetchall()
+
+        if not rows:
+            return count
+
+        last_id = rows[-1]["id"]
+        stale = [row for row in rows if row["body_hash"] != body_hash(row["body"])]
+
+        for post, html in zip(stale, render_posts(stale)):
+            store_post_html(db, post["id"], post["body"], html)
+
+        db.commit()
+        count += len(stale)
+
+
+@click.command("render-posts")
+def render_posts_command():
+    """Store the rendered HTML of posts that were written before it was
+    stored, or changed outside the app.
+    """
+    count = backfill_post_html(get_db())
+    click.echo(f"Rendered {count} posts.")
+
+
+def init_app(app):
+    app.cli.add_command(render_posts_command)
@@ -1,5 +1,6 @@
 -- Initialize the database.
 -- Drop any existing data and create empty tables.
+-- Later changes live in migrations/, init_db applies them afterwards.
 
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
@@ -7,6 +8,13 @@ DROP TABLE IF EXISTS user_like;
 DROP TABLE IF EXISTS comment;
 DROP TABLE IF EXISTS tag;
 DROP TABLE IF EXISTS post_tag;
+DROP TABLE IF EXISTS post_html;
+DROP TABLE IF EXISTS counter;
+DROP TABLE IF EXISTS tag_stats;
+DROP TABLE IF EXISTS post_fts;
+DROP TABLE IF EXISTS feed;
+DROP TABLE IF EXISTS session;
+DROP TABLE IF EXISTS deferred_schema;
 
 CREATE TABLE user (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -57,3 +65,4 @@ CREATE TABLE comment(
   FOREIGN KEY (post_id) REFERENCES post (id)
 );
 
+PRAGMA user_version = 0;
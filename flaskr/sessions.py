@@ -0,0 +1,316 @@
+import hashlib
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+from flask import g
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface
+from flask.sessions import SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from .db import get_db
+
+# sessions kept in memory per process
+SESSION_CACHE_SIZE = 4096
+
+# the user columns copied into the session
+USER_SNAPSHOT_COLUMNS = ("id", "username", "alias")
+
+
+def session_key(token):
+    """The database key of a cookie's session id. Only the hash is
+    stored, so a leaked table can't be used to take over sessions.
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """A session whose data is stored in the database. The cookie only
+    holds a random id.
+
+    :param user: the copy of the logged in user's row saved with the
+        session, or ``None``
+    """
+
+    modified = False
+
+    def __init__(self, initial=None, token=None, user=None, expires=0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.token = token
+        self.user = user
+        self.expires = expires
+        self.original_user_id = self.get("user_id")
+
+
+class SessionCache:
+    """A thread safe LRU of ``{key: (cache_until, data, user, expires)}``.
+
+    Entries are only trusted for ``ttl`` seconds, so sessions revoked by
+    another process are noticed soon.
+    """
+
+    def __init__(self, ttl, maxsize=SESSION_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                return None
+
+            if entry[0] <= time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return entry[1:]
+
+    def set(self, key, data, user, expires):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, data, user, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def forget_user(self, user_id):
+        """Drop the sessions of a user."""
+        with self._lock:
+            for key in [
+                key
+                for key, (_, _, user, _) in self._data.items()
+                if user is not None and json.loads(user)["id"] == user_id
+            ]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def get_session_cache():
+    """Get the session cache of the current app."""
+    cache = current_app.extensions.get("flaskr.session_cache")
+
+    if cache is None:
+        cache = current_app.extensions.setdefault(
+            "flaskr.session_cache", SessionCache(current_app.config["SESSION_CACHE_TTL"])
+        )
+
+    return cache
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Keep sessions in the ``session`` table, with an in-memory LRU in
+    front of it.
+
+    The cookie holds a random id and nothing else, so it is small and
+    needs no signature. Sessions can be revoked by deleting their row,
+    see :func:`revoke_sessions`. A copy of the logged in user is saved
+    with the session, so ``g.user`` usually needs no query.
+    """
+
+    serializer = TaggedJSONSerializer()
+    session_class = ServerSession
+
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+
+        if not token:
+            return self.session_class()
+
+        key = session_key(token)
+        cache = get_session_cache()
+        entry = cache.get(key)
+
+        if entry is None:
+            row = (
+                get_db()
+                .execute(
+                    "SELECT data, user, expires FROM session"
+                    " WHERE id = ? AND expires > ?",
+                    (key, int(time.time())),
+                )
+                .fetchone()
+            )
+
+            if row is None:
+                # unknown, expired or revoked, start over
+                return self.session_class()
+
+            entry = tuple(row)
+            cache.set(key, *entry)
+
+        data, user, expires = entry
+
+        if expires <= time.time():
+            return self.session_class()
+
+        return self.session_class(
+            self.serializer.loads(data),
+            token=token,
+            user=json.loads(user) if user else None,
+            expires=expires,
+        )
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        cookie = {
+            "domain": self.get_cookie_domain(app),
+            "path": self.get_cookie_path(app),
+            "secure": self.get_cookie_secure(app),
+            "samesite": self.get_cookie_samesite(app),
+            "httponly": self.get_cookie_httponly(app),
+        }
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.token is not None:
+                delete_session(session_key(session.token))
+                response.delete_cookie(name, **cookie)
+                response.vary.add("Cookie")
+
+            return
+
+        now = int(time.time())
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        user_id = session.get("user_id")
+        # a new id when the user changes, so an id planted before login
+        # is worth nothing after it
+        renew = session.token is None or user_id != session.original_user_id
+        # only push the expiry back once half the lifetime has passed
+        refresh = session.expires - now < lifetime // 2
+        user = session.user
+
+        if user_id is None:
+            user = None
+        elif user is None or user["id"] != user_id:
+            user = snapshot_user(g.user)
+
+        if not (renew or refresh or session.modified or user != session.user):
+            return
+
+        if renew:
+            if session.token is not None:
+                delete_session(session_key(session.token))
+
+            session.token = secrets.token_urlsafe(32)
+
+        expires = now + lifetime
+        write_session(
+            session_key(session.token),
+            user_id,
+            self.serializer.dumps(dict(session)),
+            None if user is None else json.dumps(user),
+            expires,
+        )
+        sweep_sessions(now)
+
+        if renew or refresh:
+            response.set_cookie(
+                name,
+                session.token,
+                expires=self.get_expiration_time(app, session),
+                **cookie,
+            )
+            response.vary.add("Cookie")
+
+
+def snapshot_user(row):
+    """The part of a user row saved with the session."""
+    if row is None:
+        return None
+
+    return {column: row[column] for column in USER_SNAPSHOT_COLUMNS}
+
+
+def _session_db():
+    db = get_db()
+
+    # work the view left uncommitted is rolled back when the connection
+    # goes back to the pool anyway, don't commit it with the session
+    if db.in_transaction:
+        db.rollback()
+
+    return db
+
+
+def write_session(key, user_id, data, user, expires):
+    db = _session_db()
+    db.execute(
+        "INSERT INTO session (id, user_id, data, user, expires) VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id,"
+        " data = excluded.data, user = excluded.user, expires = excluded.expires",
+        (key, user_id, data, user, expires),
+    )
+    db.commit()
+    get_session_cache().set(key, data, user, expires)
+
+
+def delete_session(key):
+    db = _session_db()
+    db.execute("DELETE FROM session WHERE id = ?", (key,))
+    db.commit()
+    get_session_cache().pop(key)
+
+
+def sweep_sessions(now=None):
+    """Delete expired sessions, at most every ``SESSION_SWEEP_INTERVAL``
+    seconds per process.
+
+    :return: the number of sessions deleted, or ``None`` if it was not
+        time yet
+    """
+    now = int(time.time()) if now is None else now
+    state = current_app.extensions.setdefault("flaskr.session_sweep", {"next": 0})
+
+    if now < state["next"]:
+        return None
+
+    state["next"] = now + current_app.config["SESSION_SWEEP_INTERVAL"]
+    db = _session_db()
+    deleted = db.execute("DELETE FROM session WHERE expires <= ?", (now,)).rowcount
+    db.commit()
+    return deleted
+
+
+def revoke_sessions(user_id):
+    """Log a user out everywhere, e.g. after a password change. Commits
+    the current transaction.
+    """
+    db = get_db()
+    db.execute("DELETE FROM session WHERE user_id = ?", (user_id,))
+    db.commit()
+    get_session_cache().forget_user(user_id)
+
+
+def forget_user_snapshots(user_id):
+    """Make the sessions of a user load the user row again. Call after
+    changing the row. Commits the current transaction.
+    """
+    db = get_db()
+    db.execute("UPDATE session SET user = NULL WHERE user_id = ?", (user_id,))
+    db.commit()
+    get_session_cache().forget_user(user_id)
+
+
+def init_app(app):
+    if app.config["SESSION_BACKEND"] == "sqlite":
+        app.session_interface = SqliteSessionInterface()
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import click
+from flask import current_app
+
+from .db import get_db
+
+# bytes read from the upload at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def content_path(digest, ext):
+    """``image_path`` of a stored file: sharded by the first two bytes of
+    its hash so no directory grows too large.
+    """
+    return f"uploads/{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+
+
+def folder_path(image_path):
+    """File system path of an ``uploads/...`` image path."""
+    name = image_path.split("/", 1)[1]
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], *name.split("/"))
+
+
+def store_upload(stream, ext):
+    """Copy an upload to the upload folder under its content hash.
+
+    The stream is written to a temporary file in chunks while it is
+    hashed, then moved into place. If a file with the same content is
+    already stored, the copy is discarded and the existing one reused.
+
+    :param stream: a readable binary file object
+    :param ext: file extension, without the dot
+    :return: the ``image_path`` to record on the post
+    """
+    folder = current_app.config["UPLOAD_FOLDER"]
+    os.makedirs(folder, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".upload-")
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while chunk := stream.read(CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+
+        image_path = content_path(digest.hexdigest(), ext.lower())
+        path = folder_path(image_path)
+
+        if os.path.exists(path):
+            # refresh the age so a concurrent cleanup keeps the file
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return image_path
+
+
+def variant_paths(image_path):
+    """The image and the thumbnails made from it."""
+    stem, ext = os.path.splitext(image_path)
+    return [image_path, f"{stem}.thumb{ext}", f"{stem}.thumb.webp"]
+
+
+def reference_count(db, image_path):
+    """Number of posts showing the image."""
+    return db.execute(
+        "SELECT count(*) FROM post WHERE image_path = ?", (image_path,)
+    ).fetchone()[0]
+
+
+def release_image(db, image_path):
+    """Delete a stored image and its thumbnails once no post references
+    it. Files changed in the last ``UPLOAD_GRACE_SECONDS`` are kept, they
+    may belong to an upload whose post is not committed yet.
+
+    Call after committing the change that dropped the reference.
+
+    :return: whether the files were deleted
+    """
+    if not image_path or reference_count(db, image_path):
+        return False
+
+    path = folder_path(image_path)
+
+    try:
+        age = time.time() - os.path.getmtime(path)
+    except OSError:
+        return False
+
+    if age < current_app.config["UPLOAD_GRACE_SECONDS"]:
+        return False
+
+    for variant in variant_paths(image_path):
+        try:
+            os.remove(folder_path(variant))
+        except FileNotFoundError:
+            pass
+
+    return True
+
+
+def collect_garbage(db):
+    """Delete every content addressed upload no post references.
+
+    :return: the ``image_path`` of the deleted images
+    """
+    folder = current_app.config["UPLOAD_FOLDER"]
+    referenced = {
+        row[0]
+        for row in db.execute(
+            "SELECT DISTINCT image_path FROM post WHERE image_path IS NOT NULL"
+        )
+    }
+    deleted = []
+
+    for dirpath, _, filenames in os.walk(folder):
+        shard = os.path.relpath(dirpath, folder).split(os.sep)
+
+        # only the sharded files are managed, leave anything else alone
+        if len(shard) != 2:
+            continue
+
+        for filename in filenames:
+            if ".thumb." in filename:
+                continue
+
+            image_path = "/".join(["uploads", *shard, filename])
+
+            if image_path not in referenced and release_image(db, image_path):
+                deleted.append(image_path)
+
+    return deleted
+
+
+@click.command("cleanup-uploads")
+def cleanup_uploads_command():
+    """Delete uploaded images that no post uses anymore."""
+    deleted = collect_garbage(get_db())
+    click.echo(f"Deleted {len(deleted)} unused images.")
+
+
+def init_app(app):
+    app.cli.add_command(cleanup_uploads_command)
@@ -0,0 +1,133 @@
+import os
+
+import click
+from flask import current_app
+from flask import has_request_context
+from flask import request
+from flask import stream_template
+from flask import url_for
+from jinja2 import FileSystemBytecodeCache
+
+# URLs remembered per app by cached_url_for
+URL_CACHE_SIZE = 4096
+
+# characters of a streamed page sent at once
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def cached_url_for(endpoint, **values):
+    """:func:`flask.url_for` for templates, remembering the URLs it built.
+
+    Pages build the same few URLs over and over (each tag, each post),
+    and building one takes far longer than a dict lookup. The URL only
+    depends on the arguments and the host and root the app is served
+    from, as this app registers no ``url_defaults``.
+    """
+    if not has_request_context() or endpoint.startswith("."):
+        return url_for(endpoint, **values)
+
+    try:
+        key = (
+            request.host_url,
+            request.script_root,
+            endpoint,
+            frozenset(values.items()),
+        )
+        hash(key)
+    except TypeError:
+        # a list or other unhashable argument
+        return url_for(endpoint, **values)
+
+    cache = current_app.extensions.setdefault("flaskr.url_cache", {})
+    url = cache.get(key)
+
+    if url is None:
+        url = url_for(endpoint, **values)
+
+        if len(cache) >= URL_CACHE_SIZE:
+            # drop everything rather than tracking recency, entries are cheap
+            cache.clear()
+
+        cache[key] = url
+
+    return url
+
+
+def stream_page(template_name, **context):
+    """Render a template as it is sent. Jinja yields every bit of output
+    on its own, those are joined into chunks of ``STREAM_CHUNK_SIZE``
+    characters so the server doesn't write them one by one.
+
+    The request context stays available until the page is done, see
+    :func:`flask.stream_template`.
+    """
+    return _join_chunks(stream_template(template_name, **context))
+
+
+def _join_chunks(chunks):
+    buffer = []
+    size = 0
+
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield "".join(buffer)
+
+
+class LazyBytecodeCache(FileSystemBytecodeCache):
+    """A :class:`~jinja2.FileSystemBytecodeCache` that creates its folder
+    on the first write, so creating an app doesn't touch the disk.
+    """
+
+    def dump_bytecode(self, bucket):
+        os.makedirs(self.directory, exist_ok=True)
+        super().dump_bytecode(bucket)
+
+
+def compile_templates(app):
+    """Load every template, so the bytecode cache holds all of them.
+
+    :return: the names of the templates
+    """
+    env = app.jinja_env
+    names = [
+        name for name in env.list_templates() if name.endswith((".html", ".xml"))
+    ]
+
+    for name in names:
+        env.get_template(name)
+
+    return names
+
+
+@click.command("compile-templates")
+def compile_templates_command():
+    """Compile the templates into the bytecode cache, so the first
+    requests of new workers don't compile them.
+    """
+    folder = current_app.config["TEMPLATE_CACHE_FOLDER"]
+
+    if folder is None:
+        raise click.ClickException("TEMPLATE_CACHE_FOLDER is not set.")
+
+    names = compile_templates(current_app)
+    click.echo(f"Compiled {len(names)} templates to {folder}.")
+
+
+def init_app(app):
+    folder = app.config["TEMPLATE_CACHE_FOLDER"]
+
+    if folder is not None:
+        # compiled templates are reused by every worker and restart,
+        # a changed source is compiled again
+        app.jinja_env.bytecode_cache = LazyBytecodeCache(folder)
+
+    app.jinja_env.globals["url_for"] = cached_url_for
+    app.cli.add_command(compile_templates_command)
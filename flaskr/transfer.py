@@ -0,0 +1,430 @@
+import itertools
+import json
+import time
+from contextlib import contextmanager
+
+import click
+
+from .blog import get_tag_ids
+from .cache import get_cache
+from .db import get_db
+from .feed import refresh_feeds
+
+# records written per transaction
+BATCH_SIZE = 1000
+# names looked up per SELECT ... IN, below SQLite's variable limit
+LOOKUP_BATCH_SIZE = 500
+# the tables whose indexes and triggers are set aside while importing
+IMPORT_TABLES = ("post", "comment", "user_like", "post_tag")
+
+
+class InvalidRecord(ValueError):
+    """A line of the import file can't be imported."""
+
+
+class _Children:
+    """Rows of a query ordered by ``post_id``, taken one post at a time
+    while the posts are read in the same order.
+    """
+
+    def __init__(self, cursor):
+        self.rows = iter(cursor)
+        self.next = next(self.rows, None)
+
+    def take(self, post_id):
+        taken = []
+
+        while self.next is not None and self.next["post_id"] <= post_id:
+            if self.next["post_id"] == post_id:
+                taken.append(self.next)
+
+            self.next = next(self.rows, None)
+
+        return taken
+
+
+def export_records(db):
+    """Yield the users, then every post with its tags, comments and
+    likes, as JSON serialisable records.
+
+    Each table is read by one query in post order and the results are
+    merged, so memory use doesn't grow with the number of posts.
+    """
+    for row in db.execute("SELECT username, password, alias FROM user ORDER BY id"):
+        yield {"type": "user", **dict(row)}
+
+    tags = _Children(
+        db.execute(
+            "SELECT pt.post_id, t.name FROM post_tag pt JOIN tag t ON t.id = pt.tag_id"
+            " ORDER BY pt.post_id, pt.tag_id"
+        )
+    )
+    comments = _Children(
+        db.execute(
+            "SELECT c.post_id, u.username, c.body, c.created"
+            " FROM comment c JOIN user u ON u.id = c.user_id"
+            " ORDER BY c.post_id, c.created, c.id"
+        )
+    )
+    likes = _Children(
+        db.execute(
+            "SELECT l.post_id, u.username, l.created"
+            " FROM user_like l JOIN user u ON u.id = l.user_id ORDER BY l.post_id"
+        )
+    )
+
+    for post in db.execute(
+        "SELECT p.id, u.username, p.created, p.title, p.body, p.image_path"
+        " FROM post p JOIN user u ON u.id = p.author_id ORDER BY p.id"
+    ):
+        yield {
+            "type": "post",
+            "author": post["username"],
+            "created": str(post["created"]),
+            "title": post["title"],
+            "body": post["body"],
+            "image_path": post["image_path"],
+            "tags": [row["name"] for row in tags.take(post["id"])],
+            "comments": [
+                {
+                    "author": row["username"],
+                    "body": row["body"],
+                    "created": str(row["created"]),
+                }
+                for row in comments.take(post["id"])
+            ],
+            "likes": [
+                {"user": row["username"], "created": str(row["created"])}
+                for row in likes.take(post["id"])
+            ],
+        }
+
+
+def read_records(lines):
+    """Parse JSON Lines one line at a time.
+
+    :return: an iterator of ``(line_number, record)``
+    """
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise InvalidRecord(f"Line {number}: {e}") from None
+
+        if record.get("type") not in ("user", "post"):
+            raise InvalidRecord(f"Line {number}: unknown record type.")
+
+        yield number, record
+
+
+def next_post_id(db):
+    """The first id AUTOINCREMENT would give a new post."""
+    return db.execute(
+        "SELECT max(coalesce((SELECT max(id) FROM post), 0),"
+        " coalesce((SELECT seq FROM sqlite_sequence WHERE name = 'post'), 0)) + 1"
+    ).fetchone()[0]
+
+
+@contextmanager
+def deferred_indexes(db):
+    """Set aside the indexes and triggers of the post tables while rows
+    are bulk inserted, then recreate them with :func:`restore_indexes`.
+
+    What is set aside is recorded in ``deferred_schema`` by the
+    transaction that drops it, so if the process dies during the import,
+    ``flask migrate-db`` or the next import puts it back.
+
+    Other writers must not change those tables meanwhile, their rows
+    would be missing from the maintained data.
+    """
+    # left by an import that died
+    restore_indexes(db)
+    marks = ", ".join("?" * len(IMPORT_TABLES))
+
+    db.execute("BEGIN IMMEDIATE")
+
+    try:
+        saved = db.execute(
+            "SELECT name, type, sql FROM sqlite_master"
+            f" WHERE type IN ('index', 'trigger') AND tbl_name IN ({marks})"
+            " AND sql IS NOT NULL",
+            IMPORT_TABLES,
+        ).fetchall()
+        first_id = next_post_id(db)
+        db.executemany(
+            "INSERT INTO deferred_schema (name, type, sql, first_post_id)"
+            " VALUES (?, ?, ?, ?)",
+            [(*row, first_id) for row in saved],
+        )
+
+        for name, kind, _ in saved:
+            db.execute(f'DROP {kind.upper()} "{name}"')
+
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    try:
+        yield
+    finally:
+        restore_indexes(db)
+
+
+def restore_indexes(db):
+    """Recreate the indexes and triggers recorded in ``deferred_schema``
+    and rebuild what the triggers would have kept up to date: counters,
+    like and comment counts, the search index and the content version.
+
+    :return: whether anything was set aside
+    """
+    db.execute("BEGIN IMMEDIATE")
+
+    try:
+        saved = db.execute(
+            "SELECT type, sql, first_post_id FROM deferred_schema ORDER BY type"
+        ).fetchall()
+
+        if not saved:
+            db.rollback()
+            return False
+
+        first_id = saved[0]["first_post_id"]
+
+        # indexes first, the rebuild below reads through them
+        for kind, sql, _ in saved:
+            if kind == "index":
+                db.execute(sql)
+
+        db.execute(
+            "INSERT OR REPLACE INTO counter (name, value)"
+            " SELECT 'post', count(*) FROM post"
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO tag_stats (tag_id, post_count, last_used)"
+            " SELECT pt.tag_id, count(*), max(p.created)"
+            " FROM post_tag pt JOIN post p ON p.id = pt.post_id GROUP BY pt.tag_id"
+        )
+        db.execute(
+            "UPDATE post SET"
+            " like_count = (SELECT count(*) FROM user_like WHERE post_id = post.id),"
+            " comment_count = (SELECT count(*) FROM comment WHERE post_id = post.id)"
+        )
+        db.execute(
+            "INSERT INTO post_fts (rowid, title, body)"
+            " SELECT id, title, body FROM post WHERE id >= ?",
+            (first_id,),
+        )
+        db.execute(
+            "UPDATE post SET modified = CAST(strftime('%s', 'now') AS INTEGER)"
+            " WHERE id >= ?",
+            (first_id,),
+        )
+        db.execute(
+            "UPDATE counter SET value = value + 1 WHERE name = 'content_version'"
+        )
+        db.execute(
+            "UPDATE counter SET value = CAST(strftime('%s', 'now') AS INTEGER)"
+            " WHERE name = 'content_modified'"
+        )
+
+        for kind, sql, _ in saved:
+            if kind == "trigger":
+                db.execute(sql)
+
+        db.execute("DELETE FROM deferred_schema")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    return True
+
+
+def _user_ids(db, usernames):
+    ids = {}
+    usernames = list(usernames)
+
+    for start in range(0, len(usernames), LOOKUP_BATCH_SIZE):
+        batch = usernames[start:start + LOOKUP_BATCH_SIZE]
+        marks = ", ".join("?" * len(batch))
+
+        for row in db.execute(
+            f"SELECT username, id FROM user WHERE username IN ({marks})", batch
+        ):
+            ids[row[0]] = row[1]
+
+    return ids
+
+
+def import_batch(db, batch, counts):
+    """Write one batch of ``(line_number, record)`` in one transaction.
+    Users that already exist are kept as they are.
+    """
+    users = [record for _, record in batch if record["type"] == "user"]
+    posts = [(number, record) for number, record in batch if record["type"] == "post"]
+
+    db.execute("BEGIN IMMEDIATE")
+
+    try:
+        # existing users are skipped, only count the inserted ones
+        added_users = db.executemany(
+            "INSERT OR IGNORE INTO user (username, password, alias) VALUES (?, ?, ?)",
+            [(u["username"], u["password"], u.get("alias")) for u in users],
+        ).rowcount
+
+        usernames = set()
+        tag_names = set()
+
+        for _, post in posts:
+            usernames.add(post["author"])
+            usernames.update(c["author"] for c in post.get("comments", ()))
+            usernames.update(like["user"] for like in post.get("likes", ()))
+            tag_names.update(t.strip() for t in post.get("tags", ()) if t.strip())
+
+        user_ids = _user_ids(db, usernames)
+        tag_ids = get_tag_ids(db, tag_names)
+        post_id = next_post_id(db)
+        post_rows, tag_rows, comment_rows, like_rows = [], [], [], []
+
+        for number, post in posts:
+            try:
+                post_rows.append(
+                    (
+                        post_id,
+                        user_ids[post["author"]],
+                        post.get("created"),
+                        post["title"],
+                        post.get("body", ""),
+                        post.get("image_path"),
+                    )
+                )
+                tag_rows.extend(
+                    (post_id, tag_ids[name])
+                    for name in {t.strip() for t in post.get("tags", ()) if t.strip()}
+                )
+                comment_rows.extend(
+                    (user_ids[c["author"]], post_id, c.get("created"), c["body"])
+                    for c in post.get("comments", ())
+                )
+                like_rows.extend(
+                    (user_ids[like["user"]], post_id, like.get("created"))
+                    for like in post.get("likes", ())
+                )
+            except KeyError as e:
+                raise InvalidRecord(f"Line {number}: unknown user or missing field {e}.")
+
+            post_id += 1
+
+        db.executemany(
+            "INSERT INTO post (id, author_id, created, title, body, image_path)"
+            " VALUES (?, ?, coalesce(?, CURRENT_TIMESTAMP), ?, ?, ?)",
+            post_rows,
+        )
+        db.executemany(
+            "INSERT INTO post_tag (post_id, tag_id) VALUES (?, ?)", tag_rows
+        )
+        db.executemany(
+            "INSERT INTO comment (user_id, post_id, created, body)"
+            " VALUES (?, ?, coalesce(?, CURRENT_TIMESTAMP), ?)",
+            comment_rows,
+        )
+        db.executemany(
+            "INSERT OR IGNORE INTO user_like (user_id, post_id, created)"
+            " VALUES (?, ?, coalesce(?, CURRENT_TIMESTAMP))",
+            like_rows,
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    counts["users"] += added_users
+    counts["posts"] += len(post_rows)
+    counts["tags"] += len(tag_rows)
+    counts["comments"] += len(comment_rows)
+    counts["likes"] += len(like_rows)
+
+
+def import_records(db, records, batch_size=BATCH_SIZE, progress=None):
+    """Import ``(line_number, record)`` pairs as read by
+    :func:`read_records`, ``batch_size`` records per transaction.
+
+    Only one batch is held in memory. A batch that fails is rolled back,
+    the batches before it stay imported.
+
+    :param progress: called with the counts after every batch
+    :return: ``{"users": n, "posts": n, "tags": n, "comments": n,
+        "likes": n}``
+    """
+    counts = dict.fromkeys(("users", "posts", "tags", "comments", "likes"), 0)
+    records = iter(records)
+
+    with deferred_indexes(db):
+        while batch := list(itertools.islice(records, batch_size)):
+            import_batch(db, batch, counts)
+
+            if progress is not None:
+                progress(counts)
+
+    refresh_feeds(db)
+    db.commit()
+    # misses cached for the ids just taken
+    get_cache().clear()
+    return counts
+
+
+def _rate(rows, started):
+    return rows / max(time.perf_counter() - started, 1e-9)
+
+
+@click.command("import-posts")
+@click.argument("input", type=click.File("r", encoding="utf-8"), default="-")
+@click.option("--batch-size", default=BATCH_SIZE, show_default=True)
+def import_posts_command(input, batch_size):
+    """Import users and posts from a JSON Lines file, as written by
+    export-posts.
+    """
+    started = time.perf_counter()
+
+    def progress(counts):
+        rows = sum(counts.values())
+        click.echo(f"{rows} rows, {_rate(rows, started):.0f} rows/s", err=True)
+
+    try:
+        counts = import_records(get_db(), read_records(input), batch_size, progress)
+    except InvalidRecord as e:
+        raise click.ClickException(str(e)) from None
+
+    rows = sum(counts.values())
+    click.echo(
+        f"Imported {counts['posts']} posts, {counts['comments']} comments,"
+        f" {counts['likes']} likes and {counts['users']} users"
+        f" in {time.perf_counter() - started:.1f}s"
+        f" ({_rate(rows, started):.0f} rows/s)."
+    )
+
+
+@click.command("export-posts")
+@click.argument("output", type=click.File("w", encoding="utf-8"), default="-")
+def export_posts_command(output):
+    """Write every user and post to a JSON Lines file."""
+    started = time.perf_counter()
+    count = 0
+
+    for record in export_records(get_db()):
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+
+    # the file may be stdout, report on stderr
+    click.echo(
+        f"Exported {count} records ({_rate(count, started):.0f} records/s).", err=True
+    )
+
+
+def init_app(app):
+    app.cli.add_command(import_posts_command)
+    app.cli.add_command(export_posts_command)
@@ -1,9 +1,11 @@
 import os
+import shutil
 import tempfile
 
 import pytest
 
 from flaskr import create_app
+from flaskr import shutdown
 from flaskr.db import get_db
 from flaskr.db import init_db
 
@@ -12,13 +14,48 @@ with open(os.path.join(os.path.dirname(__file__), "data.sql"), "rb") as f:
     _data_sql = f.read().decode("utf8")
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark", action="store_true", help="run the benchmarks as well"
+    )
+    parser.addoption(
+        "--benchmark-save",
+        action="store_true",
+        help="run the benchmarks and save the results as the baseline",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Benchmarks are slow, only run them when asked to."""
+    if config.getoption("--benchmark") or config.getoption("--benchmark-save"):
+        return
+
+    skip = pytest.mark.skip(reason="run with --benchmark")
+
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def app():
     """Create and configure a new app instance for each test."""
     # create a temporary file to isolate the database for each test
     db_fd, db_path = tempfile.mkstemp()
+    upload_folder = tempfile.mkdtemp()
     # create the app with common test config
-    app = create_app({"TESTING": True, "DATABASE": db_path})
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": db_path,
+            "UPLOAD_FOLDER": upload_folder,
+            "TEMPLATE_CACHE_FOLDER": None,
+            "CACHE_FOLDER": None,
+            # the hashes in data.sql, hashed in the test's thread
+            "PASSWORD_HASH_METHOD": "pbkdf2:sha256:50000",
+            "PASSWORD_HASH_PROCESSES": 0,
+        }
+    )
 
     # create the database and load test data
     with app.app_context():
@@ -27,7 +64,9 @@ def app():
 
     yield app
 
-    # close and remove the temporary database
+    # finish background jobs, close and remove the temporary database
+    shutdown(app)
+    shutil.rmtree(upload_folder)
     os.close(db_fd)
     os.unlink(db_path)
 
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from flaskr import shutdown
+from flaskr.asgi import create_asgi_app
+
+
+def asgi_app_for(app):
+    return create_asgi_app(
+        {"TESTING": True, "DATABASE": app.config["DATABASE"], "TEMPLATE_CACHE_FOLDER": None}
+    )
+
+
+def close(asgi_app):
+    asgi_app.executor.shutdown()
+    shutdown(asgi_app.app)
+
+
+async def request(asgi_app, path):
+    sent = []
+    received = False
+
+    async def receive():
+        nonlocal received
+
+        if received:
+            # the request is done, wait like a connected client would
+            await asyncio.sleep(3600)
+
+        received = True
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+    await asgi_app(scope, receive, send)
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def test_asgi(app):
+    asgi_app = asgi_app_for(app)
+
+    try:
+        status, body = asyncio.run(request(asgi_app, "/1"))
+    finally:
+        close(asgi_app)
+
+    assert status == 200
+    assert b"test title" in body
+
+
+def test_asgi_concurrent_requests(app):
+    asgi_app = asgi_app_for(app)
+    delay = 0.3
+
+    @asgi_app.app.route("/slow")
+    def slow():
+        time.sleep(delay)
+        return "done"
+
+    async def overlapping(count):
+        return await asyncio.gather(*(request(asgi_app, "/slow") for _ in range(count)))
+
+    count = asgi_app.app.config["DATABASE_POOL_SIZE"]
+    started = time.perf_counter()
+
+    try:
+        responses = asyncio.run(overlapping(count))
+    finally:
+        close(asgi_app)
+
+    assert responses == [(200, b"done")] * count
+    # served side by side, not one after the other
+    assert time.perf_counter() - started < delay * 2
@@ -1,7 +1,9 @@
 import pytest
 from flask import g
 from flask import session
+from flask.sessions import SecureCookieSessionInterface
 
+from flaskr.auth import invalidate_user
 from flaskr.db import get_db
 
 
@@ -67,3 +69,57 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert "user_id" not in session
+
+
+@pytest.fixture
+def cookie_sessions(app):
+    # without the copy of the user saved in server side sessions
+    app.session_interface = SecureCookieSessionInterface()
+
+
+def trace_user_queries(app):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    return lambda: [sql for sql in statements if sql.startswith("SELECT * FROM user WHERE id")]
+
+
+def test_user_is_loaded_lazily(client, auth, app, cookie_sessions):
+    user_queries = trace_user_queries(app)
+    auth.login()
+
+    # the feed never looks at g.user
+    client.get("/feed")
+    assert user_queries() == []
+
+    client.get("/")
+    assert len(user_queries()) == 1
+
+
+def test_user_cache(client, auth, app, cookie_sessions):
+    user_queries = trace_user_queries(app)
+    auth.login()
+    client.get("/")
+    client.get("/")
+    assert len(user_queries()) == 1
+
+    with app.app_context():
+        invalidate_user(1)
+
+    client.get("/")
+    assert len(user_queries()) == 2
+
+    app.config["USER_CACHE_TTL"] = 0
+    with app.app_context():
+        invalidate_user(1)
+    client.get("/")
+    client.get("/")
+    assert len(user_queries()) == 4
+
+
+def test_user_outside_request(app):
+    with app.app_context():
+        assert g.user is None
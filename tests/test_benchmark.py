@@ -0,0 +1,256 @@
+"""Latency and throughput benchmarks for the blog routes.
+
+Skipped unless pytest runs with ``--benchmark``. The dataset size and
+load are set with environment variables::
+
+    FLASKR_BENCH_POSTS=2000 FLASKR_BENCH_THREADS=8 pytest --benchmark
+
+Results are compared with the baseline in ``.benchmarks/flaskr.json``
+if there is one, a p95 more than ``FLASKR_BENCH_TOLERANCE`` times the
+baseline fails. ``--benchmark-save`` writes the results as the new
+baseline.
+"""
+import json
+import os
+import random
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.serving import make_server
+
+from flaskr.blog import markdown_filter
+from flaskr.db import get_db
+from flaskr.transfer import import_records
+
+pytestmark = pytest.mark.benchmark
+
+POSTS = int(os.environ.get("FLASKR_BENCH_POSTS", 2000))
+TAGS = int(os.environ.get("FLASKR_BENCH_TAGS", 50))
+USERS = int(os.environ.get("FLASKR_BENCH_USERS", 100))
+COMMENTS = int(os.environ.get("FLASKR_BENCH_COMMENTS", 5))  # per post
+LIKES = int(os.environ.get("FLASKR_BENCH_LIKES", 5))  # per post
+REQUESTS = int(os.environ.get("FLASKR_BENCH_REQUESTS", 200))
+THREADS = int(os.environ.get("FLASKR_BENCH_THREADS", 8))
+TOLERANCE = float(os.environ.get("FLASKR_BENCH_TOLERANCE", 1.5))
+
+BASELINE = os.path.join(os.path.dirname(__file__), "..", ".benchmarks", "flaskr.json")
+# password "test", the same hash as the test user in data.sql
+PASSWORD_HASH = (
+    "pbkdf2:sha256:50000$TCI4GzcX$"
+    "0de171a4f4dac32e3364c7ddc7c14f3e2fa61f2d17574483f7ffbb431b4acb2f"
+)
+WORDS = (
+    "flask sqlite python template request response cache index query "
+    "thread server route blog post tag comment markdown feed user"
+).split()
+
+results = {}
+
+
+def paragraph(rng, words=60):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def markdown_body(rng):
+    """A post body using the Markdown features the blog renders."""
+    return "\n\n".join(
+        [
+            f"## {paragraph(rng, 4)}",
+            paragraph(rng),
+            "\n".join(f"- {paragraph(rng, 6)}" for _ in range(4)),
+            f"```python\nprint({rng.randint(0, 100)})\n```",
+            f"| a | b |\n|---|---|\n| {rng.choice(WORDS)} | {rng.choice(WORDS)} |",
+            paragraph(rng),
+        ]
+    )
+
+
+def synthetic_records(rng):
+    """Users and posts for :func:`flaskr.transfer.import_records`."""
+    users = [f"bench{i}" for i in range(USERS)]
+
+    for name in users:
+        yield 0, {"type": "user", "username": name, "password": PASSWORD_HASH}
+
+    for i in range(POSTS):
+        yield 0, {
+            "type": "post",
+            "author": rng.choice(users),
+            "created": f"2024-01-01 00:00:{i % 60:02}",
+            "title": paragraph(rng, 5),
+            "body": markdown_body(rng),
+            "tags": rng.sample([f"tag{t}" for t in range(TAGS)], min(3, TAGS)),
+            "comments": [
+                {"author": rng.choice(users), "body": paragraph(rng, 20)}
+                for _ in range(COMMENTS)
+            ],
+            "likes": [{"user": name} for name in rng.sample(users, min(LIKES, USERS))],
+        }
+
+
+@pytest.fixture
+def dataset(app):
+    with app.app_context():
+        import_records(get_db(), synthetic_records(random.Random(0)))
+
+    return app
+
+
+@pytest.fixture(scope="module", autouse=True)
+def report(request):
+    """Print the results of the module, then save or compare them."""
+    yield
+
+    if not results:
+        return
+
+    terminal = request.config.pluginmanager.get_plugin("terminalreporter")
+    capture = request.config.pluginmanager.get_plugin("capturemanager")
+    rows = [f"{'benchmark':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"]
+    rows.extend(
+        f"{name:<24}{r['p50']:>10.2f}{r['p95']:>10.2f}{r['p99']:>10.2f}{r['rps']:>10.0f}"
+        for name, r in sorted(results.items())
+    )
+
+    with capture.global_and_fixture_disabled():
+        terminal.write_line("")
+
+        for row in rows:
+            terminal.write_line(row)
+
+    if request.config.getoption("--benchmark-save"):
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+
+        with open(BASELINE, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+def summarize(name, latencies, elapsed):
+    """Record percentiles in milliseconds and throughput, and compare
+    them with the baseline.
+    """
+    cuts = statistics.quantiles(latencies, n=100)
+    result = results[name] = {
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+        "rps": len(latencies) / elapsed,
+    }
+
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f).get(name)
+
+        if baseline is not None:
+            assert result["p95"] <= baseline["p95"] * TOLERANCE, (
+                f"{name}: p95 {result['p95']:.2f} ms,"
+                f" baseline {baseline['p95']:.2f} ms"
+            )
+
+
+def run(name, call, count=REQUESTS):
+    """Time ``call`` ``count`` times in a row."""
+    call()  # warm up
+    latencies = []
+    started = time.perf_counter()
+
+    for _ in range(count):
+        t = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t)
+
+    summarize(name, latencies, time.perf_counter() - started)
+
+
+def get(client, path):
+    def call():
+        response = client.get(path)
+        assert response.status_code == 200
+
+    return call
+
+
+@pytest.mark.parametrize(
+    "name, path",
+    [
+        ("index", "/"),
+        ("index_tag", "/?tag=tag1"),
+        ("index_search", "/?q=flask"),
+        ("index_page", "/?page=50"),
+        ("index_long", "/?per_page=100"),
+        ("detail", "/10"),
+        ("feed", "/feed"),
+    ],
+)
+def test_route(dataset, name, path):
+    run(name, get(dataset.test_client(), path))
+
+
+def test_index_first_chunk(dataset):
+    """Time to the first chunk of a long, streamed, index page."""
+    client = dataset.test_client()
+
+    def call():
+        response = client.get("/?per_page=100")
+        assert next(iter(response.response))
+        response.close()
+
+    run("index_long_first_chunk", call)
+
+
+def test_detail_logged_in(dataset, auth):
+    auth.login()
+    run("detail_logged_in", get(auth._client, "/10"))
+
+
+def test_login(dataset):
+    client = dataset.test_client()
+    # time the password check, not the rate limiter turning logins away
+    dataset.config["LOGIN_RATE_LIMITS"] = {"username": (10**6, 1), "ip": (10**6, 1)}
+
+    def call():
+        response = client.post(
+            "/auth/login", data={"username": "bench1", "password": "test"}
+        )
+        assert response.status_code == 302
+
+    run("login", call, count=max(REQUESTS // 10, 10))
+
+
+def test_markdown_filter():
+    body = markdown_body(random.Random(0))
+    run("markdown_filter", lambda: markdown_filter(body))
+
+
+@pytest.mark.parametrize("path", ["/", "/10", "/feed"])
+def test_threaded_server(dataset, path):
+    """Concurrent requests to a real multi-threaded WSGI server."""
+    server = make_server("127.0.0.1", 0, dataset, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}{path}"
+
+    def fetch(_):
+        t = time.perf_counter()
+
+        with urllib.request.urlopen(url) as response:
+            response.read()
+
+        return time.perf_counter() - t
+
+    try:
+        fetch(None)
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(THREADS) as executor:
+            latencies = list(executor.map(fetch, range(REQUESTS)))
+
+        summarize(f"server {path}", latencies, time.perf_counter() - started)
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
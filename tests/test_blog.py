@@ -1,5 +1,12 @@
+import re
+from html import unescape
+
 import pytest
 
+from flaskr import create_app
+from flaskr import shutdown
+from flaskr.blog import get_tag_ids
+from flaskr.blog import save_tags
 from flaskr.db import get_db
 
 
@@ -81,3 +88,451 @@ def test_delete(client, auth, app):
         db = get_db()
         post = db.execute("SELECT * FROM post WHERE id = 1").fetchone()
         assert post is None
+
+
+def add_posts(app, count, tag=None):
+    with app.app_context():
+        db = get_db()
+        for i in range(count):
+            cursor = db.execute(
+                "INSERT INTO post (title, body, author_id, created)"
+                " VALUES (?, '', 1, datetime('2019-01-01', ?))",
+                (f"post {i:03}", f"+{i // 2} days"),
+            )
+            if tag and i % 2:
+                db.execute("INSERT OR IGNORE INTO tag (name) VALUES (?)", (tag,))
+                db.execute(
+                    "INSERT INTO post_tag (post_id, tag_id)"
+                    " SELECT ?, id FROM tag WHERE name = ?",
+                    (cursor.lastrowid, tag),
+                )
+        db.commit()
+
+
+def walk_pages(client, url, link="Next"):
+    titles = []
+    while url:
+        html = client.get(url).data.decode()
+        titles.extend(re.findall(r"<h1><a href=/\d+>(.*?)</a></h1>", html))
+        match = re.search(rf'<a href="([^"]*)">{link}</a>', html)
+        url = unescape(match.group(1)) if match else None
+    return titles, html
+
+
+def test_index_cursor_pagination(client, app):
+    # pairs of posts share a created timestamp, the id breaks the tie
+    add_posts(app, 11)
+    titles, html = walk_pages(client, "/?per_page=3")
+    assert titles == [f"post {i:03}" for i in (10, 9, 8, 7, 6, 5, 4, 3, 2, 1, 0)] + [
+        "test title"
+    ]
+    assert "Page 4 of 4" in html
+
+    # walking back from the last page visits pages 3, 2 and 1
+    prev = unescape(re.search(r'<a href="([^"]*)">Previous</a>', html).group(1))
+    back, html = walk_pages(client, prev, "Previous")
+    assert back == titles[6:9] + titles[3:6] + titles[0:3]
+    assert "Page 1 of 4" in html
+
+
+def test_index_cursor_with_tag(client, app):
+    add_posts(app, 10, tag="odd")
+    titles, _ = walk_pages(client, "/?per_page=2&tag=odd")
+    assert titles == [f"post {i:03}" for i in (9, 7, 5, 3, 1)]
+
+
+def test_index_cursor_beyond_page_100(client, app):
+    add_posts(app, 3)
+    response = client.get("/?per_page=1&page=150&after=2019-01-02+00:00:00,4")
+    assert b"post 001" in response.data
+    assert b"Page 150 of" in response.data
+
+
+def test_index_bad_cursor(client):
+    response = client.get("/?after=garbage")
+    assert response.status_code == 200
+    assert b"test title" in response.data
+
+
+def test_post_counters(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "a", "body": "", "tags": "x, y"})
+    client.post("/create", data={"title": "b", "body": "", "tags": "x"})
+    client.post("/3/update", data={"title": "b", "body": "", "tags": "y"})
+    client.get("/2/delete")
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()[0] == 2
+        counts = dict(
+            db.execute(
+                "SELECT t.name, s.post_count FROM tag_stats s JOIN tag t ON s.tag_id = t.id"
+            ).fetchall()
+        )
+        # "x" has no posts left and is deleted
+        assert counts == {"y": 1}
+
+    assert b"Page 1 of 1" in client.get("/?tag=y&per_page=1").data
+    assert b"Page 1 of 0" in client.get("/?tag=x").data
+    assert b"Page 2 of 2" in client.get("/?per_page=1&page=2").data
+
+
+def test_orphan_tags_are_deleted(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "a", "body": "", "tags": "x, y"})
+    client.post("/create", data={"title": "b", "body": "", "tags": "x"})
+    client.post("/2/update", data={"title": "a", "body": "", "tags": "y"})
+    client.post("/3/update", data={"title": "b", "body": "", "tags": ""})
+
+    with app.app_context():
+        db = get_db()
+        assert [tuple(row) for row in db.execute("SELECT name FROM tag")] == [("y",)]
+        assert db.execute("SELECT count(*) FROM tag_stats").fetchone()[0] == 1
+
+    client.get("/2/delete")
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("SELECT count(*) FROM tag").fetchone()[0] == 0
+        assert db.execute("SELECT count(*) FROM tag_stats").fetchone()[0] == 0
+
+
+def test_tag_index(client, auth, app):
+    assert b"No tags yet." in client.get("/tags").data
+
+    auth.login()
+    client.post("/create", data={"title": "a", "body": "", "tags": "b, c"})
+    client.post("/create", data={"title": "b", "body": "", "tags": "c"})
+    client.post("/create", data={"title": "c", "body": "", "tags": "a, c"})
+
+    response = client.get("/tags")
+    assert b'href="/?tag=c"' in response.data
+    assert b'title="3 posts"' in response.data
+
+    tags = client.get("/tags.json").get_json()["tags"]
+    assert [(tag["name"], tag["post_count"]) for tag in tags] == [
+        ("c", 3),
+        ("b", 1),
+        ("a", 1),
+    ]
+    assert all(tag["last_used"] for tag in tags)
+
+    names = [tag["name"] for tag in client.get("/tags.json?sort=name").get_json()["tags"]]
+    assert names == ["a", "b", "c"]
+
+
+def test_tag_index_sorts_all_tags(client, app, monkeypatch):
+    monkeypatch.setattr("flaskr.blog.TAG_INDEX_SIZE", 2)
+    add_posts(app, 4)
+
+    with app.app_context():
+        db = get_db()
+        save_tags(db, 1, "popular, zz")
+        save_tags(db, 2, "popular")
+        save_tags(db, 3, "popular, zz")
+        # one post, but the newest and the first by name
+        save_tags(db, 4, "aa")
+        db.execute(
+            "UPDATE tag_stats SET last_used = '2030-01-01'"
+            " WHERE tag_id = (SELECT id FROM tag WHERE name = 'aa')"
+        )
+        db.commit()
+
+    def names(sort):
+        tags = client.get(f"/tags.json?sort={sort}").get_json()["tags"]
+        return [tag["name"] for tag in tags]
+
+    assert names("popular") == ["popular", "zz"]
+    assert names("recent")[0] == "aa"
+    assert names("name") == ["aa", "popular"]
+
+
+def test_tag_index_does_not_group(client, app):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    client.get("/tags.json")
+    assert not [sql for sql in statements if "post_tag" in sql]
+
+
+def test_index_streamed(client, app, monkeypatch):
+    add_posts(app, 60)
+    monkeypatch.setattr("flaskr.templating.STREAM_CHUNK_SIZE", 1024)
+    response = client.get("/?per_page=50")
+    # sent chunked, the length isn't known up front
+    assert "Content-Length" not in response.headers
+
+    chunks = list(response.response)
+    assert len(chunks) > 2
+    first = b"".join(chunks[:1])
+    # the newest posts are sent before the older ones are rendered
+    assert b"post 059" in first
+    assert b"post 010" not in first
+    # the links after the list know where the page ended
+    assert b"after=2019-01-06" in chunks[-1]
+
+    # the same page as without streaming
+    app.config["STREAM_MIN_PER_PAGE"] = None
+    response = client.get("/?per_page=50")
+    assert "Content-Length" in response.headers
+    assert b"".join(chunks) == response.data
+
+
+@pytest.mark.parametrize("query", ("?per_page=20&page=2", "?per_page=20&q=post&page=2"))
+def test_index_streamed_pages(client, app, query):
+    add_posts(app, 50)
+    streamed = client.get("/" + query)
+    assert "Content-Length" not in streamed.headers
+    app.config["STREAM_MIN_PER_PAGE"] = None
+    assert streamed.get_data() == client.get("/" + query).data
+
+
+def test_index_does_not_count_rows(client, app):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    client.get("/")
+    client.get("/?tag=x")
+    assert not [sql for sql in statements if "count(" in sql.lower()]
+
+
+def test_search_count_is_cached(client, app):
+    app.config["SEARCH_COUNT_TTL"] = 60
+    assert b"Page 1 of 0" in client.get("/?q=post&per_page=1").data
+    add_posts(app, 3)
+
+    # the total is reused until it expires
+    response = client.get("/?q=post&per_page=1")
+    assert b"post 002" in response.data
+    assert b"Page 1 of 0" in response.data
+
+    app.extensions["flaskr.cache"].clear()
+    app.extensions["flaskr.response_cache"].clear()
+    assert b"Page 1 of 3" in client.get("/?q=post&per_page=1").data
+
+
+def test_search(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "flask tips", "body": "use <b>blueprints</b>"})
+    client.post("/create", data={"title": "other", "body": "flask in the body"})
+    client.post("/create", data={"title": "django", "body": "", "tags": "web"})
+
+    html = client.get("/?q=flask").data.decode()
+    titles = re.findall(r"<h1><a href=/\d+>(.*?)</a></h1>", html)
+    # title matches rank above body matches
+    assert titles == ["flask tips", "other"]
+    assert "<mark>flask</mark> in the body" in html
+    # snippets are escaped before highlighting
+    assert "&lt;b&gt;<mark>blueprints</mark>&lt;/b&gt;" in client.get("/?q=blue").data.decode()
+
+    # prefix queries and several words
+    assert b"flask tips" in client.get("/?q=fla+tip").data
+    assert b"flask tips" not in client.get("/?q=flask+django").data
+    # search combined with a tag
+    assert b"django" in client.get("/?q=djan&tag=web").data
+    assert b"django" not in client.get("/?q=djan&tag=other").data
+    # FTS5 syntax is not interpreted
+    assert client.get('/?q="AND+NOT+(').status_code == 200
+
+
+def test_search_follows_updates(client, auth, app):
+    auth.login()
+    client.post("/1/update", data={"title": "renamed", "body": "fresh words"})
+    assert b"renamed" in client.get("/?q=fresh").data
+    assert b"renamed" not in client.get("/?q=test").data
+
+    client.get("/1/delete")
+    assert b"renamed" not in client.get("/?q=fresh").data
+
+
+def test_search_pagination(client, app):
+    add_posts(app, 5)
+    titles, html = walk_pages(client, "/?q=post&per_page=2")
+    assert sorted(titles) == [f"post {i:03}" for i in range(5)]
+    assert "Page 3 of 3" in html
+
+
+def test_search_past_page_100(client, app):
+    add_posts(app, 102)
+    titles = []
+
+    for page in (100, 101, 102):
+        html = client.get(f"/?q=post&per_page=1&page={page}").data.decode()
+        titles.extend(re.findall(r"<h1><a href=/\d+>(.*?)</a></h1>", html))
+
+    assert len(set(titles)) == 3
+    assert "Page 102 of 102" in html
+    assert ">Next<" not in html
+
+
+class CallCounter:
+    """Counts the execute and executemany calls made on a connection."""
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = 0
+
+    def execute(self, *args):
+        self.calls += 1
+        return self.db.execute(*args)
+
+    def executemany(self, *args):
+        self.calls += 1
+        return self.db.executemany(*args)
+
+
+def test_save_tags_statement_count(app):
+    with app.app_context():
+        db = CallCounter(get_db())
+        save_tags(db, 1, ", ".join(f"tag{i}" for i in range(50)))
+        # current tags, insert missing tags returning ids, link them
+        assert db.calls == 3
+
+        tags = get_db().execute("SELECT count(*) FROM post_tag WHERE post_id = 1")
+        assert tags.fetchone()[0] == 50
+
+
+def test_save_tags_writes_difference(app):
+    with app.app_context():
+        db = get_db()
+        save_tags(db, 1, "a, b, c")
+        db.commit()
+
+        counter = CallCounter(db)
+        save_tags(counter, 1, "c, b, a")
+        # the tags are unchanged, nothing is written
+        assert counter.calls == 1
+
+        save_tags(db, 1, "a, d")
+        names = {
+            row[0]
+            for row in db.execute(
+                "SELECT t.name FROM post_tag pt JOIN tag t ON pt.tag_id = t.id"
+                " WHERE pt.post_id = 1"
+            )
+        }
+        assert names == {"a", "d"}
+
+        save_tags(db, 1, "")
+        assert db.execute("SELECT count(*) FROM post_tag").fetchone()[0] == 0
+
+
+def test_get_tag_ids(app):
+    with app.app_context():
+        db = get_db()
+        created = get_tag_ids(db, {"a", "b"})
+        db.rollback()
+        # the rolled back ids are not reused
+        ids = get_tag_ids(db, {"a", "b", "c"})
+        db.commit()
+        assert ids == get_tag_ids(db, {"a", "b", "c"})
+        assert ids == dict(db.execute("SELECT name, id FROM tag").fetchall())
+        assert created.keys() == {"a", "b"}
+
+
+def test_tag_deleted_by_other_app(app):
+    # another worker process with the same database
+    other = create_app(dict(app.config))
+
+    with app.app_context():
+        db = get_db()
+        save_tags(db, 1, "x")
+        db.commit()
+        # seen twice, a cache of ids would hold "x" now
+        get_tag_ids(db, {"x"})
+        db.commit()
+
+    with other.app_context():
+        db = get_db()
+        save_tags(db, 1, "")
+        db.commit()
+        assert db.execute("SELECT count(*) FROM tag").fetchone()[0] == 0
+
+    with app.app_context():
+        db = get_db()
+        save_tags(db, 1, "x")
+        db.commit()
+        names = db.execute(
+            "SELECT t.name FROM post_tag pt JOIN tag t ON pt.tag_id = t.id"
+            " WHERE pt.post_id = 1"
+        )
+        assert [tuple(row) for row in names] == [("x",)]
+
+    shutdown(other)
+
+
+def test_like_and_comment_counts(client, auth, app):
+    auth.login()
+    client.post("/1/like")
+    client.post("/1/like")
+    client.post("/1/comment", data={"body": "first"})
+    client.post("/1/comment", data={"body": "second"})
+
+    with app.app_context():
+        post = get_db().execute("SELECT * FROM post WHERE id = 1").fetchone()
+        assert post["like_count"] == 1
+        assert post["comment_count"] == 2
+
+    response = client.get("/1")
+    assert b"1 Likes" in response.data
+    assert b"Unlike" in response.data
+    assert b"Comments (2)" in response.data
+
+    client.post("/1/unlike")
+    response = client.get("/1")
+    assert b"0 Likes" in response.data
+    assert b">Like</button>" in response.data
+
+
+def test_detail_queries(client, auth, app):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    auth.login()
+    client.get("/1")
+    # logged in pages are rendered every time
+    statements.clear()
+    client.get("/1")
+
+    # the post with its tags and liked state, then the comments
+    post_reads = [sql for sql in statements if "FROM post p" in sql]
+    assert len(post_reads) == 1
+    assert "EXISTS" in post_reads[0]
+    assert not [sql for sql in statements if "COUNT(" in sql.upper()]
+
+
+def test_comment_pagination(client, app):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO comment (user_id, post_id, body, created)"
+            " VALUES (1, 1, ?, datetime('2019-01-01', ?))",
+            [(f"comment {i:02}", f"+{i} minutes") for i in range(25)],
+        )
+        db.commit()
+
+    html = client.get("/1").data.decode()
+    assert "Comments (25)" in html
+    assert "comment 24" in html
+    assert "comment 05" in html
+    assert "comment 04" not in html
+
+    older = unescape(re.search(r'<a href="([^"]*)">Older comments</a>', html).group(1))
+    html = client.get(older).data.decode()
+    assert "comment 04" in html
+    assert "comment 00" in html
+    assert "comment 05" not in html
+    assert "Older comments" not in html
+
+
+def test_detail_missing(client):
+    assert client.get("/5").status_code == 404
@@ -0,0 +1,115 @@
+import pytest
+
+from flaskr import create_app
+from flaskr.cache import Cache
+from flaskr.cache import DiskCache
+from flaskr.cache import _MISSING
+from flaskr.cache import get_cache
+from flaskr.cache import memoize
+from flaskr.cache import sizeof
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("flaskr.cache.time.monotonic", lambda: now[0])
+    return now
+
+
+def test_ttl(clock):
+    cache = Cache(10000)
+    cache.set("a", 1, 5)
+    assert cache.get("a") == 1
+
+    clock[0] = 5
+    assert cache.get("a") is _MISSING
+    # a TTL of 0 stores nothing
+    cache.set("b", 1, 0)
+    assert cache.get("b") is _MISSING
+    assert cache.stats()["expirations"] == 1
+
+
+def test_size_bound():
+    cache = Cache(sizeof("x" * 100) * 2)
+    cache.set("a", "x" * 100, 60)
+    cache.set("b", "x" * 100, 60)
+    # "a" is used more recently, so "b" goes
+    cache.get("a")
+    cache.set("c", "x" * 100, 60)
+    assert cache.get("b") is _MISSING
+    assert cache.get("a") == cache.get("c") == "x" * 100
+    # too big for the whole cache
+    cache.set("d", "x" * 1000, 60)
+    assert cache.get("d") is _MISSING
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["entries"] == 2
+    assert stats["size"] <= cache.max_bytes
+
+
+def test_invalidate():
+    cache = Cache(10000)
+    cache.set("a", 1, 60, ("post:1",))
+    cache.set("b", 2, 60, ("post:1", "post:2"))
+    cache.set("c", 3, 60, ("post:2",))
+    cache.invalidate("post:1")
+    assert cache.get("a") is cache.get("b") is _MISSING
+    assert cache.get("c") == 3
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_disk_tier(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    # two processes sharing the file
+    first = Cache(10000, DiskCache(path, 100))
+    second = Cache(10000, DiskCache(path, 100))
+
+    first.set(("f", (1,)), {"title": "a"}, 60, ("post:1",))
+    assert second.get(("f", (1,))) == {"title": "a"}
+    assert second.stats()["disk_hits"] == 1
+    # found in memory now
+    assert second.get(("f", (1,))) == {"title": "a"}
+    assert second.stats()["hits"] == 1
+
+    # invalidated in the file, and in memory of the process doing it
+    second.invalidate("post:1")
+    assert second.get(("f", (1,))) is _MISSING
+    third = Cache(10000, DiskCache(path, 100))
+    assert third.get(("f", (1,))) is _MISSING
+
+
+def test_memoize(app):
+    calls = []
+
+    @memoize("SEARCH_COUNT_TTL", tags=lambda id: [f"post:{id}"])
+    def load(id):
+        calls.append(id)
+        return id * 2
+
+    with app.app_context():
+        assert load(1) == load(1) == 2
+        assert calls == [1]
+
+        app.config["SEARCH_COUNT_TTL"] = 0
+        assert load(1) == 2
+        assert load.uncached(1) == 2
+        assert calls == [1, 1, 1]
+
+
+def test_disk_file_per_database(app, tmp_path):
+    app.config["CACHE_FOLDER"] = str(tmp_path)
+    other = create_app({**app.config, "DATABASE": str(tmp_path / "other.sqlite")})
+
+    with app.app_context():
+        get_cache().set("key", "mine", 60)
+
+    # shares the folder, not the results
+    with other.app_context():
+        assert get_cache().get("key") is _MISSING
+
+    # a new process of the same database finds them
+    del app.extensions["flaskr.cache"]
+
+    with app.app_context():
+        assert get_cache().get("key") == "mine"
@@ -1,8 +1,17 @@
+import io
+import re
 import sqlite3
+import threading
+import time
 
 import pytest
 
+from flaskr.db import ConnectionPool
+from flaskr.db import PoolTimeout
 from flaskr.db import get_db
+from flaskr.db import get_migrations
+from flaskr.db import get_pool
+from flaskr.db import migrate_db
 
 
 def test_get_close_db(app):
@@ -10,12 +19,68 @@ def test_get_close_db(app):
         db = get_db()
         assert db is get_db()
 
+    # the connection went back to the pool and is handed out again
+    assert get_pool_stats(app)["idle"] == 1
+
+    with app.app_context():
+        assert get_db() is db
+        db.execute("SELECT 1")
+
+    with app.app_context():
+        get_pool().close()
+
     with pytest.raises(sqlite3.ProgrammingError) as e:
         db.execute("SELECT 1")
 
     assert "closed" in str(e.value)
 
 
+def get_pool_stats(app):
+    with app.app_context():
+        return get_pool().stats()
+
+
+def test_pragmas(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+        assert db.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+
+
+def test_release_rolls_back(app):
+    with app.app_context():
+        get_db().execute("DELETE FROM post")
+
+    with app.app_context():
+        assert get_db().execute("SELECT count(*) FROM post").fetchone()[0] == 1
+
+
+def test_pool_waits_for_release(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "pool.sqlite"), size=1, timeout=5)
+    db = pool.acquire()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(pool.acquire()))
+    thread.start()
+    time.sleep(0.05)
+    pool.release(db)
+    thread.join()
+
+    assert result == [db]
+    stats = pool.stats()
+    assert stats["open"] == 1
+    assert stats["in_use"] == 1
+    assert stats["waits"] == 1
+    assert stats["wait_time"] > 0
+
+    pool.timeout = 0.01
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+
+    pool.release(db)
+    pool.close()
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder:
         called = False
@@ -27,3 +92,101 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_migrate_existing_database(app):
+    with app.app_context():
+        db = get_db()
+        # a database created before migrations existed
+        db.execute("PRAGMA foreign_keys = OFF")
+        with app.open_resource("schema.sql") as f:
+            db.executescript(f.read().decode("utf8"))
+        db.execute("PRAGMA foreign_keys = ON")
+        db.execute("INSERT INTO user (username, password) VALUES ('old', 'x')")
+        db.commit()
+
+        applied = migrate_db()
+        assert applied == [version for version, _ in get_migrations()]
+        assert db.execute("PRAGMA user_version").fetchone()[0] == applied[-1]
+        indexes = {
+            row[0]
+            for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        }
+        assert {"post_created_id", "comment_post_id", "post_tag_tag_id"} <= indexes
+        # nothing was dropped
+        assert db.execute("SELECT count(*) FROM user").fetchone()[0] == 1
+
+        # already up to date
+        assert migrate_db() == []
+
+
+def test_migrate_db_command(app, runner):
+    with app.app_context():
+        result = runner.invoke(args=["migrate-db"])
+    assert "up to date" in result.output
+
+
+def test_failed_migration_keeps_version(app, monkeypatch):
+    with app.app_context():
+        db = get_db()
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        monkeypatch.setattr(
+            "flaskr.db.get_migrations", lambda: [(version + 1, "broken.sql")]
+        )
+        monkeypatch.setattr(
+            app,
+            "open_resource",
+            lambda name: io.BytesIO(b"CREATE TABLE broken (id);\nNOT SQL;"),
+        )
+
+        with pytest.raises(sqlite3.Error):
+            migrate_db()
+
+        assert db.execute("PRAGMA user_version").fetchone()[0] == version
+        assert (
+            db.execute("SELECT 1 FROM sqlite_master WHERE name = 'broken'").fetchone()
+            is None
+        )
+
+
+def full_scans(db, sql):
+    """Tables an SQL statement reads without using an index."""
+    plan = db.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row["detail"] for row in plan if re.fullmatch(r"SCAN \w+", row["detail"])]
+
+
+def test_route_queries_use_indexes(app, client, auth):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO tag (name) VALUES ('t')")
+        db.execute("INSERT INTO post_tag (post_id, tag_id) VALUES (1, 1)")
+        db.execute("INSERT INTO comment (user_id, post_id, body) VALUES (1, 1, 'c')")
+        db.execute("INSERT INTO user_like (user_id, post_id) VALUES (1, 1)")
+        db.commit()
+
+    auth.login()
+    for path in (
+        "/",
+        "/?tag=t",
+        "/?q=test",
+        "/?q=test&tag=t",
+        "/?after=2018-01-02+00:00:00,5",
+        "/?before=2017-01-01+00:00:00,5",
+        "/1",
+        "/feed",
+    ):
+        assert client.get(path).status_code == 200
+
+    selects = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT")]
+    assert selects
+
+    with app.app_context():
+        db = get_db()
+        for sql in selects:
+            assert not full_scans(db, sql), sql
@@ -1,3 +1,9 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
 from flaskr import create_app
 
 
@@ -10,3 +16,49 @@ def test_config():
 def test_hello(client):
     response = client.get("/hello")
     assert response.data == b"this is my first flask app. good start!!!! endpoint is hello"
+
+
+# seconds flaskr's own modules may take to import, see python -X importtime
+IMPORT_BUDGET = 0.15
+# loaded on first use, not by create_app
+LAZY_MODULES = ("markdown", "pygments", "PIL")
+
+
+def run_create_app(tmp_path):
+    """Create an app in a new interpreter.
+
+    :return: the modules of ``LAZY_MODULES`` it loaded, and the
+        ``-X importtime`` report
+    """
+    script = (
+        "import sys\n"
+        "from flaskr import create_app\n"
+        f"create_app({{'DATABASE': {str(tmp_path / 'db')!r}}})\n"
+        f"print(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(__file__)),
+    )
+    return result.stdout.strip(), result.stderr
+
+
+def test_lazy_imports(tmp_path):
+    loaded, _ = run_create_app(tmp_path)
+    assert loaded == "[]"
+
+
+# wall clock time, too noisy to run on every machine
+@pytest.mark.benchmark
+def test_import_time(tmp_path):
+    _, report = run_create_app(tmp_path)
+    # "import time: self [us] | cumulative | name", self time of flaskr.*
+    own = sum(
+        int(line.split("|")[0].split(":")[1])
+        for line in report.splitlines()
+        if line.split("|")[-1].strip().startswith("flaskr")
+    )
+    assert own / 1e6 < IMPORT_BUDGET
@@ -0,0 +1,98 @@
+import gzip
+
+from flask import template_rendered
+
+from flaskr.db import get_db
+
+
+def test_feed(client):
+    response = client.get("/feed")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/xml"
+    assert b"<title>test title</title>" in response.data
+
+    etag = response.headers["ETag"]
+    response = client.get("/feed", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_feed_gzip(client):
+    plain = client.get("/feed").data
+    response = client.get("/feed", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(response.data) == plain
+
+
+def test_feed_built_on_write(client, auth, app):
+    rendered = []
+    template_rendered.connect(
+        lambda sender, template, context, **extra: rendered.append(template.name),
+        app,
+        weak=False,
+    )
+    etag = client.get("/feed").headers["ETag"]
+    assert rendered == ["blog/feed.xml"]
+
+    auth.login()
+    client.post("/create", data={"title": "fresh post", "body": ""})
+    assert rendered.count("blog/feed.xml") == 2
+
+    # fetching serves the stored document
+    response = client.get("/feed", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"fresh post" in response.data
+    assert rendered.count("blog/feed.xml") == 2
+
+    client.get("/1/delete")
+    assert b"test title" not in client.get("/feed").data
+
+
+def test_tag_feed(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "tagged", "body": "", "tags": "news"})
+    response = client.get("/feed?tag=news")
+    assert b"tagged" in response.data
+    assert b"test title" not in response.data
+    assert b"- news</title>" in response.data
+
+    client.post("/1/update", data={"title": "now tagged", "body": "", "tags": "news"})
+    assert b"now tagged" in client.get("/feed?tag=news").data
+
+
+
+def test_unknown_tag_feed(client, app):
+    assert client.get("/feed?tag=missing").status_code == 404
+
+    with app.app_context():
+        rows = get_db().execute("SELECT count(*) FROM feed WHERE tag = 'missing'")
+        assert rows.fetchone()[0] == 0
+
+
+def test_feed_item_count(client, app):
+    app.config["FEED_ITEM_COUNT"] = 2
+
+    with app.app_context():
+        db = get_db()
+        for title in ("a", "b", "c"):
+            db.execute(
+                "INSERT INTO post (title, body, author_id) VALUES (?, '', 1)", (title,)
+            )
+        db.commit()
+
+    assert client.get("/feed").data.count(b"<item>") == 2
+
+
+def test_feed_links_use_server_name(client, app):
+    app.config.update(SERVER_NAME="blog.example.com", PREFERRED_URL_SCHEME="https")
+    # the post is written through an internal address
+    internal = "http://internal:8000"
+    client.post(
+        "/auth/login", data={"username": "test", "password": "test"}, base_url=internal
+    )
+    client.post("/create", data={"title": "fresh post", "body": ""}, base_url=internal)
+
+    data = client.get("/feed", base_url="http://other").data
+    assert b"<link>https://blog.example.com/2</link>" in data
+    assert b"internal" not in data
+    assert b"other" not in data
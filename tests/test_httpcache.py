@@ -0,0 +1,111 @@
+from flask import template_rendered
+
+from flaskr.db import get_db
+from flaskr.httpcache import ResponseCache
+
+
+def record_renders(app):
+    rendered = []
+    template_rendered.connect(
+        lambda sender, template, context, **extra: rendered.append(template.name),
+        app,
+        weak=False,
+    )
+    return rendered
+
+
+def test_validators(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+    assert "no-cache" in response.headers["Cache-Control"]
+
+    etag = response.headers["ETag"]
+    last_modified = response.headers["Last-Modified"]
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    response = client.get("/", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+
+
+def test_304_does_not_render(client, app):
+    rendered = record_renders(app)
+    etag = client.get("/1").headers["ETag"]
+    assert rendered == ["blog/detail.html"]
+
+    assert client.get("/1", headers={"If-None-Match": etag}).status_code == 304
+    assert rendered == ["blog/detail.html"]
+
+
+def test_anonymous_pages_are_cached(client, app):
+    rendered = record_renders(app)
+    first = client.get("/")
+    second = client.get("/")
+    assert rendered == ["blog/index.html"]
+    assert second.data == first.data
+    assert second.headers["ETag"] == first.headers["ETag"]
+
+    # other query strings are other pages
+    client.get("/?per_page=2")
+    assert len(rendered) == 2
+
+
+def test_writes_change_validators(client, auth, app):
+    index_etag = client.get("/").headers["ETag"]
+    detail_etag = client.get("/1").headers["ETag"]
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO comment (user_id, post_id, body) VALUES (1, 1, 'hi')")
+        db.commit()
+
+    # comments only show on the detail page
+    assert client.get("/", headers={"If-None-Match": index_etag}).status_code == 304
+    response = client.get("/1", headers={"If-None-Match": detail_etag})
+    assert response.status_code == 200
+    assert b"hi" in response.data
+
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": ""})
+    auth.logout()
+    response = client.get("/", headers={"If-None-Match": index_etag})
+    assert response.status_code == 200
+    assert b"updated" in response.data
+
+
+def test_logged_in_pages(client, auth, app):
+    anonymous = client.get("/").headers["ETag"]
+    auth.login()
+    rendered = record_renders(app)
+    response = client.get("/")
+    assert response.headers["ETag"] != anonymous
+    assert "private" in response.headers["Cache-Control"]
+    assert b"Log Out" in response.data
+
+    # rendered every time, but still validated
+    client.get("/")
+    assert len(rendered) == 2
+    assert client.get("/", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_missing_post_is_not_cached(client):
+    assert client.get("/5").status_code == 404
+    assert "ETag" not in client.get("/5").headers
+
+
+def test_response_cache_size():
+    cache = ResponseCache(max_bytes=10)
+    cache.set("a", (b"12345", 200, []))
+    cache.set("b", (b"12345", 200, []))
+    cache.get("a")
+    cache.set("c", (b"1", 200, []))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.size == 6
+
+    # too large to ever fit
+    cache.set("d", (b"x" * 11, 200, []))
+    assert cache.get("d") is None
@@ -0,0 +1,114 @@
+import io
+import os
+import threading
+
+import pytest
+from PIL import Image
+
+from flaskr import images
+from flaskr.db import get_db
+from flaskr.images import get_image_queue
+from flaskr.storage import folder_path
+
+
+def png(width=1600, height=1200, color="red"):
+    data = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(data, "PNG")
+    data.seek(0)
+    return data
+
+
+def get_post(app, id):
+    with app.app_context():
+        return get_db().execute("SELECT * FROM post WHERE id = ?", (id,)).fetchone()
+
+
+def join_queue(app):
+    with app.app_context():
+        get_image_queue().join()
+
+
+def test_create_makes_variants(client, auth, app):
+    auth.login()
+    client.post(
+        "/create",
+        data={"title": "pic", "body": "", "image": (png(), "photo.png")},
+    )
+    join_queue(app)
+
+    post = get_post(app, 2)
+    stem = post["image_path"][: -len(".png")]
+    assert post["thumb_path"] == f"{stem}.thumb.png"
+    assert post["webp_path"] == f"{stem}.thumb.webp"
+
+    with app.app_context():
+        with Image.open(folder_path(post["image_path"])) as original:
+            assert original.size == (1600, 1200)
+        with Image.open(folder_path(post["thumb_path"])) as thumb:
+            assert thumb.size == (533, 400)
+        with Image.open(folder_path(post["webp_path"])) as webp:
+            assert webp.format == "WEBP"
+
+    html = client.get("/").data.decode()
+    assert f'srcset="/static/{stem}.thumb.webp"' in html
+    assert f'src="/static/{stem}.thumb.png"' in html
+
+
+def test_request_does_not_wait(client, auth, app, monkeypatch):
+    release = threading.Event()
+    original = images.make_variants
+
+    def slow_variants(image_path, size):
+        release.wait(5)
+        return original(image_path, size)
+
+    monkeypatch.setattr(images, "make_variants", slow_variants)
+    auth.login()
+    response = client.post(
+        "/create", data={"title": "pic", "body": "", "image": (png(), "slow.png")}
+    )
+    assert response.status_code == 302
+    # the index shows the original until the thumbnail is ready
+    post = get_post(app, 2)
+    assert post["thumb_path"] is None
+    assert f'src="/static/{post["image_path"]}"'.encode() in client.get("/").data
+
+    release.set()
+    join_queue(app)
+    assert get_post(app, 2)["thumb_path"] is not None
+
+
+def test_update_replaces_variants(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "pic", "body": "", "image": (png(), "a.png")})
+    join_queue(app)
+    first = get_post(app, 2)
+    client.post(
+        "/2/update",
+        data={"title": "pic", "body": "", "image": (png(color="blue"), "b.png")},
+    )
+    join_queue(app)
+
+    post = get_post(app, 2)
+    assert post["image_path"] != first["image_path"]
+    assert post["thumb_path"] == post["image_path"].replace(".png", ".thumb.png")
+
+
+@pytest.mark.parametrize("no_pillow", (False, True))
+def test_unprocessable_images(client, auth, app, monkeypatch, no_pillow):
+    if no_pillow:
+        monkeypatch.setattr(images, "Image", None)
+        data = png()
+    else:
+        data = io.BytesIO(b"not an image")
+
+    auth.login()
+    client.post("/create", data={"title": "pic", "body": "", "image": (data, "x.png")})
+    join_queue(app)
+
+    post = get_post(app, 2)
+    assert post["image_path"].endswith(".png")
+    assert post["thumb_path"] is None
+
+    with app.app_context():
+        assert os.path.exists(folder_path(post["image_path"]))
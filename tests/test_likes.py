@@ -0,0 +1,163 @@
+import json
+import os
+
+import pytest
+
+from flaskr.db import get_db
+from flaskr.likes import LikeBuffer
+from flaskr.likes import get_like_buffer
+
+
+@pytest.fixture
+def buffer(app):
+    # only flush when the test asks for it
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+
+    with app.app_context():
+        yield get_like_buffer()
+
+
+def count_likes(post_id=1):
+    return get_db().execute(
+        "SELECT count(*) FROM user_like WHERE post_id = ?", (post_id,)
+    ).fetchone()[0]
+
+
+def test_like_json(client, auth, app):
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+    assert client.post("/1/like.json").status_code == 401
+
+    auth.login()
+    assert client.post("/1/like.json").json == {
+        "post_id": 1,
+        "liked": True,
+        "like_count": 1,
+    }
+    # liking twice is not counted twice
+    assert client.post("/1/like.json").json["like_count"] == 1
+    assert client.delete("/1/like.json").json == {
+        "post_id": 1,
+        "liked": False,
+        "like_count": 0,
+    }
+    assert client.post("/2/like.json").status_code == 404
+
+
+def test_detail_shows_buffered_likes(client, auth, app):
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+    auth.login()
+    client.post("/1/like.json")
+
+    with app.app_context():
+        assert count_likes() == 0
+
+    response = client.get("/1")
+    assert b"1 Likes" in response.data
+    assert b">Unlike</button>" in response.data
+
+
+def test_buffered_likes_skip_validation(client, auth, app):
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+    auth.login()
+    etag = client.get("/1").headers["ETag"]
+    client.post("/1/like.json")
+
+    # the page changed before the post's version does
+    response = client.get("/1", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"1 Likes" in response.data
+
+    with app.app_context():
+        get_like_buffer().flush()
+
+    assert client.get("/1", headers={"If-None-Match": etag}).status_code == 200
+    etag = client.get("/1").headers["ETag"]
+    assert client.get("/1", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_coalesce(buffer):
+    buffer.add(1, 1, True)
+    buffer.add(1, 1, False)
+    assert buffer.add(1, 1, True) == (True, 1)
+    buffer.add(2, 1, True)
+    assert buffer.pending_delta(1) == 2
+
+    assert buffer.flush() == 2
+    assert count_likes() == 2
+    assert buffer.pending_delta(1) == 0
+    assert buffer.like_count(1) == 2
+
+    # an unlike that is undone before the flush writes nothing
+    buffer.add(1, 1, False)
+    buffer.add(1, 1, True)
+    assert buffer.pending_delta(1) == 0
+
+
+def test_flush_deleted_post(buffer):
+    buffer.add(1, 1, True)
+    db = get_db()
+    db.execute("DELETE FROM post WHERE id = 1")
+    db.commit()
+
+    buffer.flush()
+    assert count_likes() == 0
+
+
+def test_discard(client, auth, app):
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+    auth.login()
+    client.post("/1/like.json")
+    # the form post supersedes the buffered like
+    client.post("/1/unlike")
+
+    with app.app_context():
+        buffer = get_like_buffer()
+        assert buffer.pending_liked(1, 1) is None
+        assert buffer.pending_delta(1) == 0
+        buffer.flush()
+        assert count_likes() == 0
+
+
+def test_recover(app):
+    app.config["LIKE_FLUSH_INTERVAL"] = 60
+    # events buffered when a process died, the last one cut short
+    journal = app.config["DATABASE"] + "-likes.1234-0.journal"
+
+    with open(journal, "w") as f:
+        f.write(json.dumps([1, 1, True]) + "\n")
+        f.write(json.dumps([2, 1, True]) + "\n")
+        f.write('[2, 1, fa')
+
+    buffer = LikeBuffer(app)
+
+    with app.app_context():
+        assert count_likes() == 2
+
+    assert not os.path.exists(journal)
+    buffer.close()
+
+
+def test_recover_skips_live_journals(buffer, app):
+    buffer.add(1, 1, True)
+    # e.g. another worker process starting
+    other = LikeBuffer(app)
+    other.close()
+
+    assert os.path.exists(buffer.journal_path)
+    assert count_likes() == 0
+    buffer.flush()
+    assert count_likes() == 1
+
+
+def test_journal_written_before_flush(buffer, app):
+    buffer.add(1, 1, True)
+
+    with open(buffer.journal_path) as f:
+        assert [json.loads(line) for line in f] == [[1, 1, True]]
+
+    buffer.flush()
+    # a new buffer has nothing left to replay
+    other = LikeBuffer(app)
+    assert not other.pending_delta(1)
+    other.close()
+    assert count_likes() == 1
@@ -0,0 +1,102 @@
+import os
+
+import pytest
+from flask import g
+
+from flaskr import create_app
+from flaskr import metrics
+from flaskr.db import TimedConnection
+from flaskr.db import get_db
+from flaskr.db import get_pool
+
+
+@pytest.fixture
+def instrumented(app, tmp_path):
+    """The test app with instrumentation turned on."""
+    app.config.update(INSTRUMENTATION=True, PROFILE_FOLDER=str(tmp_path))
+
+    # the fixture's pool was opened with plain connections
+    with app.app_context():
+        get_pool().close()
+
+    del app.extensions["flaskr.db_pool"]
+    metrics.init_app(app)
+    return app
+
+
+def test_disabled(client):
+    response = client.get("/")
+    assert "Server-Timing" not in response.headers
+    assert client.get("/metrics").status_code == 404
+
+
+def test_timed_queries(instrumented):
+    with instrumented.test_request_context():
+        db = get_db()
+        assert isinstance(db, TimedConnection)
+        db.execute("SELECT * FROM user").fetchall()
+        db.execute("UPDATE post SET title = 'x'")
+
+        for _ in db.execute("SELECT id FROM post"):
+            pass
+
+        assert [q.rows for q in g.queries[-3:]] == [2, 1, 1]
+        assert metrics.request_timings()["sql"][1] == len(g.queries)
+
+
+def test_server_timing(instrumented):
+    with instrumented.app_context():
+        db = get_db()
+        # a body not rendered by an earlier test
+        db.execute("UPDATE post SET body = ? WHERE id = 1", (str(os.urandom(8)),))
+        db.commit()
+
+    response = instrumented.test_client().get("/1")
+    timing = response.headers["Server-Timing"]
+    assert "sql;dur=" in timing
+    assert "template;dur=" in timing
+    assert "markdown;dur=" in timing
+    assert "total;dur=" in timing
+
+
+def test_metrics_endpoint(instrumented):
+    client = instrumented.test_client()
+    client.get("/")
+    client.get("/")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'flaskr_requests_total{method="GET",endpoint="blog.index",status="200"} 2' in body
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 2' in body
+    assert 'flaskr_part_calls_total{endpoint="blog.index",part="sql"}' in body
+    assert 'flaskr_db_connections{state="open"}' in body
+    assert 'flaskr_cache_lookups_total{result="miss"}' in body
+    assert "flaskr_cache_bytes " in body
+
+
+def test_streamed_request(instrumented):
+    client = instrumented.test_client()
+    response = client.get("/?per_page=50")
+    assert "Content-Length" not in response.headers
+    assert "Server-Timing" not in response.headers
+    response.close()
+
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'flaskr_request_duration_seconds_count{endpoint="blog.index"} 1' in body
+    # rendered and queried while the body was sent
+    assert 'flaskr_part_calls_total{endpoint="blog.index",part="template"} 1' in body
+    assert 'flaskr_part_calls_total{endpoint="blog.index",part="sql"}' in body
+
+
+def test_profile_slow_requests(instrumented, tmp_path):
+    instrumented.config.update(PROFILE_SAMPLE_RATE=1.0, PROFILE_SLOW_SECONDS=0)
+    instrumented.test_client().get("/")
+    (name,) = os.listdir(tmp_path)
+    assert "blog.index" in name
+    assert name.endswith(".prof")
+    # the lock is released for the next sampled request
+    assert not metrics._profile_lock.locked()
+
+
+def test_config_enables_instrumentation(tmp_path):
+    app = create_app({"TESTING": True, "INSTRUMENTATION": True, "DATABASE": str(tmp_path / "db")})
+    assert "flaskr.metrics" in app.extensions
+    assert any(rule.rule == "/metrics" for rule in app.url_map.iter_rules())
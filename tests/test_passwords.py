@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+from werkzeug.security import check_password_hash
+
+from flaskr import shutdown
+from flaskr.auth import get_user
+from flaskr.db import get_db
+from flaskr.passwords import Hasher
+from flaskr.passwords import get_hasher
+from flaskr.ratelimit import RateLimiter
+
+
+def stored_hash(app, username="test"):
+    with app.app_context():
+        return (
+            get_db()
+            .execute("SELECT password FROM user WHERE username = ?", (username,))
+            .fetchone()[0]
+        )
+
+
+def test_rehash_on_login(app, auth):
+    old = stored_hash(app)
+    app.config["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+    assert auth.login().headers["Location"] == "/"
+
+    new = stored_hash(app)
+    assert new.startswith("pbkdf2:sha256:1000$")
+    assert check_password_hash(new, "test")
+
+    with app.app_context():
+        # the cached row has the new hash as well
+        assert get_user(1)["password"] == new
+
+    # a failed login changes nothing, a later one has nothing to do
+    auth.login(password="wrong")
+    auth.login()
+    assert stored_hash(app) == new
+    assert old != new
+
+
+def test_register_uses_method(app, client):
+    client.post("/auth/register", data={"username": "abc", "password": "a"})
+    assert stored_hash(app, "abc").startswith("pbkdf2:sha256:50000$")
+
+
+def test_busy(app, auth, monkeypatch):
+    app.config["PASSWORD_HASH_QUEUE"] = 1
+    entered = threading.Event()
+    release = threading.Event()
+
+    with app.app_context():
+        hasher = get_hasher()
+
+    def slow_check(pwhash, password, method):
+        entered.set()
+        release.wait()
+        return False, None
+
+    monkeypatch.setattr("flaskr.passwords._check", slow_check)
+    thread = threading.Thread(target=hasher.check, args=("x", "y"))
+    thread.start()
+    entered.wait()
+
+    try:
+        response = auth.login()
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert b"busy" in response.data
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_login_rate_limit(app, auth):
+    app.config["LOGIN_RATE_LIMITS"] = {"username": (2, 60), "ip": (3, 60)}
+    auth.login(password="wrong")
+    auth.login(password="wrong")
+
+    response = auth.login()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "30"
+    assert b"Too many login attempts" in response.data
+
+    # another username, until the address runs out too
+    assert auth.login("other", "other").status_code == 302
+    assert auth.login("other", "other").status_code == 429
+
+
+def test_rate_limiter(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr("flaskr.ratelimit.time.monotonic", lambda: now[0])
+    limiter = RateLimiter(2, 10, max_buckets=2)
+
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(5)
+
+    now[0] = 5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("b") == 0
+
+    # the full bucket of "b" is dropped to make room
+    now[0] = 100
+    limiter.acquire("a")
+    limiter.acquire("a")
+    assert limiter.acquire("c") == 0
+    assert set(limiter._buckets) == {"a", "c"}
+
+
+def test_process_pool():
+    hasher = Hasher("pbkdf2:sha256:1000", processes=1, queue=4)
+
+    try:
+        pwhash = hasher.hash("secret")
+        assert check_password_hash(pwhash, "secret")
+        assert hasher.check(pwhash, "secret") == (True, None)
+        assert hasher.check(pwhash, "wrong") == (False, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_shutdown(app):
+    app.config["PASSWORD_HASH_PROCESSES"] = 1
+
+    with app.app_context():
+        hasher = get_hasher()
+
+    shutdown(app)
+    assert "flaskr.hasher" not in app.extensions
+
+    with pytest.raises(RuntimeError):
+        hasher.hash("secret")
@@ -0,0 +1,24 @@
+import gc
+import sys
+
+from flaskr.preload import warm_up
+from flaskr.render import body_hash
+from flaskr.render import html_cache
+
+
+def test_warm_up(app):
+    warm_up(app, freeze=False)
+
+    assert "markdown" in sys.modules
+    assert "blog/index.html" in {name for _, name in app.jinja_env.cache}
+    assert html_cache.get((1, body_hash("test\nbody"))) is not None
+    # workers open their own connections
+    assert "flaskr.db_pool" not in app.extensions
+
+
+def test_warm_up_freezes(app):
+    try:
+        warm_up(app)
+        assert gc.get_freeze_count()
+    finally:
+        gc.unfreeze()
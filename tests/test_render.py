@@ -0,0 +1,166 @@
+import markdown
+import pytest
+
+from flaskr import render
+from flaskr.db import get_db
+
+
+@pytest.fixture(autouse=True)
+def clear_html_cache():
+    render.html_cache.clear()
+    yield
+    render.html_cache.clear()
+
+
+def count_renders(monkeypatch):
+    calls = []
+    original = render.render_markdown
+
+    def recording(text):
+        calls.append(text)
+        return original(text)
+
+    monkeypatch.setattr(render, "render_markdown", recording)
+    return calls
+
+
+def test_render_markdown():
+    assert render.render_markdown(None) == ""
+    assert render.render_markdown("**a**") == "<p><strong>a</strong></p>"
+    # the per thread instance is reset between documents
+    assert render.render_markdown("*b*") == "<p><em>b</em></p>"
+    # same output as a freshly built pipeline
+    text = "```python\nprint(1)\n```"
+    assert render.render_markdown(text) == markdown.markdown(
+        text,
+        extensions=render.MARKDOWN_EXTENSIONS,
+        extension_configs=render.MARKDOWN_EXTENSION_CONFIGS,
+    )
+
+
+def test_create_stores_html(client, auth, app):
+    auth.login()
+    client.post("/create", data={"title": "created", "body": "**bold**"})
+
+    with app.app_context():
+        row = get_db().execute("SELECT * FROM post_html WHERE post_id = 2").fetchone()
+        assert row["body_hash"] == render.body_hash("**bold**")
+        assert row["body_html"] == "<p><strong>bold</strong></p>"
+
+
+def test_update_refreshes_html(client, auth, app):
+    auth.login()
+    client.post("/1/update", data={"title": "updated", "body": "*new*"})
+
+    with app.app_context():
+        row = get_db().execute("SELECT * FROM post_html WHERE post_id = 1").fetchone()
+        assert row["body_html"] == "<p><em>new</em></p>"
+
+
+def test_reads_do_not_write(client, app, monkeypatch):
+    calls = count_renders(monkeypatch)
+
+    # the test post was inserted without going through create
+    assert b"test<br />\nbody" in client.get("/1").data
+    assert len(calls) == 2
+
+    with app.app_context():
+        row = get_db().execute("SELECT * FROM post_html WHERE post_id = 1").fetchone()
+        assert row is None
+
+    # later reads come from the cache
+    client.get("/1")
+    client.get("/")
+    client.get("/feed")
+    assert len(calls) == 2
+
+
+def test_render_posts_command(client, app, runner, monkeypatch):
+    add_posts(app, ["*a*"])
+
+    with app.app_context():
+        result = runner.invoke(args=["render-posts"])
+        assert "Rendered 2 posts." in result.output
+        assert get_db().execute("SELECT count(*) FROM post_html").fetchone()[0] == 2
+        # nothing is left to do
+        assert "Rendered 0 posts." in runner.invoke(args=["render-posts"]).output
+
+    # a cold process finds the html in the database
+    calls = count_renders(monkeypatch)
+    render.html_cache.clear()
+    client.get("/1")
+    assert calls == []
+
+
+def test_stale_html_is_rendered_again(client, app, monkeypatch):
+    client.get("/1")
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE post SET body = 'changed' WHERE id = 1")
+        db.commit()
+
+    calls = count_renders(monkeypatch)
+    assert b"<p>changed</p>" in client.get("/1").data
+    assert len(calls) == 2
+
+
+def test_delete_removes_html(client, auth, app):
+    client.get("/1")
+    auth.login()
+    client.get("/1/delete")
+
+    with app.app_context():
+        row = get_db().execute("SELECT * FROM post_html WHERE post_id = 1").fetchone()
+        assert row is None
+
+
+def add_posts(app, bodies):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            "INSERT INTO post (title, body, author_id) VALUES ('t', ?, 1)",
+            [(body,) for body in bodies],
+        )
+        db.commit()
+
+
+def test_prerender_batches(app, monkeypatch):
+    add_posts(app, ["*a*", "*b*", "*c*"])
+
+    with app.app_context():
+        db = get_db()
+        posts = db.execute("SELECT id, body FROM post").fetchall()
+        render.store_post_html(db, posts[0]["id"], posts[0]["body"])
+        db.commit()
+        render.html_cache.clear()
+
+        calls = count_renders(monkeypatch)
+        statements = []
+        db.set_trace_callback(statements.append)
+        render.prerender(db, posts)
+        db.set_trace_callback(None)
+
+        # one read of the stored html, the 3 others rendered
+        assert sum("FROM post_html" in s for s in statements) == 1
+        assert len(calls) == 6
+
+        for post in posts:
+            render.get_post_html(post)
+
+        assert len(calls) == 6
+        # only what was stored before
+        assert db.execute("SELECT count(*) FROM post_html").fetchone()[0] == 1
+
+
+def test_prerender_in_processes(app):
+    app.config["RENDER_PROCESSES"] = 2
+    add_posts(app, ["**x**", "# y"])
+
+    with app.app_context():
+        db = get_db()
+        posts = db.execute("SELECT id, body FROM post").fetchall()
+        render.prerender(db, posts)
+        assert "flaskr.render_pool" in app.extensions
+        assert render.get_post_html(posts[1])[0] == "<p><strong>x</strong></p>"
+        assert render.get_post_html(posts[2])[0] == render.render_markdown("# y")
@@ -0,0 +1,140 @@
+import time
+
+from flask import session
+
+from flaskr import create_app
+from flaskr import shutdown
+from flaskr.auth import invalidate_user
+from flaskr.db import get_db
+from flaskr.sessions import get_session_cache
+from flaskr.sessions import revoke_sessions
+from flaskr.sessions import session_key
+from flaskr.sessions import sweep_sessions
+
+
+def session_rows(app):
+    with app.app_context():
+        return get_db().execute("SELECT * FROM session").fetchall()
+
+
+def session_cookie(client):
+    return client.get_cookie("session").value
+
+
+def test_login_stores_session(client, auth, app):
+    # anonymous visits store nothing
+    client.get("/")
+    assert session_rows(app) == []
+    assert client.get_cookie("session") is None
+
+    auth.login()
+    token = session_cookie(client)
+    (row,) = session_rows(app)
+    # only the hash of the cookie is stored
+    assert row["id"] == session_key(token)
+    assert row["user_id"] == 1
+    assert token not in row["data"]
+
+    with client:
+        client.get("/")
+        assert session["user_id"] == 1
+
+    auth.logout()
+    assert session_rows(app) == []
+    assert client.get_cookie("session") is None
+
+
+def test_login_renews_id(client, auth, app):
+    with client.session_transaction() as sess:
+        sess["planted"] = True
+
+    planted = session_cookie(client)
+    auth.login()
+    assert session_cookie(client) != planted
+    assert [row["id"] for row in session_rows(app)] == [session_key(session_cookie(client))]
+
+
+def test_unknown_session(client, auth):
+    client.set_cookie("session", "forged")
+
+    with client:
+        client.get("/")
+        assert "user_id" not in session
+
+
+def test_user_from_session(client, auth, app):
+    statements = []
+
+    @app.before_request
+    def trace_queries():
+        get_db().set_trace_callback(statements.append)
+
+    auth.login()
+    del statements[:]
+
+    with app.app_context():
+        get_session_cache().clear()
+
+    # the session row has the user, no query for it
+    response = client.get("/")
+    assert b"test" in response.data
+    assert not [sql for sql in statements if sql.startswith("SELECT * FROM user")]
+    # and the session comes from memory after it was read once
+    del statements[:]
+    client.get("/")
+    assert not [sql for sql in statements if "FROM session" in sql]
+
+    with app.app_context():
+        get_db().execute("UPDATE user SET alias = 'tester' WHERE id = 1")
+        invalidate_user(1)
+
+    del statements[:]
+    client.get("/")
+    assert [sql for sql in statements if sql.startswith("SELECT * FROM user")]
+    assert "tester" in session_rows(app)[0]["user"]
+
+
+def test_revoke_sessions(client, auth, app):
+    auth.login()
+
+    with app.app_context():
+        revoke_sessions(1)
+
+    assert session_rows(app) == []
+
+    with client:
+        client.get("/")
+        assert "user_id" not in session
+
+
+def test_expired_session(client, auth, app):
+    auth.login()
+
+    with app.app_context():
+        get_db().execute("UPDATE session SET expires = 0")
+        get_db().commit()
+        get_session_cache().clear()
+
+    with client:
+        client.get("/")
+        assert "user_id" not in session
+
+    with app.app_context():
+        # the login swept a moment ago
+        assert sweep_sessions() is None
+        assert sweep_sessions(int(time.time()) + app.config["SESSION_SWEEP_INTERVAL"]) == 1
+
+    assert session_rows(app) == []
+
+
+def test_cookie_backend(app):
+    cookie_app = create_app({**app.config, "SESSION_BACKEND": "cookie"})
+    client = cookie_app.test_client()
+    client.post("/auth/login", data={"username": "test", "password": "test"})
+
+    with client:
+        client.get("/")
+        assert session["user_id"] == 1
+
+    shutdown(cookie_app)
+    assert session_rows(app) == []
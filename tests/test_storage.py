@@ -0,0 +1,135 @@
+import hashlib
+import io
+import os
+
+from flaskr.db import get_db
+from flaskr.storage import collect_garbage
+from flaskr.storage import folder_path
+from flaskr.storage import store_upload
+
+
+class ChunkRecorder(io.BytesIO):
+    """Records the size of every read."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def make_old(app, image_path):
+    with app.app_context():
+        path = folder_path(image_path)
+    os.utime(path, (0, 0))
+    return path
+
+
+def test_store_upload(app):
+    data = b"x" * 200_000
+    digest = hashlib.sha256(data).hexdigest()
+    stream = ChunkRecorder(data)
+
+    with app.app_context():
+        image_path = store_upload(stream, "PNG")
+        assert image_path == f"uploads/{digest[:2]}/{digest[2:4]}/{digest}.png"
+
+        with open(folder_path(image_path), "rb") as f:
+            assert f.read() == data
+
+    # read in chunks, never the whole file at once
+    assert -1 not in stream.reads
+    assert len(stream.reads) > 1
+    # no temporary files are left behind
+    assert not [
+        name for name in os.listdir(app.config["UPLOAD_FOLDER"]) if name.startswith(".")
+    ]
+
+
+def test_identical_uploads_are_stored_once(client, auth, app):
+    auth.login()
+    for title in ("a", "b"):
+        client.post(
+            "/create",
+            data={"title": title, "body": "", "image": (io.BytesIO(b"same"), "image.png")},
+        )
+
+    with app.app_context():
+        paths = [
+            row[0]
+            for row in get_db().execute(
+                "SELECT image_path FROM post WHERE image_path IS NOT NULL"
+            )
+        ]
+
+    assert len(paths) == 2
+    assert paths[0] == paths[1]
+
+
+def create_with_image(client, data):
+    client.post(
+        "/create",
+        data={"title": "pic", "body": "", "image": (io.BytesIO(data), "image.png")},
+    )
+
+
+def test_release_on_delete(client, auth, app):
+    auth.login()
+    create_with_image(client, b"shared")
+    create_with_image(client, b"shared")
+
+    with app.app_context():
+        image_path = get_db().execute("SELECT image_path FROM post WHERE id = 2").fetchone()[0]
+
+    path = make_old(app, image_path)
+    client.get("/2/delete")
+    # still used by post 3
+    assert os.path.exists(path)
+
+    client.get("/3/delete")
+    assert not os.path.exists(path)
+
+
+def test_recent_files_are_kept(client, auth, app):
+    auth.login()
+    create_with_image(client, b"fresh")
+
+    with app.app_context():
+        image_path = get_db().execute("SELECT image_path FROM post WHERE id = 2").fetchone()[0]
+        path = folder_path(image_path)
+
+    client.get("/2/delete")
+    assert os.path.exists(path)
+
+    # the sweep picks it up once it is old enough
+    make_old(app, image_path)
+    with app.app_context():
+        assert collect_garbage(get_db()) == [image_path]
+    assert not os.path.exists(path)
+
+
+def test_cleanup_uploads_command(app, runner):
+    with app.app_context():
+        used = store_upload(io.BytesIO(b"used"), "png")
+        unused = store_upload(io.BytesIO(b"unused"), "png")
+        db = get_db()
+        db.execute("UPDATE post SET image_path = ? WHERE id = 1", (used,))
+        db.commit()
+
+    make_old(app, used)
+    unused_path = make_old(app, unused)
+    # files outside the sharded layout are not managed
+    legacy = os.path.join(app.config["UPLOAD_FOLDER"], "legacy.png")
+    open(legacy, "wb").close()
+    os.utime(legacy, (0, 0))
+
+    with app.app_context():
+        result = runner.invoke(args=["cleanup-uploads"])
+
+    assert "Deleted 1 unused images." in result.output
+    assert not os.path.exists(unused_path)
+    assert os.path.exists(legacy)
+    with app.app_context():
+        assert os.path.exists(folder_path(used))
@@ -0,0 +1,79 @@
+import os
+
+from flask import url_for
+
+from flaskr import create_app
+from flaskr import templating
+from flaskr.templating import cached_url_for
+
+
+def test_cached_url_for(app):
+    with app.test_request_context():
+        for endpoint, values in [
+            ("blog.index", {"tag": "news"}),
+            ("blog.index", {"tag": None}),
+            ("blog.detail", {"id": 1}),
+            ("blog.detail", {"id": 1, "_external": True}),
+            ("static", {"filename": "style.css"}),
+        ]:
+            assert cached_url_for(endpoint, **values) == url_for(endpoint, **values)
+            assert cached_url_for(endpoint, **values) == url_for(endpoint, **values)
+
+    # a different root is a different URL
+    with app.test_request_context("/", base_url="http://localhost/blog"):
+        assert cached_url_for("blog.detail", id=1) == "/blog/1"
+
+
+def test_url_for_built_once(client, monkeypatch):
+    calls = []
+
+    def counting_url_for(endpoint, **values):
+        calls.append(endpoint)
+        return url_for(endpoint, **values)
+
+    monkeypatch.setattr(templating, "url_for", counting_url_for)
+    client.get("/1")
+    first = len(calls)
+    assert first
+
+    client.get("/1?comments_after=x")
+    # only the link to older comments is new, and there are none here
+    assert len(calls) == first
+
+
+def test_bytecode_cache(tmp_path, monkeypatch):
+    config = {
+        "TESTING": True,
+        "DATABASE": str(tmp_path / "db"),
+        "TEMPLATE_CACHE_FOLDER": str(tmp_path / "jinja"),
+    }
+    app = create_app(config)
+    # made on the first write
+    assert not os.path.exists(tmp_path / "jinja")
+
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=["compile-templates"])
+
+    names = templating.compile_templates(app)
+    assert f"Compiled {len(names)} templates" in result.output
+    assert "blog/index.html" in names
+    assert len(os.listdir(tmp_path / "jinja")) == len(names)
+
+    # a new worker loads the compiled code instead of compiling
+    app = create_app(config)
+    compiled = []
+    compile = app.jinja_env.compile
+    monkeypatch.setattr(
+        app.jinja_env, "compile", lambda *args, **kwargs: compiled.append(args)
+        or compile(*args, **kwargs)
+    )
+    app.jinja_env.get_template("blog/index.html")
+    assert compiled == []
+
+
+def test_compile_templates_without_folder(app, runner):
+    with app.app_context():
+        result = runner.invoke(args=["compile-templates"])
+
+    assert result.exit_code == 1
+    assert "TEMPLATE_CACHE_FOLDER" in result.output
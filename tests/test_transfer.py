@@ -0,0 +1,156 @@
+import json
+from collections import defaultdict
+
+import pytest
+
+from flaskr.db import get_db
+from flaskr.db import migrate_db
+from flaskr.transfer import InvalidRecord
+from flaskr.transfer import deferred_indexes
+from flaskr.transfer import export_records
+from flaskr.transfer import import_batch
+from flaskr.transfer import import_records
+from flaskr.transfer import read_records
+
+
+def schema_objects(db):
+    return db.execute(
+        "SELECT type, name, sql FROM sqlite_master"
+        " WHERE type IN ('index', 'trigger') ORDER BY name"
+    ).fetchall()
+
+
+def post_lines(count, author="test"):
+    for i in range(count):
+        yield json.dumps(
+            {
+                "type": "post",
+                "author": author,
+                "title": f"imported {i}",
+                "body": "searchable",
+                "tags": ["bulk", f"tag{i % 3}"],
+                "comments": [{"author": "other", "body": "nice"}],
+                "likes": [{"user": "other"}],
+            }
+        )
+
+
+def test_export(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO comment (user_id, post_id, body) VALUES (2, 1, 'hi')")
+        db.execute("INSERT INTO user_like (user_id, post_id) VALUES (2, 1)")
+        db.commit()
+        records = list(export_records(db))
+
+    assert [r["type"] for r in records] == ["user", "user", "post"]
+    post = records[2]
+    assert post["author"] == "test"
+    assert post["created"] == "2018-01-01 00:00:00"
+    assert post["comments"][0]["author"] == "other"
+    assert post["likes"][0]["user"] == "other"
+
+
+def test_round_trip(app):
+    with app.app_context():
+        db = get_db()
+        lines = [json.dumps(r) for r in export_records(db)]
+        lines.extend(post_lines(5))
+        lines.append(json.dumps({"type": "user", "username": "new", "password": "x"}))
+        before = schema_objects(db)
+
+        counts = import_records(db, read_records(lines), batch_size=2)
+        assert counts["posts"] == 6
+        assert counts["comments"] == 5
+        assert counts["likes"] == 5
+        # the users already exist and are left alone
+        assert db.execute("SELECT count(*) FROM user").fetchone()[0] == 3
+        assert counts["users"] == 1
+
+        # indexes and triggers are back, and what they maintain is right
+        assert schema_objects(db) == before
+        assert db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()[0] == 7
+        assert db.execute(
+            "SELECT s.post_count FROM tag_stats s JOIN tag t ON t.id = s.tag_id"
+            " WHERE t.name = 'bulk'"
+        ).fetchone()[0] == 5
+        assert tuple(db.execute(
+            "SELECT like_count, comment_count FROM post WHERE title = 'imported 0'"
+        ).fetchone()) == (1, 1)
+        assert db.execute(
+            "SELECT count(*) FROM post_fts WHERE post_fts MATCH 'searchable'"
+        ).fetchone()[0] == 5
+
+        # triggers work again for later writes
+        db.execute("INSERT INTO post (title, body, author_id) VALUES ('x', '', 1)")
+        assert db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()[0] == 8
+
+
+def test_import_unknown_user(app):
+    with app.app_context():
+        db = get_db()
+        before = schema_objects(db)
+        lines = list(post_lines(2)) + list(post_lines(1, author="nobody"))
+
+        with pytest.raises(InvalidRecord, match="Line 3"):
+            import_records(db, read_records(lines), batch_size=2)
+
+        # the first batch stays, the failed one is rolled back
+        assert db.execute("SELECT count(*) FROM post").fetchone()[0] == 3
+        assert db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()[0] == 3
+        assert schema_objects(db) == before
+
+
+def test_import_died(app):
+    with app.app_context():
+        db = get_db()
+        before = schema_objects(db)
+        # the process dies after the first batch, nothing restores
+        deferred = deferred_indexes.__wrapped__(db)
+        next(deferred)
+        import_batch(db, list(read_records(post_lines(2))), defaultdict(int))
+
+        assert schema_objects(db) != before
+        assert db.execute("SELECT count(*) FROM deferred_schema").fetchone()[0]
+
+        migrate_db()
+        assert schema_objects(db) == before
+        assert db.execute("SELECT count(*) FROM deferred_schema").fetchone()[0] == 0
+        assert db.execute("SELECT value FROM counter WHERE name = 'post'").fetchone()[0] == 3
+        assert db.execute(
+            "SELECT count(*) FROM post_fts WHERE post_fts MATCH 'searchable'"
+        ).fetchone()[0] == 2
+        deferred.close()
+
+
+def test_read_records_invalid():
+    with pytest.raises(InvalidRecord, match="Line 2"):
+        list(read_records(['{"type": "user"}', "{"]))
+
+    with pytest.raises(InvalidRecord, match="Line 1"):
+        list(read_records(['{"type": "comment"}']))
+
+
+def test_commands(runner, app, tmp_path):
+    path = tmp_path / "posts.jsonl"
+
+    with app.app_context():
+        result = runner.invoke(args=["export-posts", str(path)])
+
+    assert "Exported 3 records" in result.output
+
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM post")
+        db.commit()
+
+        result = runner.invoke(args=["import-posts", str(path)])
+        assert "Imported 1 posts" in result.output
+        assert "rows/s" in result.output
+        assert get_db().execute("SELECT title FROM post").fetchone()[0] == "test title"
+
+        path.write_text('{"type": "post", "author": "nobody", "title": "t"}\n')
+        result = runner.invoke(args=["import-posts", str(path)])
+
+    assert result.exit_code == 1
+    assert "Line 1" in result.output